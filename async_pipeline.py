@@ -0,0 +1,144 @@
+"""Asyncio-native variant of the RAG pipeline in rag_core.py.
+
+Retrieval goes through Qdrant's AsyncQdrantClient and generation through the
+LLM's async completion methods, with the same backoff, deadline and circuit
+breakers as the sync path (see resilience.py), so many I/O-bound chat requests
+can share one event loop. CPU-bound embedding runs in a worker thread. The
+pipeline logic itself lives in rag_core and is shared with the sync path:
+abuild_prompt() carries out rag_core.prompt_steps(), the retrieval decisions
+of build_prompt(), with the async clients, and astream_pipeline() follows the
+same rag_core.StreamRetries policy as stream_pipeline().
+"""
+import asyncio
+import inspect
+import os
+
+from rag_core import (COLLECTION_NAME, RETRIEVAL_ENGINE, GENERATION_FAILED_MESSAGE, StreamRetries,
+                      initialize_models, embed_query, lexical_search, fuse_with_lexical, llm_timeout, prompt_steps)
+from resilience import acall_with_resilience
+from metrics import count_fallback, stage
+from search_params import current_search_params
+
+_models = None
+_models_lock = None
+
+
+async def initialize_async_models(load_models=initialize_models):
+    """Load (once per process) the embedding model, LLM and an async Qdrant client.
+
+    load_models is called in a worker thread; the backend passes its background
+    loader's wait(), so this shares the startup load instead of starting another.
+    """
+    global _models, _models_lock
+    if _models is not None:
+        return _models
+    if _models_lock is None:
+        _models_lock = asyncio.Lock()
+    async with _models_lock:
+        if _models is None:
+            embed_model, llm, client = await asyncio.to_thread(load_models)
+            if RETRIEVAL_ENGINE != "local":
+                import qdrant_client
+
+                client = qdrant_client.AsyncQdrantClient(
+                    url=os.getenv("QDRANT_URL"),
+                    api_key=os.getenv("QDRANT_API_KEY"),
+                    prefer_grpc=True
+                )
+            _models = (embed_model, llm, client)
+    return _models
+
+
+async def aembed_query(query, embed_model):
+    """embed_query() off the event loop; the embedding itself is CPU-bound."""
+    return await asyncio.to_thread(embed_query, query, embed_model)
+
+
+async def asearch(query, client, embed_model, k=5, query_embedding=None):
+    if query_embedding is None:
+        query_embedding = await aembed_query(query, embed_model)
+    if query_embedding is None:
+        return lexical_search(query, k)
+
+    search_params = current_search_params()
+
+    async def query_points(remaining):
+        result = client.query_points(
+            collection_name=COLLECTION_NAME,
+            query=query_embedding,
+            limit=k,
+            search_params=search_params,
+            timeout=max(1, int(remaining)) if remaining is not None else None
+        )
+        # The in-process index answers synchronously; AsyncQdrantClient returns a coroutine
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    try:
+        with stage('vector_search'):
+            results = await acall_with_resilience(query_points, 'vector_search', "Vector database query")
+    except Exception as e:
+        print(f"Failed to query vector database, using lexical fallback: {e}")
+        return lexical_search(query, k)
+    return fuse_with_lexical(query, results, k)
+
+
+async def abuild_prompt(query, embed_model, client, query_embedding=None, conversation=None, question=None):
+    """rag_core.build_prompt() with the async clients: carries out prompt_steps()'s requests."""
+    handlers = {
+        'embed': lambda text: aembed_query(text, embed_model),
+        'search': lambda text, embedding: asearch(text, client, embed_model, query_embedding=embedding),
+    }
+    steps = prompt_steps(query, conversation, query_embedding, question)
+    result, error = None, None
+    while True:
+        try:
+            kind, *args = steps.throw(error) if error is not None else steps.send(result)
+        except StopIteration as done:
+            return done.value
+        try:
+            result, error = await handlers[kind](*args), None
+        except Exception as e:
+            result, error = None, e
+
+
+async def apipeline(query, embed_model, llm, client, query_embedding=None, conversation=None,
+                    question=None):
+    formatted_template = await abuild_prompt(query, embed_model, client, query_embedding=query_embedding,
+                                             conversation=conversation, question=question)
+
+    try:
+        with stage('llm'):
+            return await acall_with_resilience(
+                lambda remaining: llm.acomplete(formatted_template, **llm_timeout(remaining)), 'llm', "LLM generation")
+    except Exception as e:
+        print(f"LLM generation failed: {e}")
+        count_fallback('generation_failed')
+        return GENERATION_FAILED_MESSAGE
+
+
+async def astream_pipeline(query, embed_model, llm, client, query_embedding=None, conversation=None,
+                           question=None):
+    """Async generator of raw LLM text deltas; see rag_core.stream_pipeline()."""
+    formatted_template = await abuild_prompt(query, embed_model, client, query_embedding=query_embedding,
+                                             conversation=conversation, question=question)
+
+    retries = StreamRetries()
+    for remaining in retries:
+        try:
+            async for chunk in await llm.astream_complete(formatted_template, **llm_timeout(remaining)):
+                if chunk.delta:
+                    retries.token()
+                    yield chunk.delta
+            retries.succeeded()
+            return
+        except GeneratorExit:
+            retries.abandoned()
+            raise
+        except Exception as e:
+            delay = retries.failed(e)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+    yield retries.fallback()
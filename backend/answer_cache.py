@@ -0,0 +1,247 @@
+"""Semantic answer cache for /api/chat.
+
+Questions are matched by cosine similarity of their query embedding (the same
+vector `rag_core.search()` uses for retrieval), scoped to the response language.
+A hit returns the stored (thinking, answer) without calling the LLM.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import numpy as np
+
+ANSWER_CACHE_BACKEND = os.getenv("ANSWER_CACHE_BACKEND", "memory").lower()  # memory | mongo | off
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2048"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "86400"))  # seconds
+
+
+def _normalize(embedding):
+    vector = np.asarray(embedding, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        return vector
+    return vector / norm
+
+
+class InMemoryAnswerBackend:
+    """Bounded in-process store with LRU and TTL eviction, one bucket per language."""
+
+    def __init__(self, max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._buckets = {}    # language -> OrderedDict(entry_id -> entry), oldest first
+        self._matrices = {}   # language -> (entry_ids, stacked unit vectors), rebuilt lazily
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self._buckets.values())
+
+    def _invalidate(self, language):
+        self._matrices.pop(language, None)
+
+    def _matrix(self, language):
+        cached = self._matrices.get(language)
+        if cached is None:
+            bucket = self._buckets.get(language) or {}
+            ids = list(bucket.keys())
+            if ids:
+                matrix = np.stack([bucket[entry_id]['embedding'] for entry_id in ids])
+            else:
+                matrix = np.empty((0, 0), dtype=np.float32)
+            cached = (ids, matrix)
+            self._matrices[language] = cached
+        return cached
+
+    def _expire(self, language, now):
+        bucket = self._buckets.get(language)
+        if not bucket or not self.ttl:
+            return []
+        expired = [entry_id for entry_id, entry in bucket.items() if now - entry['created_at'] > self.ttl]
+        for entry_id in expired:
+            del bucket[entry_id]
+        if expired:
+            self._invalidate(language)
+        return expired
+
+    def find(self, embedding, language):
+        """Return (entry, score) for the most similar cached question, or (None, 0.0)."""
+        with self._lock:
+            expired = self._expire(language, time.time())
+            ids, matrix = self._matrix(language)
+            if not ids or matrix.shape[1] != embedding.shape[0]:
+                entry, score = None, 0.0
+            else:
+                scores = matrix @ embedding
+                best = int(np.argmax(scores))
+                entry, score = self._buckets[language][ids[best]], float(scores[best])
+        self._on_evict(expired)
+        return entry, score
+
+    def touch(self, entry):
+        with self._lock:
+            bucket = self._buckets.get(entry['language'])
+            if bucket and entry['_id'] in bucket:
+                bucket.move_to_end(entry['_id'])
+                entry['hits'] += 1
+
+    def add(self, entry):
+        with self._lock:
+            bucket = self._buckets.setdefault(entry['language'], OrderedDict())
+            bucket[entry['_id']] = entry
+            self._invalidate(entry['language'])
+            evicted = []
+            while len(self) > self.max_entries:
+                # Evict the least recently used entry of the largest bucket
+                language = max(self._buckets, key=lambda lang: len(self._buckets[lang]))
+                evicted_id, _ = self._buckets[language].popitem(last=False)
+                self._invalidate(language)
+                evicted.append(evicted_id)
+        self._on_evict(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+            self._matrices.clear()
+
+    def _on_evict(self, entry_ids):
+        """Hook for persistent subclasses; called after the lock is released, so it may do I/O."""
+
+
+class MongoAnswerBackend(InMemoryAnswerBackend):
+    """In-process index backed by a Mongo collection as the persistent tier.
+
+    Lookups are served from memory; new entries are written through and the
+    collection is read back on startup so cached answers survive restarts.
+    Expiry is delegated to a Mongo TTL index on `created_at`.
+    """
+
+    def __init__(self, collection, max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL):
+        super().__init__(max_entries=max_entries, ttl=ttl)
+        self.collection = collection
+        try:
+            if ttl:
+                collection.create_index('created_at', expireAfterSeconds=ttl)
+            self._load()
+        except Exception as e:
+            print(f"⚠️ Could not load answer cache from MongoDB: {e}")
+
+    def _load(self):
+        cursor = self.collection.find({}).sort('created_at', -1).limit(self.max_entries)
+        docs = list(cursor)
+        for doc in reversed(docs):
+            created_at = doc['created_at']
+            if isinstance(created_at, datetime):
+                created_at = created_at.replace(tzinfo=timezone.utc).timestamp()
+            entry = {
+                '_id': doc['_id'],
+                'language': doc['language'],
+                'prompt': doc.get('prompt', ''),
+                'thinking': doc.get('thinking', ''),
+                'answer': doc['answer'],
+                'embedding': _normalize(doc['embedding']),
+                'created_at': created_at,
+                'hits': doc.get('hits', 0),
+            }
+            super().add(entry)
+        print(f"✅ Loaded {len(docs)} cached answers from MongoDB")
+
+    def add(self, entry):
+        super().add(entry)
+        try:
+            self.collection.insert_one({
+                '_id': entry['_id'],
+                'language': entry['language'],
+                'prompt': entry['prompt'],
+                'thinking': entry['thinking'],
+                'answer': entry['answer'],
+                'embedding': entry['embedding'].tolist(),
+                # TTL indexes only work on BSON dates
+                'created_at': datetime.fromtimestamp(entry['created_at'], tz=timezone.utc),
+                'hits': 0,
+            })
+        except Exception as e:
+            print(f"⚠️ Failed to persist cached answer: {e}")
+
+    def clear(self):
+        super().clear()
+        try:
+            self.collection.delete_many({})
+        except Exception as e:
+            print(f"⚠️ Failed to clear persisted answer cache: {e}")
+
+    def _on_evict(self, entry_ids):
+        if not entry_ids:
+            return
+        try:
+            self.collection.delete_many({'_id': {'$in': list(entry_ids)}})
+        except Exception as e:
+            print(f"⚠️ Failed to evict persisted answers: {e}")
+
+
+class SemanticAnswerCache:
+    """Front for an answer backend that applies the similarity threshold and counts hits."""
+
+    def __init__(self, backend, threshold=ANSWER_CACHE_THRESHOLD):
+        self.backend = backend
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, embedding, language):
+        """Return (thinking, answer) for a close enough cached question, or None."""
+        if embedding is None:
+            return None
+        entry, score = self.backend.find(_normalize(embedding), language)
+        hit = entry is not None and score >= self.threshold
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not hit:
+            return None
+        self.backend.touch(entry)
+        print(f"⚡ Answer cache hit (similarity {score:.3f}) for: {entry['prompt'][:60]}")
+        return entry['thinking'], entry['answer']
+
+    def store(self, embedding, language, prompt, thinking, answer):
+        if embedding is None or not answer:
+            return
+        self.backend.add({
+            '_id': uuid.uuid4().hex,
+            'language': language,
+            'prompt': prompt,
+            'thinking': thinking,
+            'answer': answer,
+            'embedding': _normalize(embedding),
+            'created_at': time.time(),
+            'hits': 0,
+        })
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': len(self.backend),
+            'max_entries': self.backend.max_entries,
+            'threshold': self.threshold,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+def create_answer_cache(db=None):
+    """Build the cache configured by ANSWER_CACHE_BACKEND, or None when disabled."""
+    if ANSWER_CACHE_BACKEND == 'off':
+        return None
+    if ANSWER_CACHE_BACKEND == 'mongo' and db is not None:
+        backend = MongoAnswerBackend(db['answer_cache'])
+    else:
+        backend = InMemoryAnswerBackend()
+    return SemanticAnswerCache(backend)
@@ -0,0 +1,208 @@
+"""ASGI entry point: async chat routes in front of the Flask API.
+
+/api/chat and /api/chat/stream run on the event loop using the async pipeline,
+so concurrent questions waiting on Qdrant or Groq don't each hold a thread.
+Every other route is served by the existing Flask app through a WSGI adapter.
+
+Run with:
+    cd backend
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from backend_integration import (app as flask_app, answer_cache, answer_normalizer, build_language_prompt,
+                                 load_conversation, model_loader, postprocess_answer, save_chat, sse_event,
+                                 stream_events, user_id_from_headers)
+from rag_core import ThinkingAnswerSplitter, extract_thinking_and_answer, used_fallback, verse_index
+from async_pipeline import initialize_async_models, aembed_query, apipeline, astream_pipeline
+from model_warmup import ModelsNotReady
+from resilience import deadline_scope
+from search_params import DEFAULT_SEARCH, parse_search_params, search_scope
+from metrics import begin_request, finish_request, stage
+
+STARTING_UP = 'The assistant is still starting up, please try again shortly'
+
+
+async def read_chat_request(request):
+    """The chat fields of the JSON body; raises ValueError, fit for the client, for anything but an object."""
+    try:
+        data = await request.json()
+    except ValueError:  # json.JSONDecodeError, or a body that isn't UTF-8
+        raise ValueError('Request body must be valid JSON')
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object')
+    return (data.get('prompt'), data.get('language', 'english'), user_id_from_headers(request.headers),
+            data.get('chat_id'), data.get('search_params'))
+
+
+async def read_conversation(chat_id, user_id, search):
+    """load_conversation() off the event loop, with whether the answer cache applies."""
+    conversation = await asyncio.to_thread(load_conversation, chat_id, user_id)
+    use_cache = (conversation is not None and answer_cache is not None and not conversation.is_follow_up
+                 and search == DEFAULT_SEARCH)
+    return conversation, use_cache
+
+
+async def chat(request):
+    try:
+        prompt, language, user_id, chat_id, search_overrides = await read_chat_request(request)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    if not prompt:
+        return JSONResponse({'error': 'No prompt provided'}, status_code=400)
+    try:
+        search = parse_search_params(search_overrides)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    try:
+        conversation, use_cache = await read_conversation(chat_id, user_id, search)
+        if conversation is None:
+            return JSONResponse({'error': 'Conversation not found'}, status_code=404)
+        embed_model, llm, client = await initialize_async_models(model_loader.wait)
+        modified_prompt = build_language_prompt(prompt, language)
+
+        with deadline_scope(), search_scope(search):
+            query_embedding = None
+            if not verse_index.find_references(modified_prompt):
+                query_embedding = await aembed_query(modified_prompt, embed_model)
+            cached = await asyncio.to_thread(answer_cache.lookup, query_embedding, language) if use_cache else None
+            if cached:
+                thinking, answer = cached
+            else:
+                full_response = await apipeline(modified_prompt, embed_model, llm, client,
+                                                query_embedding=query_embedding, conversation=conversation,
+                                                question=prompt)
+                with stage('parse_answer'):
+                    thinking, answer = extract_thinking_and_answer(full_response)
+                thinking, answer = postprocess_answer(thinking, answer, language)
+                if use_cache and not used_fallback():
+                    await asyncio.to_thread(answer_cache.store, query_embedding, language, prompt, thinking, answer)
+
+        chat_id = await asyncio.to_thread(save_chat, user_id, prompt, answer, conversation)
+        return JSONResponse({'response': answer, 'thinking': thinking, 'chat_id': chat_id})
+    except ModelsNotReady as e:
+        print(f"⏳ Async /api/chat before the models were ready: {e}")
+        return JSONResponse({'error': STARTING_UP}, status_code=503)
+    except Exception as e:
+        print("Error in async /api/chat:", e)
+        return JSONResponse({'error': 'Internal server error'}, status_code=500)
+
+
+async def chat_stream(request):
+    try:
+        prompt, language, user_id, chat_id, search_overrides = await read_chat_request(request)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    if not prompt:
+        return JSONResponse({'error': 'No prompt provided'}, status_code=400)
+    try:
+        search = parse_search_params(search_overrides)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    conversation, use_cache = await read_conversation(chat_id, user_id, search)
+    if conversation is None:
+        return JSONResponse({'error': 'Conversation not found'}, status_code=404)
+
+    async def generate():
+        with deadline_scope(), search_scope(search):
+            async for event in generate_events():
+                yield event
+
+    async def generate_events():
+        try:
+            embed_model, llm, client = await initialize_async_models(model_loader.wait)
+            modified_prompt = build_language_prompt(prompt, language)
+            query_embedding = None
+            if not verse_index.find_references(modified_prompt):
+                query_embedding = await aembed_query(modified_prompt, embed_model)
+            cached = await asyncio.to_thread(answer_cache.lookup, query_embedding, language) if use_cache else None
+            if cached:
+                thinking, answer = cached
+                yield sse_event('answer', {'text': answer})
+            else:
+                splitter = ThinkingAnswerSplitter()
+                normalizer = answer_normalizer(language)
+                async for delta in astream_pipeline(modified_prompt, embed_model, llm, client,
+                                                    query_embedding=query_embedding, conversation=conversation,
+                                                    question=prompt):
+                    for kind, text in stream_events(splitter.feed(delta), normalizer):
+                        yield sse_event(kind, {'text': text})
+                for kind, text in stream_events(splitter.close(), normalizer):
+                    yield sse_event(kind, {'text': text})
+
+                cacheable = not used_fallback()
+                if normalizer is not None:
+                    with stage('hindi_postprocess'):
+                        thinking, answer = '', normalizer.finish()
+                else:
+                    thinking, answer = postprocess_answer(splitter.thinking, splitter.answer, language)
+                if use_cache and cacheable:
+                    await asyncio.to_thread(answer_cache.store, query_embedding, language, prompt, thinking, answer)
+
+            saved_id = await asyncio.to_thread(save_chat, user_id, prompt, answer, conversation)
+            yield sse_event('done', {'response': answer, 'thinking': thinking, 'chat_id': saved_id})
+        except ModelsNotReady as e:
+            print(f"⏳ Async /api/chat/stream before the models were ready: {e}")
+            yield sse_event('error', {'error': STARTING_UP})
+        except Exception as e:
+            print("Error in async /api/chat/stream:", e)
+            yield sse_event('error', {'error': 'Internal server error'})
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+class RequestTraceMiddleware:
+    """Request id header, request metrics and the request log line for the async routes.
+
+    Requests passed on to Flask are traced by its own hooks instead.
+    """
+
+    def __init__(self, app, paths):
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] not in self.paths:
+            return await self.app(scope, receive, send)
+        incoming = dict(scope['headers']).get(b'x-request-id')
+        trace = begin_request(incoming.decode('latin-1') if incoming else None)
+        status = 500
+
+        async def send_with_request_id(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                message['headers'] = list(message.get('headers', [])) + [(b'x-request-id', trace.request_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            finish_request(trace, scope['method'], scope['path'], status)
+
+
+app = Starlette(
+    routes=[
+        Route('/api/chat', chat, methods=['POST']),
+        Route('/api/chat/stream', chat_stream, methods=['POST']),
+        Mount('/', WSGIMiddleware(flask_app)),
+    ],
+    # Same open policy as CORS(app) on the Flask side, applied to the async routes too
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'],
+                   expose_headers=['X-Next-Cursor', 'X-Request-ID']),
+        Middleware(RequestTraceMiddleware, paths=['/api/chat', '/api/chat/stream']),
+    ],
+)
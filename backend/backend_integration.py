@@ -1,7 +1,8 @@
 import os
 import json
 import time
-from flask import Flask, request, jsonify
+import base64
+from flask import Flask, request, jsonify, Response, g, stream_with_context
 from flask_cors import CORS
 import threading
 import subprocess
@@ -9,9 +10,6 @@ import sys
 from dotenv import load_dotenv
 import pymongo
 from bson import ObjectId
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 
 # Load environment variables from .env file
 load_dotenv()
@@ -31,6 +29,11 @@ db = client["bhagavad_gita_assistant"]  # Remove spaces from database name
 users_collection = db['users']
 chat_history_collection = db['chat_history']
 
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "100"))
+# Only what the history list shows; full messages come from /api/history/<chat_id>
+HISTORY_SUMMARY_FIELDS = {'_id': 1, 'title': 1, 'date': 1, 'created_at': 1}
+
 # Test MongoDB connection
 try:
     client.admin.command('ping')
@@ -42,7 +45,7 @@ except Exception as e:
     raise e
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Next-Cursor', 'X-Request-ID'])
 
 # --- Add this after app = Flask(__name__) and CORS(app) ---
 
@@ -61,118 +64,238 @@ def ping():
     }), 200
 
 
+@app.route("/health", methods=["GET"])
+def health():
+    # Circuit breaker state per RAG dependency; open breakers mean degraded answers, not downtime
+    states = breaker_states()
+    degraded = any(state['state'] != 'closed' for state in states.values())
+    return jsonify({
+        "status": "degraded" if degraded else "healthy",
+        "dependencies": states
+    }), 200
+
+
 # Path to the Streamlit app
 STREAMLIT_APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
 
-# Import Streamlit app components
+# RAG core (a plain module; the model stacks are imported when the models load)
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from app import initialize_models, pipeline, extract_thinking_and_answer
-import ast
+from rag_core import (initialize_models, pipeline, stream_pipeline, extract_thinking_and_answer,
+                      ThinkingAnswerSplitter, embed_query, embedding_cache, verse_index,
+                      COLLECTION_NAME, load_embed_model, used_fallback)
+from resilience import breaker_states, deadline_scope
+from search_params import DEFAULT_SEARCH, parse_search_params, search_scope
+from metrics import begin_request, finish_request, render as render_metrics, stage
+from answer_cache import create_answer_cache
+from db_schema import ensure_indexes, otp_cutoff
+from history_writer import create_history_writer
+from mail_queue import create_mail_queue
+from session_tokens import issue_token, token_stats, user_id_from_credentials
+from image_store import (VARIANTS, create_image_store, image_etag, is_data_url, is_image_id, profile_image_url,
+                         save_profile_image, sniff_image_type)
+from conversation import Conversation, CONVERSATION_PROJECTION
+from model_warmup import MODEL_PRELOAD, MODEL_WARMUP, ModelLoader, ModelsNotReady, default_warmups
+from datetime import datetime, timezone
+from language_postprocess import HindiAnswerNormalizer, has_devanagari, longest_hindi_block, normalize_hindi_answer
+
+# Idempotent; run db_schema.py once beforehand to migrate legacy user_ids and OTP timestamps
+try:
+    ensure_indexes(db)
+except Exception as e:
+    print(f"⚠️ Could not create MongoDB indexes: {e}")
 
-# Initialize models at startup
+# Semantic answer cache in front of pipeline() (None when ANSWER_CACHE_BACKEND=off)
+answer_cache = create_answer_cache(db)
+
+# Chats are queued and written in batches off the request path (None: write inline)
+history_writer = create_history_writer(chat_history_collection)
+
+# Profile images live in GridFS (or IMAGE_STORE=local files); user documents keep only the image id
+image_store = create_image_store(db)
+
+# OTP emails are sent by background workers; MAIL_BACKEND=console prints them instead (see mail_queue.py)
+mail_queue = create_mail_queue()
+
+# Models load (and warm up) in the background from startup; see /ready
 embed_model, llm, qdrant_client = None, None, None
+model_loader = ModelLoader(initialize_models, default_warmups(COLLECTION_NAME))
+if MODEL_PRELOAD:
+    # Imported by the gunicorn master: load the embedding model before the workers fork so they share
+    # its memory; each worker starts the loader itself after forking (see gunicorn.conf.py)
+    load_embed_model()
+elif MODEL_WARMUP:
+    model_loader.start()
 
 def init_models():
+    """Wait for the background load (at most MODEL_READY_TIMEOUT); raises ModelsNotReady."""
     global embed_model, llm, qdrant_client
-    embed_model, llm, qdrant_client = initialize_models()
-
-# Email configuration (optional - used for sending OTP emails)
-SMTP_HOST = os.getenv("SMTP_HOST")
-SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
-SMTP_USERNAME = os.getenv("SMTP_USERNAME")
-SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
-EMAIL_FROM = os.getenv("EMAIL_FROM") or SMTP_USERNAME
-SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "true").lower() == "true"
-
-def send_email(recipient_email: str, subject: str, body_text: str) -> None:
-    """Send an email using configured SMTP settings. Raises on failure."""
-    if not (SMTP_HOST and SMTP_USERNAME and SMTP_PASSWORD and EMAIL_FROM):
-        raise RuntimeError("SMTP is not configured. Please set SMTP_HOST, SMTP_USERNAME, SMTP_PASSWORD, EMAIL_FROM.")
-
-    message = MIMEMultipart()
-    message["From"] = EMAIL_FROM
-    message["To"] = recipient_email
-    message["Subject"] = subject
-    message.attach(MIMEText(body_text, "plain", "utf-8"))
-
-    with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=20) as server:
-        if SMTP_USE_TLS:
-            server.starttls()
-        server.login(SMTP_USERNAME, SMTP_PASSWORD)
-        server.sendmail(EMAIL_FROM, [recipient_email], message.as_string())
+    embed_model, llm, qdrant_client = model_loader.wait()
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    # Readiness (models loaded) with per-component timings; /ping only says the process is up
+    status = model_loader.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.before_request
+def start_request_trace():
+    g.trace = begin_request(request.headers.get('X-Request-ID'))
+
+@app.after_request
+def finish_request_trace(response):
+    trace = g.pop('trace', None)
+    if trace is None:
+        return response
+    response.headers['X-Request-ID'] = trace.request_id
+    method = request.method
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    # On close, so streamed responses are timed to their last event
+    response.call_on_close(lambda: finish_request(trace, method, route, response.status_code))
+    return response
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    # Per-stage latency histograms, request, retry and fallback counters (Prometheus text format)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
 
 def get_user_id_from_request():
-    # Extract user ID from Authorization header
-    # Prefer explicit header if present
-    x_user_id = request.headers.get('X-User-Id')
-    if x_user_id:
-        try:
-            oid = ObjectId(x_user_id)
-            return str(oid)
-        except Exception:
-            # If it's not an ObjectId, still allow as string id
-            if isinstance(x_user_id, str) and len(x_user_id) >= 6:
-                return x_user_id
+    return user_id_from_headers(request.headers)
+
+def user_id_from_headers(headers):
+    # Signed session token, or a legacy credential during the migration window (see session_tokens.py)
+    return user_id_from_credentials(headers.get('Authorization'), headers.get('X-User-Id'))
+
+def build_language_prompt(prompt, language):
+    """Wrap the user's prompt with instructions to answer in the selected language."""
+    # Always modify the prompt based on the selected language, regardless of input language
+    # Detect if query already has Hindi characters
+    has_hindi = has_devanagari(prompt)
 
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        print("⚠️ Authorization header missing or malformed")
+    if language == 'hindi':
+        # Add instruction to respond in Hindi regardless of input language
+        # Use more comprehensive instruction for better Hindi responses
+        modified_prompt = f"कृपया इस प्रश्न का उत्तर हिंदी में दें, भले ही प्रश्न किसी भी भाषा में हो। कृपया शुद्ध हिंदी का प्रयोग करें और उत्तर को स्पष्ट रूप से लिखें। पूर्ण वाक्यों में उत्तर दें: {prompt}"
+
+        # If query is already in Hindi, add additional context
+        if has_hindi:
+            # Extract the longest Hindi text block for better processing
+            hindi_block = longest_hindi_block(prompt)
+            if hindi_block:
+                if len(hindi_block) > len(prompt) / 3:  # If at least 1/3 is Hindi
+                    modified_prompt = f"निम्नलिखित हिंदी प्रश्न का उत्तर हिंदी में ही दें। कृपया शुद्ध हिंदी का प्रयोग करें और उत्तर को स्पष्ट रूप से लिखें। पूर्ण वाक्यों में उत्तर दें: {hindi_block}"
+                else:
+                    modified_prompt = f"निम्नलिखित हिंदी प्रश्न का उत्तर हिंदी में ही दें। कृपया शुद्ध हिंदी का प्रयोग करें और उत्तर को स्पष्ट रूप से लिखें। पूर्ण वाक्यों में उत्तर दें: {prompt}"
+    else:
+        # For English, ensure response is in English
+        modified_prompt = f"Please answer this question in English, regardless of the language it's asked in: {prompt}"
+
+    return modified_prompt
+
+def load_conversation(chat_id, user_id):
+    """The conversation to continue in chat_id, a new one when chat_id is empty, or None if not found."""
+    if not chat_id:
+        return Conversation()
+    if not user_id:
         return None
-    
-    token = auth_header.split(' ')[1]
     try:
-        print(f"🔐 Received token (first 60 chars): {token[:60]}")
+        oid = ObjectId(chat_id)
     except Exception:
-        pass
-    try:
-        # Parse the token (which contains user data from localStorage)
-        user_data = json.loads(token)
-        user_id = user_data.get('user_id')
-        if user_id:
-            return user_id
-        print("⚠️ Token parsed but user_id missing")
-    except Exception as e:
-        print(f"Error parsing token as JSON: {e}")
+        return None
+    chat = chat_history_collection.find_one({'_id': oid, 'user_id': user_id}, CONVERSATION_PROJECTION)
+    if not chat and history_writer is not None:
+        # The previous turn may still be queued
+        pending = history_writer.pending(oid)
+        if pending and pending['user_id'] == user_id:
+            chat = pending
+    return Conversation.from_document(chat) if chat else None
 
-    # Try Python literal dict (e.g., single-quoted)
-    try:
-        data = ast.literal_eval(token)
-        if isinstance(data, dict) and 'user_id' in data:
-            return data['user_id']
-    except Exception as e:
-        print(f"Error parsing token as Python literal: {e}")
+def save_chat(user_id, prompt, answer, conversation=None):
+    """Persist a question/answer pair to the user's history. Returns the chat id, or None.
 
-    # If token looks like a Mongo ObjectId, accept as user_id directly
-    try:
-        oid = ObjectId(token)
-        return str(oid)
-    except Exception:
-        pass
+    A follow-up in an existing conversation is appended to its chat with $push,
+    together with the updated summary and retrieval memory.
+    """
+    if not user_id:
+        print("ℹ️ No user_id in request; responding without saving history")
+        return None
 
-    # Sometimes token may be a JSON string wrapped in extra quotes
-    if token.startswith('"') and token.endswith('"'):
-        try:
-            inner = token.strip('"')
-            data = json.loads(inner)
-            if isinstance(data, dict) and 'user_id' in data:
-                return data['user_id']
-        except Exception as e:
-            print(f"Error parsing re-quoted token: {e}")
+    turn = [
+        {'role': 'user', 'content': prompt},
+        {'role': 'assistant', 'content': answer}
+    ]
+    state = {}
+    if conversation is not None:
+        conversation.add_turn(prompt, answer)
+        state = conversation.state()
+        if conversation.chat_id:
+            oid = ObjectId(conversation.chat_id)
+            update = {'$push': {'messages': {'$each': turn}}, '$set': dict(state, updated_at=time.time())}
+            with stage('history_write'):
+                if history_writer is not None:
+                    history_writer.submit_update(oid, update, user_id)
+                else:
+                    chat_history_collection.update_one({'_id': oid, 'user_id': user_id}, update)
+            return conversation.chat_id
 
-    # Try regex extraction for user_id in malformed tokens
-    try:
-        import re
-        m = re.search(r'"user_id"\s*:\s*"([0-9a-fA-F]{24})"', token)
-        if m:
-            return m.group(1)
-        m2 = re.search(r'user_id\s*:\s*([0-9a-fA-F]{24})', token)
-        if m2:
-            return m2.group(1)
-    except Exception as e:
-        print(f"Regex extraction failed: {e}")
+    chat_id = str(ObjectId())
+    chat_entry = {
+        '_id': ObjectId(chat_id),
+        'user_id': user_id,
+        'date': time.strftime('%Y-%m-%d'),
+        'created_at': time.time(),
+        'title': prompt[:30] + '...' if len(prompt) > 30 else prompt,
+        'messages': turn,
+        **state
+    }
+    if conversation is not None:
+        conversation.chat_id = chat_id
+    with stage('history_write'):
+        if history_writer is not None:
+            history_writer.submit(chat_entry)
+            return chat_id
+        result = chat_history_collection.insert_one(chat_entry)
+    print(f"✅ Chat saved for user {user_id} with id {result.inserted_id}")
+    return chat_id
+
+def generate_answer(modified_prompt, language, query_embedding=None, conversation=None, question=None):
+    """Run the RAG pipeline and post-process the answer for the requested language.
+
+    `question` is the user's own prompt, which retrieval scores passages against;
+    the language instructions of modified_prompt only go to the LLM.
+
+    Returns (thinking, answer, cacheable); answers from a fallback path (see
+    rag_core.used_fallback) aren't cacheable.
+    """
+    full_response = pipeline(modified_prompt, embed_model, llm, qdrant_client, query_embedding=query_embedding,
+                             conversation=conversation, question=question)
+    # pipeline() returns a plain string when generation fails
+    with stage('parse_answer'):
+        thinking, answer = extract_thinking_and_answer(full_response)
+    cacheable = not used_fallback()
+    return (*postprocess_answer(thinking, answer, language), cacheable)
 
-    print("❌ Unable to extract user_id from Authorization token")
-    return None
+def postprocess_answer(thinking, answer, language):
+    """Language-specific cleanup of an extracted (thinking, answer) pair."""
+    if language == 'hindi':
+        # Keep only the Hindi answer text, and clear the thinking section to keep output clean
+        with stage('hindi_postprocess'):
+            return '', normalize_hindi_answer(answer)
+    return thinking, answer
+
+def answer_normalizer(language):
+    """Incremental post-processor for streamed answers, or None when the language needs none."""
+    return HindiAnswerNormalizer() if language == 'hindi' else None
+
+def stream_events(events, normalizer):
+    """Apply the language post-processing to ThinkingAnswerSplitter events as they stream."""
+    for kind, text in events:
+        if normalizer is not None:
+            # Hindi responses drop the thinking section, as in /api/chat
+            if kind == 'thinking':
+                continue
+            text = normalizer.feed(text)
+        if text:
+            yield kind, text
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
@@ -185,118 +308,190 @@ def chat():
 
     if not prompt:
         return jsonify({'error': 'No prompt provided'}), 400
+    try:
+        search = parse_search_params(data.get('search_params'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     try:
+        conversation = load_conversation(data.get('chat_id'), user_id)
+        if conversation is None:
+            return jsonify({'error': 'Conversation not found'}), 404
+        # Follow-up answers depend on the earlier turns, and answers retrieved with search parameters
+        # other than the defaults shouldn't be served to (or from) others, so both bypass the answer cache
+        use_cache = answer_cache is not None and not conversation.is_follow_up and search == DEFAULT_SEARCH
+
         if embed_model is None or llm is None or qdrant_client is None:
             init_models()
 
-        # Always modify the prompt based on the selected language, regardless of input language
-        # Detect if query already has Hindi characters
-        import re
-        has_hindi = bool(re.search(r'[ऀ-ॿ]', prompt))
-        
-        if language == 'hindi':
-            # Add instruction to respond in Hindi regardless of input language
-            # Use more comprehensive instruction for better Hindi responses
-            modified_prompt = f"कृपया इस प्रश्न का उत्तर हिंदी में दें, भले ही प्रश्न किसी भी भाषा में हो। कृपया शुद्ध हिंदी का प्रयोग करें और उत्तर को स्पष्ट रूप से लिखें। पूर्ण वाक्यों में उत्तर दें: {prompt}"
-            
-            # If query is already in Hindi, add additional context
-            if has_hindi:
-                # Extract the longest Hindi text block for better processing
-                hindi_blocks = re.findall(r'[ऀ-ॿ\s\.,;:!?()]+', prompt)
-                if hindi_blocks:
-                    longest_hindi_block = max(hindi_blocks, key=len)
-                    if len(longest_hindi_block) > len(prompt) / 3:  # If at least 1/3 is Hindi
-                        modified_prompt = f"निम्नलिखित हिंदी प्रश्न का उत्तर हिंदी में ही दें। कृपया शुद्ध हिंदी का प्रयोग करें और उत्तर को स्पष्ट रूप से लिखें। पूर्ण वाक्यों में उत्तर दें: {longest_hindi_block}"
-                    else:
-                        modified_prompt = f"निम्नलिखित हिंदी प्रश्न का उत्तर हिंदी में ही दें। कृपया शुद्ध हिंदी का प्रयोग करें और उत्तर को स्पष्ट रूप से लिखें। पूर्ण वाक्यों में उत्तर दें: {prompt}"
-        else:
-            # For English, ensure response is in English
-            modified_prompt = f"Please answer this question in English, regardless of the language it's asked in: {prompt}"
-
-        full_response = pipeline(modified_prompt, embed_model, llm, qdrant_client)
-        thinking, answer = extract_thinking_and_answer(full_response.text)
-
-        if language == 'hindi':
-            import re
-            # Clean up the answer by removing unwanted symbols like square brackets
-            answer = re.sub(r'[\[\]]', '', answer)
-            
-            # Extract Hindi text blocks with improved pattern to capture more punctuation and formatting
-            hindi_blocks = re.findall(r'([ऀ-ॿ0-9\s\n\r\t\-•\.,;:!?()"""''\u0020-\u0040\u005B-\u0060\u007B-\u007E]+)', answer)
-            
-            if hindi_blocks:
-                # Use the longest Hindi block as the answer
-                answer = max(hindi_blocks, key=len).strip()
-                
-                # If the extracted Hindi block is too short (less than 20 chars), use the full answer
-                # This handles cases where Hindi text might be mixed with English or other characters
-                if len(answer) < 20 and len(answer) < len(answer) * 0.3:  # Less than 30% of original
-                    # Fallback to original answer with basic cleanup
-                    answer = re.sub(r'[\[\]]', '', answer).strip()
-            
-            # Improve formatting
-            answer = re.sub(r'\n{3,}', '\n\n', answer).strip()
-            
-            # Remove any English instructions that might be at the beginning
-            answer = re.sub(r'^(Here is|The answer|Answer|Response|In Hindi|Hindi translation)[:\s]*', '', answer, flags=re.IGNORECASE)
-            
-            # Check if the answer is just commas or very short
-            if answer.strip() in [',', ',,', ',,,'] or len(answer.strip()) < 5:
-                # Provide a fallback response in Hindi
-                answer = "क्षमा करें, मुझे आपके प्रश्न का उत्तर देने में समस्या हो रही है। कृपया अपना प्रश्न दोबारा पूछें।"
-            
-            # Reduce multiple commas to a single comma
-            answer = re.sub(r',{2,}', ',', answer)
-            
-            # Clear thinking section for Hindi responses to keep output clean
-            thinking = ''
-
-        if user_id:
-            chat_id = str(ObjectId())
-            chat_entry = {
-                '_id': ObjectId(chat_id),
-                'user_id': user_id,
-                'date': time.strftime('%Y-%m-%d'),
-                'created_at': time.time(),
-                'title': prompt[:30] + '...' if len(prompt) > 30 else prompt,
-                'messages': [
-                    {'role': 'user', 'content': prompt},
-                    {'role': 'assistant', 'content': answer}
-                ]
-            }
-            result = chat_history_collection.insert_one(chat_entry)
-            print(f"✅ Chat saved for user {user_id} with id {result.inserted_id}")
-        else:
-            print("ℹ️ No user_id in request; responding without saving history")
+        modified_prompt = build_language_prompt(prompt, language)
+
+        # One deadline caps embedding, retrieval and generation together
+        with deadline_scope(), search_scope(search):
+            # Embed once; the vector serves both the answer cache and retrieval.
+            # Questions naming a verse skip both and go straight to the verse index.
+            query_embedding = None
+            if not verse_index.find_references(modified_prompt):
+                query_embedding = embed_query(modified_prompt, embed_model)
+            cached = answer_cache.lookup(query_embedding, language) if use_cache else None
+            if cached:
+                thinking, answer = cached
+            else:
+                thinking, answer, cacheable = generate_answer(modified_prompt, language, query_embedding,
+                                                              conversation, question=prompt)
+                if use_cache and cacheable:
+                    answer_cache.store(query_embedding, language, prompt, thinking, answer)
 
-        return jsonify({'response': answer, 'thinking': thinking})
+        chat_id = save_chat(user_id, prompt, answer, conversation)
 
+        return jsonify({'response': answer, 'thinking': thinking, 'chat_id': chat_id})
+
+    except ModelsNotReady as e:
+        print(f"⏳ /api/chat before the models were ready: {e}")
+        return jsonify({'error': 'The assistant is still starting up, please try again shortly'}), 503
     except Exception as e:
         print("Error in /api/chat:", e)
         return jsonify({'error': 'Internal server error'}), 500
 
+def sse_event(event, data):
+    """Format one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Server-sent-events version of /api/chat.
+
+    Emits `thinking` and `answer` events with text deltas as the LLM produces them,
+    then a `done` event carrying the final post-processed answer (which replaces the
+    streamed text for Hindi, where the answer is cleaned up as a whole) and chat id.
+    """
+    data = request.json
+    prompt = data.get('prompt')
+    language = data.get('language', 'english')
+    user_id = get_user_id_from_request()
+
+    if not prompt:
+        return jsonify({'error': 'No prompt provided'}), 400
+    try:
+        search = parse_search_params(data.get('search_params'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    conversation = load_conversation(data.get('chat_id'), user_id)
+    if conversation is None:
+        return jsonify({'error': 'Conversation not found'}), 404
+    use_cache = answer_cache is not None and not conversation.is_follow_up and search == DEFAULT_SEARCH
+
+    def generate():
+        with deadline_scope(), search_scope(search):
+            yield from generate_events()
+
+    def generate_events():
+        try:
+            if embed_model is None or llm is None or qdrant_client is None:
+                init_models()
+
+            modified_prompt = build_language_prompt(prompt, language)
+            query_embedding = None
+            if not verse_index.find_references(modified_prompt):
+                query_embedding = embed_query(modified_prompt, embed_model)
+            cached = answer_cache.lookup(query_embedding, language) if use_cache else None
+            if cached:
+                thinking, answer = cached
+                yield sse_event('answer', {'text': answer})
+            else:
+                splitter = ThinkingAnswerSplitter()
+                normalizer = answer_normalizer(language)
+                for delta in stream_pipeline(modified_prompt, embed_model, llm, qdrant_client,
+                                             query_embedding=query_embedding, conversation=conversation,
+                                             question=prompt):
+                    for kind, text in stream_events(splitter.feed(delta), normalizer):
+                        yield sse_event(kind, {'text': text})
+                for kind, text in stream_events(splitter.close(), normalizer):
+                    yield sse_event(kind, {'text': text})
+
+                cacheable = not used_fallback()
+                if normalizer is not None:
+                    with stage('hindi_postprocess'):
+                        thinking, answer = '', normalizer.finish()
+                else:
+                    thinking, answer = postprocess_answer(splitter.thinking, splitter.answer, language)
+                if use_cache and cacheable:
+                    answer_cache.store(query_embedding, language, prompt, thinking, answer)
+
+            chat_id = save_chat(user_id, prompt, answer, conversation)
+            yield sse_event('done', {'response': answer, 'thinking': thinking, 'chat_id': chat_id})
+        except ModelsNotReady as e:
+            print(f"⏳ /api/chat/stream before the models were ready: {e}")
+            yield sse_event('error', {'error': 'The assistant is still starting up, please try again shortly'})
+        except Exception as e:
+            print("Error in /api/chat/stream:", e)
+            yield sse_event('error', {'error': 'Internal server error'})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def encode_history_cursor(chat):
+    """Opaque cursor pointing just past the given (created_at, _id)."""
+    raw = json.dumps([chat.get('created_at'), str(chat['_id'])])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_history_cursor(cursor):
+    """Return (created_at, ObjectId) from a cursor; raises ValueError if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, chat_id = json.loads(raw)
+        return (float(created_at) if created_at is not None else None), ObjectId(chat_id)
+    except Exception as e:
+        raise ValueError(f"invalid cursor: {e}")
+
 @app.route('/api/history', methods=['GET'])
 def get_history():
+    """One page of the user's chats, newest first, as summaries.
+
+    Query parameters: `limit` (default HISTORY_PAGE_SIZE) and `cursor`, taken
+    from the X-Next-Cursor header of the previous page. The header is absent
+    on the last page.
+    """
     user_id = get_user_id_from_request()
     if not user_id:
         print("❌ No user ID found in request")
         return jsonify([])
 
     try:
-        # Build query matching string user_id and tolerate legacy ObjectId user_id
+        limit = min(max(int(request.args.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor')
+        after = decode_history_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
         query = {'user_id': user_id}
-        try:
-            oid = ObjectId(user_id)
-            query = {'$or': [{'user_id': user_id}, {'user_id': oid}]}
-        except Exception:
-            pass
+        if after:
+            created_at, chat_id = after
+            if created_at is None:
+                # Legacy chats without created_at sort after every timestamped one
+                page = {'created_at': None, '_id': {'$lt': chat_id}}
+            else:
+                page = {'$or': [
+                    {'created_at': {'$lt': created_at}},
+                    {'created_at': created_at, '_id': {'$lt': chat_id}},
+                    {'created_at': None},
+                ]}
+            query.update(page)
 
-        cursor = chat_history_collection.find(query).sort([
+        # One extra row tells us whether there is a next page
+        cursor = chat_history_collection.find(query, HISTORY_SUMMARY_FIELDS).sort([
             ('created_at', pymongo.DESCENDING),
             ('_id', pymongo.DESCENDING)
-        ])
+        ]).limit(limit + 1)
         chats = list(cursor)
+        has_more = len(chats) > limit
+        chats = chats[:limit]
+        next_cursor = encode_history_cursor(chats[-1]) if has_more else None
         for chat in chats:
             chat['_id'] = str(chat['_id'])
             # Ensure consistent keys for frontend
@@ -306,7 +501,10 @@ def get_history():
                 except Exception:
                     chat['date'] = ''
         print(f"✅ Found {len(chats)} chats for user {user_id}")
-        return jsonify(chats)
+        response = jsonify(chats)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
     except Exception as e:
         print(f"❌ Error fetching history: {e}")
         return jsonify([])
@@ -318,12 +516,15 @@ def get_single_chat(chat_id):
         return jsonify({'error': 'Unauthorized'}), 401
 
     try:
-        query = {'_id': ObjectId(chat_id), '$or': [{'user_id': user_id}]}
-        try:
-            query['$or'].append({'user_id': ObjectId(user_id)})
-        except Exception:
-            pass
-        chat = chat_history_collection.find_one(query)
+        query = {'_id': ObjectId(chat_id), 'user_id': user_id}
+        # The retrieval memory (context and query vector) is server-side state
+        chat = chat_history_collection.find_one(query, {'memory': 0})
+        if not chat and history_writer is not None:
+            # Answered moments ago and not flushed yet; copy so the queued document stays intact
+            pending = history_writer.pending(query['_id'])
+            if pending and pending['user_id'] == user_id:
+                chat = dict(pending)
+                chat.pop('memory', None)
         if not chat:
             return jsonify({'error': 'Not found'}), 404
         chat['_id'] = str(chat['_id'])
@@ -344,13 +545,11 @@ def delete_chat(chat_id):
         except Exception:
             return jsonify({'error': 'Invalid chat id'}), 400
 
-        query = {'_id': oid, '$or': [{'user_id': user_id}]}
-        try:
-            query['$or'].append({'user_id': ObjectId(user_id)})
-        except Exception:
-            pass
+        query = {'_id': oid, 'user_id': user_id}
+        # A chat answered moments ago may still be queued; drop it so it isn't written after the delete
+        discarded = history_writer.discard(oid, user_id) if history_writer is not None else []
         result = chat_history_collection.delete_one(query)
-        if result.deleted_count == 0:
+        if result.deleted_count == 0 and not discarded:
             print(f"⚠️ Delete failed for chat {chat_id} and user {user_id}")
             return jsonify({'error': 'Not found or not owned by user'}), 404
         print(f"🗑️ Deleted chat {chat_id} for user {user_id}")
@@ -366,15 +565,12 @@ def delete_all_history():
         return jsonify({'error': 'Unauthorized'}), 401
 
     try:
-        # Delete both string and legacy ObjectId user_id records
-        query = {'$or': [{'user_id': user_id}]}
-        try:
-            query['$or'].append({'user_id': ObjectId(user_id)})
-        except Exception:
-            pass
+        query = {'user_id': user_id}
+        discarded = history_writer.discard(user_id=user_id) if history_writer is not None else []
         result = chat_history_collection.delete_many(query)
-        print(f"🧹 Deleted {result.deleted_count} chats for user {user_id}")
-        return jsonify({'success': True, 'deleted': result.deleted_count})
+        deleted = result.deleted_count + len(discarded)
+        print(f"🧹 Deleted {deleted} chats for user {user_id}")
+        return jsonify({'success': True, 'deleted': deleted})
     except Exception as e:
         print(f"❌ Error deleting all history: {e}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -390,7 +586,7 @@ def register():
         return jsonify({'error': 'Username, email and password required'}), 400
     
     # Check if user already exists
-    if users_collection.find_one({'$or': [{'username': username}, {'email': email}]}):
+    if users_collection.find_one({'username': username}) or users_collection.find_one({'email': email}):
         return jsonify({'error': 'Username or email already exists'}), 400
     
     # Check if email is verified
@@ -398,7 +594,8 @@ def register():
     verified_email = otp_collection.find_one({
         'email': email,
         'type': 'registration',
-        'verified': True
+        'verified': True,
+        'created_at': {'$gte': otp_cutoff()}
     })
     
     if not verified_email:
@@ -410,7 +607,7 @@ def register():
         'email': email,
         'password': password,  # In production, hash this password
         'created_at': time.time(),
-        'profileImage': None
+        'profileImageId': None
     }
     
     result = users_collection.insert_one(user_data)
@@ -418,15 +615,6 @@ def register():
     # Clean up OTP data
     otp_collection.delete_many({'email': email, 'type': 'registration'})
     
-    # Return user data with token
-    token_data = {
-        'user_id': str(result.inserted_id),
-        'username': username,
-        'email': email,
-        'created_at': user_data['created_at'],
-        'profileImage': None
-    }
-    
     return jsonify({
         'success': True,
         'user_id': str(result.inserted_id),
@@ -434,7 +622,7 @@ def register():
         'email': email,
         'created_at': user_data['created_at'],
         'profileImage': None,
-        'token': json.dumps(token_data)
+        'token': issue_token(result.inserted_id)
     })
 
 @app.route('/api/auth/login', methods=['POST'])
@@ -469,15 +657,6 @@ def login():
             print(f"⚠️ User with email {email} does not exist")
         return jsonify({'error': 'Invalid credentials'}), 401
     
-    # Create token data
-    token_data = {
-        'user_id': str(user['_id']),
-        'username': user['username'],
-        'email': user['email'],
-        'created_at': user.get('created_at'),
-        'profileImage': user.get('profileImage')
-    }
-    
     print(f"✅ Login successful for user: {user['username']}")
     
     return jsonify({
@@ -486,8 +665,8 @@ def login():
         'username': user['username'],
         'email': user['email'],
         'created_at': user.get('created_at'),
-        'profileImage': user.get('profileImage'),
-        'token': json.dumps(token_data)
+        'profileImage': profile_image_for(user),
+        'token': issue_token(user['_id'])
     })
 
 @app.route('/api/auth/logout', methods=['POST'])
@@ -495,6 +674,45 @@ def logout():
     # In a real implementation, you might invalidate the token
     return jsonify({'success': True})
 
+def profile_image_for(user):
+    """URL of the user's profile thumbnail, moving a legacy inline data URL to the image store first."""
+    image_id = user.get('profileImageId')
+    legacy = user.get('profileImage')
+    if not image_id and is_data_url(legacy):
+        try:
+            image_id = save_profile_image(image_store, str(user['_id']), legacy)
+            users_collection.update_one({'_id': user['_id']},
+                                        {'$set': {'profileImageId': image_id}, '$unset': {'profileImage': ''}})
+        except Exception as e:
+            print(f"⚠️ Could not move profile image of user {user['_id']} to the image store: {e}")
+            return None
+    return profile_image_url(image_id)
+
+@app.route('/api/images/<image_id>', methods=['GET'])
+def get_image(image_id):
+    """A stored profile image (?size=thumb|full), revalidated by ETag."""
+    variant = request.args.get('size', 'thumb')
+    if variant not in VARIANTS or not is_image_id(image_id):
+        return jsonify({'error': 'Not found'}), 404
+    etag = image_etag(image_id, variant)
+    # The id changes with the content, so a matching ETag is always current
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        stored = image_store.get(image_id, variant)
+        if stored is None:
+            return jsonify({'error': 'Not found'}), 404
+        _, data = stored
+        # Serve the type the bytes actually have, never the one stored from the upload
+        mime = sniff_image_type(data)
+        if mime is None:
+            return jsonify({'error': 'Not found'}), 404
+        response = Response(data, mimetype=mime)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
 # Profile management endpoints
 @app.route('/api/auth/profile', methods=['GET'])
 def get_profile():
@@ -512,7 +730,7 @@ def get_profile():
             'username': user['username'],
             'email': user['email'],
             'created_at': user.get('created_at'),
-            'profileImage': user.get('profileImage')
+            'profileImage': profile_image_for(user)
         }
         return jsonify(user_response)
     except Exception as e:
@@ -543,38 +761,38 @@ def update_profile():
             return jsonify({'error': 'Username already taken'}), 400
         
         # Update user profile
-        update_data = {'username': username}
-        if profile_image:
-            update_data['profileImage'] = profile_image
+        update = {'$set': {'username': username}}
+        previous_image_id = None
+        # A new upload arrives as a data URL; an unchanged image comes back as its /api/images URL
+        if is_data_url(profile_image):
+            current = users_collection.find_one({'_id': ObjectId(user_id)}, {'profileImageId': 1})
+            if not current:
+                return jsonify({'error': 'User not found'}), 404
+            try:
+                update['$set']['profileImageId'] = save_profile_image(image_store, user_id, profile_image)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            update['$unset'] = {'profileImage': ''}
+            previous_image_id = current.get('profileImageId')
         
-        result = users_collection.update_one(
-            {'_id': ObjectId(user_id)},
-            {'$set': update_data}
-        )
+        result = users_collection.update_one({'_id': ObjectId(user_id)}, update)
         
         if result.matched_count == 0:
             return jsonify({'error': 'User not found'}), 404
+        if previous_image_id and previous_image_id != update['$set']['profileImageId']:
+            image_store.delete(previous_image_id)
         
         # Get updated user data
         updated_user = users_collection.find_one({'_id': ObjectId(user_id)})
         
-        # Create token data
-        token_data = {
-            'user_id': str(updated_user['_id']),
-            'username': updated_user['username'],
-            'email': updated_user['email'],
-            'created_at': updated_user.get('created_at'),
-            'profileImage': updated_user.get('profileImage')
-        }
-        
         return jsonify({
             'success': True,
             'user_id': str(updated_user['_id']),
             'username': updated_user['username'],
             'email': updated_user['email'],
             'created_at': updated_user.get('created_at'),
-            'profileImage': updated_user.get('profileImage'),
-            'token': json.dumps(token_data)
+            'profileImage': profile_image_for(updated_user),
+            'token': issue_token(updated_user['_id'])
         })
         
     except Exception as e:
@@ -604,21 +822,15 @@ def send_registration_otp():
         otp_collection = db['otp_codes']
         otp_collection.update_one(
             {'email': email, 'type': 'registration'},
-            {'$set': {'otp': otp, 'created_at': time.time()}},
+            {'$set': {'otp': otp, 'created_at': datetime.now(timezone.utc)}},
             upsert=True
         )
         
-        # Try sending email; fallback to console log if SMTP not configured
-        try:
-            send_email(
-                recipient_email=email,
-                subject="Your ASK KRISHNA registration OTP",
-                body_text=f"Your OTP is: {otp}\nThis code will expire in 5 minutes."
-            )
-            print(f"📧 Registration OTP sent to {email}")
-        except Exception as mail_err:
-            print(f"⚠️ SMTP not configured or failed ({mail_err}); printing OTP to console.")
-            print(f"📧 Registration OTP for {email}: {otp}")
+        # Queued for the mail workers; the response doesn't wait on the SMTP server
+        if not mail_queue.send(email, "Your ASK KRISHNA registration OTP",
+                               f"Your OTP is: {otp}\nThis code will expire in 5 minutes."):
+            return jsonify({'error': 'Email service is busy, please try again shortly'}), 503
+        print(f"📧 Registration OTP queued for {email}")
         
         return jsonify({
             'success': True,
@@ -641,18 +853,16 @@ def verify_registration_otp():
     try:
         # Verify OTP
         otp_collection = db['otp_codes']
+        # Expired codes are removed by the TTL index; the cutoff covers the TTL monitor's lag
         stored_otp = otp_collection.find_one({
             'email': email,
             'type': 'registration',
-            'otp': otp
+            'otp': otp,
+            'created_at': {'$gte': otp_cutoff()}
         })
         
         if not stored_otp:
-            return jsonify({'error': 'Invalid OTP'}), 400
-        
-        # Check if OTP is expired (5 minutes)
-        if time.time() - stored_otp['created_at'] > 300:
-            return jsonify({'error': 'OTP expired'}), 400
+            return jsonify({'error': 'Invalid or expired OTP'}), 400
         
         # Mark email as verified
         otp_collection.update_one(
@@ -691,21 +901,15 @@ def send_delete_otp():
         otp_collection = db['otp_codes']
         otp_collection.update_one(
             {'email': email, 'type': 'delete_account'},
-            {'$set': {'otp': otp, 'created_at': time.time()}},
+            {'$set': {'otp': otp, 'created_at': datetime.now(timezone.utc)}},
             upsert=True
         )
         
-        # Try sending email; fallback to console log if SMTP not configured
-        try:
-            send_email(
-                recipient_email=email,
-                subject="Confirm account deletion - OTP",
-                body_text=f"Your OTP to confirm deletion is: {otp}\nThis code will expire in 5 minutes."
-            )
-            print(f"📧 Delete account OTP sent to {email}")
-        except Exception as mail_err:
-            print(f"⚠️ SMTP not configured or failed ({mail_err}); printing OTP to console.")
-            print(f"📧 Delete account OTP for {email}: {otp}")
+        # Queued for the mail workers; the response doesn't wait on the SMTP server
+        if not mail_queue.send(email, "Confirm account deletion - OTP",
+                               f"Your OTP to confirm deletion is: {otp}\nThis code will expire in 5 minutes."):
+            return jsonify({'error': 'Email service is busy, please try again shortly'}), 503
+        print(f"📧 Delete account OTP queued for {email}")
         
         return jsonify({
             'success': True,
@@ -738,21 +942,23 @@ def delete_account():
         
         # Verify OTP
         otp_collection = db['otp_codes']
+        # Expired codes are removed by the TTL index; the cutoff covers the TTL monitor's lag
         stored_otp = otp_collection.find_one({
             'email': email,
             'type': 'delete_account',
-            'otp': otp
+            'otp': otp,
+            'created_at': {'$gte': otp_cutoff()}
         })
         
         if not stored_otp:
-            return jsonify({'error': 'Invalid OTP'}), 400
-        
-        # Check if OTP is expired (5 minutes)
-        if time.time() - stored_otp['created_at'] > 300:
-            return jsonify({'error': 'OTP expired'}), 400
+            return jsonify({'error': 'Invalid or expired OTP'}), 400
         
         # Delete user and all their data
         users_collection.delete_one({'_id': ObjectId(user_id)})
+        if user.get('profileImageId'):
+            image_store.delete(user['profileImageId'])
+        if history_writer is not None:
+            history_writer.discard(user_id=user_id)
         chat_history_collection.delete_many({'user_id': user_id})
         otp_collection.delete_many({'email': email})
         
@@ -789,6 +995,33 @@ def test_connection():
             'error': str(e)
         }), 500
 
+@app.route('/api/test/cache', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'answer_cache': answer_cache.stats() if answer_cache else None,
+        'embedding_cache': embedding_cache.stats()
+    })
+
+@app.route('/api/test/embedding-batches', methods=['GET'])
+def embedding_batch_stats():
+    if embed_model is None or not hasattr(embed_model, 'stats'):
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **embed_model.stats()})
+
+@app.route('/api/test/history-writer', methods=['GET'])
+def history_writer_stats():
+    if history_writer is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **history_writer.stats()})
+
+@app.route('/api/test/mail', methods=['GET'])
+def mail_queue_stats():
+    return jsonify(mail_queue.stats())
+
+@app.route('/api/test/tokens', methods=['GET'])
+def session_token_stats():
+    return jsonify(token_stats())
+
 @app.route('/api/test/create-user', methods=['POST'])
 def create_test_user():
     try:
@@ -0,0 +1,150 @@
+"""MongoDB indexes and the one-shot user_id migration.
+
+`ensure_indexes(db)` runs at backend startup. It is idempotent: existing
+indexes are left alone, and a changed OTP expiry is applied with collMod.
+
+Older chats stored `user_id` as an ObjectId, newer ones as the string the
+auth token carries, so every lookup had to `$or` over both. Run this module
+once to convert the history to strings (in batches), to convert OTP
+timestamps to dates for the TTL index and to move inline profile images to
+the image store:
+
+    python db_schema.py            # migrate and create indexes
+    python db_schema.py --dry-run  # only report what would change
+"""
+import os
+from datetime import datetime, timedelta, timezone
+
+import pymongo
+from pymongo.errors import OperationFailure
+
+OTP_TTL_SECONDS = int(os.getenv("OTP_TTL_SECONDS", "300"))
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "1000"))
+
+
+def _create_index(collection, keys, **options):
+    try:
+        collection.create_index(keys, **options)
+    except OperationFailure as e:
+        # Typically duplicates blocking a unique index; the app still works without it
+        print(f"⚠️ Could not create index {options.get('name', keys)} on {collection.name}: {e}")
+
+
+def _ensure_ttl_index(collection, field, seconds, name):
+    try:
+        collection.create_index(field, expireAfterSeconds=seconds, name=name)
+    except OperationFailure:
+        # Same index with a different expiry: update it in place
+        collection.database.command('collMod', collection.name,
+                                    index={'name': name, 'expireAfterSeconds': seconds})
+
+
+def ensure_indexes(db):
+    """Create every index the backend's queries rely on."""
+    chat_history = db['chat_history']
+    users = db['users']
+    otp_codes = db['otp_codes']
+
+    # Newest-first history pages for one user, and lookups/deletes by user
+    _create_index(chat_history,
+                  [('user_id', pymongo.ASCENDING), ('created_at', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)],
+                  name='user_history')
+    _create_index(users, 'email', name='email', unique=True)
+    _create_index(users, 'username', name='username', unique=True)
+    _create_index(otp_codes, [('email', pymongo.ASCENDING), ('type', pymongo.ASCENDING)], name='email_type')
+    # Mongo deletes codes OTP_TTL_SECONDS after they were sent (created_at must be a date)
+    _ensure_ttl_index(otp_codes, 'created_at', OTP_TTL_SECONDS, name='otp_expiry')
+
+
+def otp_cutoff():
+    """Oldest created_at of a still-valid OTP.
+
+    The TTL monitor only runs about once a minute, so lookups also filter on
+    this to keep the expiry exact.
+    """
+    return datetime.now(timezone.utc) - timedelta(seconds=OTP_TTL_SECONDS)
+
+
+def _batched_updates(collection, query, update_for, batch_size, dry_run):
+    """Apply update_for(doc) to every doc matching query, batch_size at a time."""
+    changed = 0
+    last_id = None
+    while True:
+        page = dict(query)
+        if last_id is not None:
+            page['_id'] = {'$gt': last_id}
+        docs = list(collection.find(page).sort('_id', pymongo.ASCENDING).limit(batch_size))
+        if not docs:
+            return changed
+        if not dry_run:
+            collection.bulk_write([pymongo.UpdateOne({'_id': doc['_id']}, update_for(doc)) for doc in docs],
+                                  ordered=False)
+        changed += len(docs)
+        last_id = docs[-1]['_id']
+        print(f"⏳ {collection.name}: {changed} documents {'to migrate' if dry_run else 'migrated'}")
+
+
+def migrate_chat_user_ids(db, batch_size=MIGRATION_BATCH_SIZE, dry_run=False):
+    """Store chat_history.user_id as a string everywhere, and backfill created_at."""
+    chat_history = db['chat_history']
+    converted = _batched_updates(
+        chat_history, {'user_id': {'$type': 'objectId'}},
+        lambda doc: {'$set': {'user_id': str(doc['user_id'])}},
+        batch_size, dry_run)
+    # Chats from before created_at existed take their ObjectId's timestamp, so pagination orders them
+    backfilled = _batched_updates(
+        chat_history, {'created_at': {'$exists': False}},
+        lambda doc: {'$set': {'created_at': doc['_id'].generation_time.timestamp()}},
+        batch_size, dry_run)
+    return {'user_ids_converted': converted, 'created_at_backfilled': backfilled}
+
+
+def migrate_otp_timestamps(db, batch_size=MIGRATION_BATCH_SIZE, dry_run=False):
+    """Convert float OTP timestamps to dates so the TTL index can expire them."""
+    converted = _batched_updates(
+        db['otp_codes'], {'created_at': {'$type': 'double'}},
+        lambda doc: {'$set': {'created_at': datetime.fromtimestamp(doc['created_at'], timezone.utc)}},
+        batch_size, dry_run)
+    return {'otp_timestamps_converted': converted}
+
+
+def migrate_profile_images(db, batch_size=MIGRATION_BATCH_SIZE, dry_run=False):
+    """Move inline data-URL profile images to the image store (see image_store.py)."""
+    from image_store import create_image_store, save_profile_image
+
+    store = None if dry_run else create_image_store(db)
+
+    def move(doc):
+        try:
+            return {'$set': {'profileImageId': save_profile_image(store, str(doc['_id']), doc['profileImage'])},
+                    '$unset': {'profileImage': ''}}
+        except ValueError as e:
+            print(f"⚠️ Dropping unreadable profile image of user {doc['_id']}: {e}")
+            return {'$unset': {'profileImage': ''}}
+
+    moved = _batched_updates(db['users'], {'profileImage': {'$regex': '^data:'}}, move, batch_size, dry_run)
+    return {'profile_images_moved': moved}
+
+
+def main():
+    import argparse
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Normalize chat user_ids and create MongoDB indexes.")
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="Count documents to migrate without changing them")
+    args = parser.parse_args()
+
+    db = pymongo.MongoClient(os.getenv("MONGO_URI"))["bhagavad_gita_assistant"]
+    stats = migrate_chat_user_ids(db, args.batch_size, args.dry_run)
+    stats.update(migrate_otp_timestamps(db, args.batch_size, args.dry_run))
+    stats.update(migrate_profile_images(db, args.batch_size, args.dry_run))
+    if not args.dry_run:
+        ensure_indexes(db)
+    print(f"✅ Migration {'dry run ' if args.dry_run else ''}done: {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Production server configuration (gunicorn).
+
+    cd backend
+    gunicorn -c gunicorn.conf.py backend_integration:app
+    gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app
+
+Each worker process used to load its own gte-large ONNX session, over a
+gigabyte apiece, so memory rather than CPU capped the workers per node. With
+GUNICORN_PRELOAD on (the default) the app is imported once in the master,
+which loads the embedding model before forking; the workers then share its
+weights copy-on-write. Objects that exist at fork time are moved out of the
+garbage collector's reach (gc.freeze) so collections in the workers don't
+write to, and so copy, the shared pages. The LLM and Qdrant clients hold
+network connections (and gRPC channels don't survive fork), so every worker
+still creates its own, via the background model loader, right after forking.
+
+The embedding model runs with EMBED_THREADS=1 under preloading: onnxruntime's
+intra-op thread pool wouldn't exist in the forked workers, and with several
+workers the parallelism comes from the processes instead.
+
+Size the worker count from measured memory with `python worker_memory.py`.
+
+Workers share their metrics through METRICS_DIR (see metrics.py), so /metrics
+reports the whole server; the master clears the previous run's files.
+"""
+import gc
+import glob
+import os
+import sys
+
+PRELOAD = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+# gthread workers for the Flask app; ignored by the uvicorn worker class, which runs an event loop instead
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+# Chat requests wait on the LLM (and on the model load right after a restart)
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+pidfile = os.getenv("GUNICORN_PIDFILE", "/tmp/ask-krishna-gunicorn.pid")
+preload_app = PRELOAD
+
+# Read by metrics.py in every worker; set before the app is imported
+os.environ.setdefault("METRICS_DIR", "/tmp/ask-krishna-metrics")
+
+if PRELOAD:
+    # Read by backend_integration and rag_core when the master imports the app below
+    os.environ["MODEL_PRELOAD"] = "true"
+    os.environ.setdefault("EMBED_THREADS", "1")
+
+
+def on_starting(server):
+    # Snapshots from the previous run would otherwise be added to this one's totals
+    if os.environ["METRICS_DIR"]:
+        for path in glob.glob(os.path.join(os.environ["METRICS_DIR"], "*.json")):
+            os.remove(path)
+
+
+def when_ready(server):
+    # The app (and the embedding model) is loaded; freeze what's there before the first fork
+    if PRELOAD:
+        gc.collect()
+        gc.freeze()
+        server.log.info("Preloaded the app; %d objects frozen for sharing with workers", gc.get_freeze_count())
+
+
+def post_fork(server, worker):
+    backend = sys.modules.get("backend_integration")
+    if PRELOAD and backend is not None and backend.MODEL_WARMUP:
+        # Threads don't survive fork(): load the LLM and Qdrant clients (reusing the shared embedding model) here
+        backend.model_loader.start()
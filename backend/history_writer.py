@@ -0,0 +1,298 @@
+"""Write-behind persistence for chat history.
+
+`save_chat()` used to wait for an `insert_one` round trip to Atlas before the
+answer went back. `ChatHistoryWriter.submit()` only queues the document (its
+`_id` is generated by the caller, so the API can still return it) and a
+background thread writes queued chats with one ordered `bulk_write` whenever
+HISTORY_FLUSH_MAX_BATCH chats are waiting or HISTORY_FLUSH_INTERVAL_MS has
+passed. Failed flushes are retried with backoff; the queue is drained on
+shutdown. Until a chat is flushed, `pending()` still returns it, so
+/api/history/<chat_id> works immediately after the answer.
+
+Follow-up turns are queued as updates (`submit_update()`) in the same queue,
+so a turn appended to a chat that is still queued lands after its insert. Updates to a queued chat are also
+applied to the copy `pending()` returns.
+
+When the queue is full, submitting waits up to HISTORY_ENQUEUE_TIMEOUT_MS for
+room and then writes inline, keeping each chat's writes in order: a chat whose
+insert is still queued is written whole from its pending copy, and its queued
+operations are skipped.
+
+Deleting history must `discard()` the chats still queued first, or they would
+be written after the delete and reappear.
+"""
+import atexit
+import copy
+import os
+import queue
+import threading
+import time
+
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from metrics import observe_stage
+from resilience import backoff_delay
+
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "true").lower() == "true"
+HISTORY_FLUSH_MAX_BATCH = int(os.getenv("HISTORY_FLUSH_MAX_BATCH", "50"))
+HISTORY_FLUSH_INTERVAL_MS = float(os.getenv("HISTORY_FLUSH_INTERVAL_MS", "200"))
+HISTORY_FLUSH_RETRIES = int(os.getenv("HISTORY_FLUSH_RETRIES", "5"))
+HISTORY_QUEUE_MAX = int(os.getenv("HISTORY_QUEUE_MAX", "10000"))
+HISTORY_ENQUEUE_TIMEOUT_MS = float(os.getenv("HISTORY_ENQUEUE_TIMEOUT_MS", "2000"))
+HISTORY_DRAIN_TIMEOUT = float(os.getenv("HISTORY_DRAIN_TIMEOUT", "10"))  # seconds
+
+_DUPLICATE_KEY = 11000
+
+
+class ChatHistoryWriter:
+    """Background batching writer for chat_history documents."""
+
+    def __init__(self, collection, max_batch=HISTORY_FLUSH_MAX_BATCH, interval_ms=HISTORY_FLUSH_INTERVAL_MS,
+                 retries=HISTORY_FLUSH_RETRIES, max_queue=HISTORY_QUEUE_MAX, enqueue_timeout_ms=HISTORY_ENQUEUE_TIMEOUT_MS):
+        self.collection = collection
+        self.max_batch = max_batch
+        self.interval = interval_ms / 1000.0
+        self.retries = retries
+        self.enqueue_timeout = enqueue_timeout_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        # _id -> [document (None once inserted or discarded), queued operations], until they are written (or dropped)
+        self._pending = {}
+        self._skipped = set()  # _ids whose queued operations are dropped by the flusher (discarded or written inline)
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()  # held while a batch is written
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopping = False
+        # Metrics
+        self.flushes = 0
+        self.written = 0
+        self.failed_flushes = 0
+        self.dropped = 0
+        self.discarded = 0
+        self.sync_writes = 0
+        self.total_flush_time = 0.0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    def _ensure_worker(self):
+        # Threads don't survive fork(), so a forked worker starts its own flusher
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                self._pid = os.getpid()
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+                self._thread.start()
+
+    def _enqueue(self, document_id, operation, write_inline):
+        try:
+            self._queue.put((document_id, operation), timeout=self.enqueue_timeout)
+            return
+        except queue.Full:
+            pass
+        # Backpressure: the database is far behind, so write this one inline without overtaking
+        # the chat's queued writes (this operation is already counted in its pending entry)
+        with self._pending_lock:
+            entry = self._pending.get(document_id)
+            queued_before = entry[1] - 1 if entry is not None else 0
+            document = copy.deepcopy(entry[0]) if entry is not None and entry[0] is not None else None
+        if queued_before and document is None:
+            # Earlier updates of an already inserted chat are queued; there's no copy to write instead
+            self._queue.put((document_id, operation))
+            return
+        self.sync_writes += 1
+        try:
+            if not queued_before:
+                write_inline()
+            else:
+                # Its insert is still queued: write the pending copy (every queued update applied) in its place
+                with self._pending_lock:
+                    self._skipped.add(document_id)
+                with self._write_lock:
+                    self.collection.replace_one({'_id': document_id}, document, upsert=True)
+        finally:
+            self._forget([document_id])
+
+    def submit(self, document):
+        """Queue a document (which must already carry its `_id`) for insertion."""
+        self._ensure_worker()
+        with self._pending_lock:
+            self._pending[document['_id']] = [copy.deepcopy(document), 1]
+        self._enqueue(document['_id'], InsertOne(document), lambda: self.collection.insert_one(document))
+
+    def submit_update(self, document_id, update, user_id=None):
+        """Queue an update ($set and $push only) of the document with this `_id`.
+
+        With a user_id, only that user's document is updated, whether the write
+        is queued, applied to a pending insert or made inline.
+        """
+        self._ensure_worker()
+        query = {'_id': document_id}
+        if user_id is not None:
+            query['user_id'] = user_id
+        with self._pending_lock:
+            entry = self._pending.setdefault(document_id, [None, 0])
+            if entry[0] is not None and (user_id is None or entry[0].get('user_id') == user_id):
+                _apply_update(entry[0], update)
+            entry[1] += 1
+        self._enqueue(document_id, UpdateOne(query, update),
+                      lambda: self.collection.update_one(query, update))
+
+    def discard(self, document_id=None, user_id=None):
+        """Drop the queued writes of chats not inserted yet: one chat, or all of a user's.
+
+        With both arguments the chat must belong to the user. Waits for a batch
+        being written, so a delete issued afterwards sees everything that
+        wasn't dropped. Returns the `_id`s of the discarded chats.
+        """
+        with self._pending_lock:
+            discarded = [
+                pending_id for pending_id, (document, _) in self._pending.items()
+                if document is not None
+                and (document_id is None or pending_id == document_id)
+                and (user_id is None or document.get('user_id') == user_id)
+            ]
+            for pending_id in discarded:
+                self._pending[pending_id][0] = None
+                self._skipped.add(pending_id)
+        with self._write_lock:
+            pass
+        return discarded
+
+    def pending(self, document_id):
+        """A queued document that has not been written yet, or None."""
+        with self._pending_lock:
+            entry = self._pending.get(document_id)
+            return entry[0] if entry is not None else None
+
+    def _forget(self, document_ids):
+        with self._pending_lock:
+            for document_id in document_ids:
+                entry = self._pending.get(document_id)
+                if entry is not None:
+                    entry[1] -= 1
+                    if entry[1] <= 0:
+                        del self._pending[document_id]
+                        self._skipped.discard(document_id)
+
+    def _drop_skipped(self, batch):
+        """The batch without operations of discarded (or inline-written) chats, which are forgotten."""
+        with self._pending_lock:
+            skipped = [document_id for document_id, _ in batch if document_id in self._skipped]
+        if not skipped:
+            return batch
+        self.discarded += len(skipped)
+        self._forget(skipped)
+        return [(document_id, operation) for document_id, operation in batch if document_id not in skipped]
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.interval)]
+            except queue.Empty:
+                if self._stopping:
+                    return
+                continue
+            deadline = time.perf_counter() + self.interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        size = len(batch)
+        discarded_before = self.discarded
+        attempt = 0
+        while batch:
+            try:
+                with self._write_lock:
+                    batch = self._drop_skipped(batch)
+                    if not batch:
+                        break
+                    self.collection.bulk_write([operation for _, operation in batch], ordered=True)
+                break
+            except BulkWriteError as e:
+                # An ordered write stops at the first error; everything before it was applied
+                errors = e.details.get('writeErrors', [])
+                index = errors[0]['index'] if errors else 0
+                self._forget([document_id for document_id, _ in batch[:index]])
+                batch = batch[index:]
+                if errors and errors[0].get('code') == _DUPLICATE_KEY:
+                    # Inserted by an earlier attempt; carry on with the rest
+                    self._forget([batch[0][0]])
+                    batch = batch[1:]
+                    continue
+                error = e
+            except Exception as e:
+                error = e
+            attempt += 1
+            self.failed_flushes += 1
+            print(f"⚠️ Chat history flush failed (attempt {attempt}/{self.retries}): {error}")
+            if attempt >= self.retries:
+                self.dropped += len(batch)
+                print(f"❌ Dropped {len(batch)} chat history entries after {self.retries} attempts")
+                self._forget([document_id for document_id, _ in batch])
+                return
+            time.sleep(backoff_delay(attempt - 1))
+
+        elapsed = time.perf_counter() - started
+        self._forget([document_id for document_id, _ in batch])
+        self.flushes += 1
+        self.written += size - (self.discarded - discarded_before)
+        self.total_flush_time += elapsed
+        self.last_flush_ms = 1000.0 * elapsed
+        self.max_flush_ms = max(self.max_flush_ms, self.last_flush_ms)
+        observe_stage('history_flush', elapsed)
+
+    def drain(self, timeout=HISTORY_DRAIN_TIMEOUT):
+        """Flush everything queued and stop the background thread (called at exit)."""
+        thread = self._thread
+        if thread is None or not thread.is_alive() or self._pid != os.getpid():
+            return
+        self._stopping = True
+        thread.join(timeout)
+        if thread.is_alive():
+            print(f"⚠️ Chat history writer still had {self._queue.qsize()} entries queued at shutdown")
+
+    def stats(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'pending': len(self._pending),
+            'flushes': self.flushes,
+            'written': self.written,
+            'failed_flushes': self.failed_flushes,
+            'dropped': self.dropped,
+            'discarded': self.discarded,
+            'sync_writes': self.sync_writes,
+            'avg_batch_size': self.written / self.flushes if self.flushes else 0.0,
+            'avg_flush_ms': 1000.0 * self.total_flush_time / self.flushes if self.flushes else 0.0,
+            'last_flush_ms': self.last_flush_ms,
+            'max_flush_ms': self.max_flush_ms,
+        }
+
+
+def _apply_update(document, update):
+    """Mirror a queued $set/$push update onto the pending copy of a document."""
+    document.update(update.get('$set', {}))
+    for field, value in update.get('$push', {}).items():
+        values = value['$each'] if isinstance(value, dict) and '$each' in value else [value]
+        document.setdefault(field, []).extend(values)
+
+
+def create_history_writer(collection):
+    """The writer for chat_history, or None when HISTORY_WRITE_BEHIND is off."""
+    if not HISTORY_WRITE_BEHIND:
+        return None
+    writer = ChatHistoryWriter(collection)
+    atexit.register(writer.drain)
+    return writer
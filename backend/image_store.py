@@ -0,0 +1,190 @@
+"""Profile images, stored out of line from the user documents.
+
+Profile pictures used to be saved as data URLs on the user document, so every
+profile fetch, login and register response carried the whole image. Now an
+upload is decoded, downscaled to a PROFILE_IMAGE_SIZE version and a
+PROFILE_THUMBNAIL_SIZE thumbnail (both JPEG/PNG, with Pillow), and written to
+a blob store; the user document only keeps the image id. Without Pillow the
+upload is stored as-is, but only if its magic bytes match an allowed image
+type. Images are served by /api/images/<image_id> with the type detected from
+their bytes (never the client's), `X-Content-Type-Options: nosniff` and an
+ETag (the content digest), so browsers revalidate with If-None-Match and get a
+304 instead of the bytes.
+
+IMAGE_STORE picks the backend: `gridfs` (default, in the app's MongoDB) or
+`local` (files under IMAGE_STORE_PATH).
+"""
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+
+IMAGE_STORE = os.getenv("IMAGE_STORE", "gridfs").lower()  # gridfs | local
+IMAGE_STORE_PATH = os.getenv("IMAGE_STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                               "profile_images"))
+PROFILE_IMAGE_MAX_BYTES = int(os.getenv("PROFILE_IMAGE_MAX_BYTES", str(5 * 1024 * 1024)))
+PROFILE_IMAGE_SIZE = int(os.getenv("PROFILE_IMAGE_SIZE", "512"))  # longest side, pixels
+PROFILE_THUMBNAIL_SIZE = int(os.getenv("PROFILE_THUMBNAIL_SIZE", "128"))
+
+VARIANTS = ("thumb", "full")
+_DATA_URL = re.compile(r'^data:(image/[\w.+-]+);base64,(.*)$', re.DOTALL)
+_IMAGE_ID = re.compile(r'^[0-9a-f]{24}-[0-9a-f]{16}$')
+# Magic bytes of the image types accepted and served
+_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', "image/png"),
+    (b'\xff\xd8\xff', "image/jpeg"),
+    (b'GIF87a', "image/gif"),
+    (b'GIF89a', "image/gif"),
+)
+
+
+def is_data_url(value):
+    return isinstance(value, str) and value.startswith('data:')
+
+
+def decode_data_url(data_url):
+    """(mime type, bytes) of a base64 image data URL; raises ValueError for anything else."""
+    match = _DATA_URL.match(data_url.strip())
+    if not match:
+        raise ValueError("Profile image must be a base64 image data URL")
+    try:
+        raw = base64.b64decode(match.group(2), validate=False)
+    except (binascii.Error, ValueError):
+        raise ValueError("Profile image is not valid base64")
+    if len(raw) > PROFILE_IMAGE_MAX_BYTES:
+        raise ValueError(f"Profile image is larger than {PROFILE_IMAGE_MAX_BYTES // (1024 * 1024)} MB")
+    return match.group(1), raw
+
+
+def sniff_image_type(data):
+    """Mime type of `data` from its magic bytes, or None when it is not an allowed image type."""
+    for signature, mime in _SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return "image/webp"
+    return None
+
+
+def _resize(raw, size):
+    """(mime type, bytes) of the image scaled to fit size x size."""
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(raw)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        out = io.BytesIO()
+        if image.mode in ("RGBA", "LA", "P"):
+            image.save(out, format="PNG", optimize=True)
+            return "image/png", out.getvalue()
+        image.convert("RGB").save(out, format="JPEG", quality=85, optimize=True)
+        return "image/jpeg", out.getvalue()
+
+
+def image_variants(mime, raw):
+    """{variant: (mime type, bytes)}; without Pillow both variants are the upload as-is.
+
+    `mime` is the client's claim and is not trusted: without Pillow the type
+    comes from the magic bytes, and anything outside the allowlist is refused.
+    """
+    try:
+        return {"thumb": _resize(raw, PROFILE_THUMBNAIL_SIZE), "full": _resize(raw, PROFILE_IMAGE_SIZE)}
+    except ImportError:
+        detected = sniff_image_type(raw)
+        if detected is None:
+            raise ValueError("Profile image must be a PNG, JPEG, GIF or WebP image")
+        print("⚠️ Pillow is not installed; storing profile images without thumbnails")
+        return {variant: (detected, raw) for variant in VARIANTS}
+    except Exception as e:
+        raise ValueError(f"Could not read profile image: {e}")
+
+
+def is_image_id(value):
+    return isinstance(value, str) and _IMAGE_ID.match(value) is not None
+
+
+def image_etag(image_id, variant):
+    return f"{image_id.rsplit('-', 1)[1]}-{variant}"
+
+
+class LocalImageStore:
+    """One file per variant under a directory, with the mime type in a sidecar file."""
+
+    def __init__(self, path=IMAGE_STORE_PATH):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, image_id, variant):
+        return os.path.join(self.path, f"{image_id}.{variant}")
+
+    def put(self, image_id, variant, mime, data):
+        target = self._file(image_id, variant)
+        with open(target + ".tmp", "wb") as f:
+            f.write(data)
+        with open(target + ".type", "w") as f:
+            f.write(mime)
+        os.replace(target + ".tmp", target)
+
+    def get(self, image_id, variant):
+        target = self._file(image_id, variant)
+        try:
+            with open(target + ".type") as f:
+                mime = f.read().strip()
+            with open(target, "rb") as f:
+                return mime, f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, image_id):
+        for variant in VARIANTS:
+            for suffix in ("", ".type"):
+                try:
+                    os.remove(self._file(image_id, variant) + suffix)
+                except FileNotFoundError:
+                    pass
+
+
+class GridFSImageStore:
+    """Variants as GridFS files named <image_id>/<variant> in the profile_images bucket."""
+
+    def __init__(self, db, bucket="profile_images"):
+        import gridfs
+
+        self.fs = gridfs.GridFS(db, collection=bucket)
+
+    def put(self, image_id, variant, mime, data):
+        self.fs.put(data, filename=f"{image_id}/{variant}", contentType=mime)
+
+    def get(self, image_id, variant):
+        grid_out = self.fs.find_one({"filename": f"{image_id}/{variant}"})
+        if grid_out is None:
+            return None
+        return grid_out.content_type, grid_out.read()
+
+    def delete(self, image_id):
+        for variant in VARIANTS:
+            for grid_out in self.fs.find({"filename": f"{image_id}/{variant}"}):
+                self.fs.delete(grid_out._id)
+
+
+def save_profile_image(store, user_id, data_url):
+    """Store an uploaded data URL (original and thumbnail) and return its image id."""
+    mime, raw = decode_data_url(data_url)
+    image_id = f"{user_id}-{hashlib.sha256(raw).hexdigest()[:16]}"
+    if store.get(image_id, "thumb") is None:
+        for variant, (variant_mime, data) in image_variants(mime, raw).items():
+            store.put(image_id, variant, variant_mime, data)
+    return image_id
+
+
+def profile_image_url(image_id, variant="thumb"):
+    """Path the frontend loads a stored profile image from, or None."""
+    return f"/api/images/{image_id}?size={variant}" if image_id else None
+
+
+def create_image_store(db):
+    if IMAGE_STORE == "local":
+        return LocalImageStore()
+    return GridFSImageStore(db)
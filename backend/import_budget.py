@@ -0,0 +1,95 @@
+"""Import-time budget for the API process.
+
+Cold starts on autoscaled instances are dominated by imports, and until the
+RAG core was split out of the Streamlit app, serving /ping or a login meant
+importing Streamlit and the whole LlamaIndex stack first. This script imports
+everything backend_integration.py imports at module level (read from its
+source, so the list can't drift) under `python -X importtime`, prints the
+slowest imports, and fails if
+
+- the total exceeds IMPORT_BUDGET_MS, or
+- any of the heavy model stacks (HEAVY_MODULES) got imported; those belong in
+  the background model load, not on the auth/history path.
+
+    python import_budget.py                 # report and check
+    python import_budget.py --budget-ms 500 --top 25
+
+backend_integration itself isn't imported, since that connects to MongoDB.
+"""
+import ast
+import os
+import subprocess
+import sys
+
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "1500"))
+HEAVY_MODULES = ("streamlit", "llama_index", "fastembed", "onnxruntime", "qdrant_client", "grpc", "PIL",
+                 "torch", "transformers")
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BACKEND_DIR)
+
+
+def module_imports(path):
+    """Top-level modules imported at module level by the file at path."""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def measure(modules):
+    """[(cumulative µs, depth, module)] from -X importtime for importing modules in a fresh interpreter."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([BACKEND_DIR, ROOT_DIR, os.environ.get("PYTHONPATH", "")]))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "; ".join(f"import {m}" for m in modules)],
+                            cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing the API's dependencies failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), (len(name) - len(name.lstrip())) // 2, name.strip()))
+    return rows
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check the API's import time against a budget.")
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=15, help="How many of the slowest imports to list")
+    args = parser.parse_args()
+
+    modules = module_imports(os.path.join(BACKEND_DIR, "backend_integration.py"))
+    rows = measure(modules)
+    # Depth-0 entries are the imports the -c statement made; their cumulative times add up to the total
+    total_ms = sum(cumulative for cumulative, depth, _ in rows if depth == 0) / 1000.0
+    imported = {name for _, _, name in rows}
+    heavy = sorted(name for name in imported if name.split(".")[0] in HEAVY_MODULES)
+
+    print(f"{len(modules)} modules imported by backend_integration.py, {len(imported)} loaded in total")
+    print(f"{'cumulative ms':>14}  module")
+    for cumulative, depth, name in sorted(rows, reverse=True)[:args.top]:
+        print(f"{cumulative / 1000.0:>14.1f}  {'  ' * depth}{name}")
+    print(f"Total: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+
+    failed = False
+    if heavy:
+        print(f"❌ Heavy model stacks on the API import path: {', '.join(heavy[:10])}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"❌ Import time {total_ms:.1f} ms is over the {args.budget_ms:.0f} ms budget")
+        failed = True
+    if not failed:
+        print("✅ API import path is within budget")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,491 @@
+"""Offline end-to-end load benchmark of the Flask API.
+
+Runs the real app (backend_integration) on a local HTTP server with every
+external service replaced by a local stand-in, so it costs no Groq quota and
+touches neither Qdrant Cloud nor Atlas:
+
+- Qdrant: an in-memory client (`location=":memory:"`) seeded with a synthetic
+  corpus (or passages from --corpus, one per blank-line-separated paragraph);
+- the LLM: `FakeLLM`, which answers with a `<think>` block and an answer after
+  --llm-first-token-ms, at --llm-tokens-per-second, streaming or not;
+- the embedding model: a hashing embedder by default, or the real gte-large
+  with --embedder fastembed (CPU-bound, and needs the model downloaded);
+- MongoDB: mongomock (`pip install -r requirements-bench.txt`), or a local server with
+  --mongo-uri (it writes to the app's bhagavad_gita_assistant database there).
+
+--concurrency virtual users each register an account (through the OTP flow)
+and then send a weighted mix of chat, streamed chat, history and auth
+requests. Throughput and p50/p95/p99 latency are reported per endpoint, the
+per-stage means from metrics.py alongside, and everything is written as JSON
+to --output; pass a previous results file as --compare to see the change.
+The app's answer and embedding caches stay on, as in production; set
+ANSWER_CACHE_BACKEND=off to send every chat through the whole pipeline.
+
+    python load_benchmark.py --concurrency 16 --requests 2000
+    python load_benchmark.py --duration 60 --mix chat=1 --output after.json --compare before.json
+"""
+import argparse
+import contextlib
+import hashlib
+import http.client
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BACKEND_DIR)
+
+DEFAULT_MIX = "chat=4,chat_stream=2,history=2,history_chat=1,login=1,profile=1"
+TOPICS = ["karma yoga", "dharma", "the eternal soul", "devotion", "detachment", "meditation", "the three gunas",
+          "duty in battle", "renunciation", "knowledge of the self", "the nature of the mind", "surrender to Krishna",
+          "equanimity", "action without attachment to results", "the field and its knower", "divine qualities"]
+QUESTIONS = ["What does Krishna teach about {}?", "How should I practise {} in daily life?",
+             "Why does Arjuna ask about {}?", "Explain {} in simple words.", "What is the role of {} in the Gita?"]
+FOLLOW_UPS = ["Can you explain that more simply?", "Which verse says this?", "How does that apply to work?"]
+WORDS = ("Krishna Arjuna soul body action duty yoga mind senses wisdom devotion self peace desire anger "
+         "knowledge sacrifice nature supreme eternal battle chariot renounce attachment fruit steady").split()
+
+
+# --- Stand-ins ---
+
+class HashingEmbedder:
+    """Deterministic bag-of-words vectors (feature hashing), normalized; no model download."""
+
+    model_name = "hashing-embedder"
+
+    def __init__(self, dim=384, latency_ms=0.0):
+        self.dim = dim
+        self.latency = latency_ms / 1000.0
+
+    def _embed(self, text):
+        vector = [0.0] * self.dim
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.md5(word.encode()).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dim] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def get_query_embedding(self, query):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._embed(query)
+
+    def get_text_embedding_batch(self, texts, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+
+class FakeCompletion:
+    __slots__ = ('text', 'delta')
+
+    def __init__(self, text, delta=None):
+        self.text = text
+        self.delta = delta
+
+
+class FakeLLM:
+    """LLM stand-in: `<think>` reasoning then an answer, with a first-token delay and a token rate."""
+
+    def __init__(self, first_token_ms=300.0, tokens_per_second=250.0, think_tokens=60, answer_tokens=120, seed=0):
+        self.first_token = first_token_ms / 1000.0
+        self.token_interval = 1.0 / tokens_per_second if tokens_per_second > 0 else 0.0
+        self.think_tokens = think_tokens
+        self.answer_tokens = answer_tokens
+        self.seed = seed
+
+    def _tokens(self, prompt):
+        rng = random.Random(f"{self.seed}:{prompt}")
+        tokens = ["<think>", "\n"] + [rng.choice(WORDS) + " " for _ in range(self.think_tokens)] + ["\n</think>\n\n"]
+        return tokens + [rng.choice(WORDS) + ("." if i % 15 == 14 else "") + " " for i in range(self.answer_tokens)]
+
+    def complete(self, prompt, **kwargs):
+        tokens = self._tokens(prompt)
+        time.sleep(self.first_token + self.token_interval * len(tokens))
+        return FakeCompletion("".join(tokens))
+
+    def stream_complete(self, prompt, **kwargs):
+        time.sleep(self.first_token)
+        text = ""
+        for token in self._tokens(prompt):
+            if self.token_interval:
+                time.sleep(self.token_interval)
+            text += token
+            yield FakeCompletion(text, token)
+
+
+def synthetic_corpus(size, seed=0):
+    rng = random.Random(seed)
+    passages = []
+    for i in range(size):
+        topic = TOPICS[i % len(TOPICS)]
+        sentences = [f"This passage is about {topic}."]
+        for _ in range(rng.randint(4, 9)):
+            sentences.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 18))).capitalize() + ".")
+        passages.append(" ".join(sentences))
+    return passages
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [p.strip() for p in re.split(r"\n\s*\n", f.read()) if len(p.strip()) > 40]
+
+
+def seeded_qdrant(passages, embedder, collection_name):
+    from qdrant_client import QdrantClient
+    from qdrant_client.http import models
+
+    client = QdrantClient(location=":memory:")
+    for start in range(0, len(passages), 256):
+        batch = passages[start:start + 256]
+        vectors = embedder.get_text_embedding_batch(batch)
+        if start == 0:
+            client.create_collection(collection_name=collection_name, vectors_config=models.VectorParams(
+                size=len(vectors[0]), distance=models.Distance.COSINE))
+        client.upsert(collection_name=collection_name, points=[
+            models.PointStruct(id=start + i, vector=vector, payload={"context": text})
+            for i, (text, vector) in enumerate(zip(batch, vectors))
+        ])
+    return client
+
+
+def start_app(args):
+    """Import the app wired to the stand-ins and serve it on a local port; returns (backend_integration, server)."""
+    os.environ.setdefault("MAIL_BACKEND", "stub")
+    os.environ.setdefault("REQUEST_LOG", "false")
+    os.environ.setdefault("SESSION_SECRET", "load-benchmark")
+    os.environ.setdefault("MODEL_WARMUP_LLM", "false")
+    os.environ["MONGO_URI"] = args.mongo_uri or "mongodb://localhost"
+    sys.path[:0] = [BACKEND_DIR, ROOT_DIR]
+
+    if not args.mongo_uri:
+        import mongomock
+        import mongomock.gridfs
+        import pymongo
+
+        mongomock.gridfs.enable_gridfs_integration()
+        pymongo.MongoClient = mongomock.MongoClient
+
+    import rag_core
+
+    passages = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.corpus_size, args.seed)
+    if args.embedder == "fastembed":
+        # The production model, wrapped in the query batcher as in the app
+        embedder = rag_core.load_embed_model()
+        client = seeded_qdrant(passages, embedder, rag_core.COLLECTION_NAME)
+    else:
+        embedder = HashingEmbedder(args.embedding_dim, args.embed_latency_ms)
+        client = seeded_qdrant(passages, embedder, rag_core.COLLECTION_NAME)
+        if rag_core.EMBED_BATCH_MAX_SIZE > 1:
+            embedder = rag_core.EmbeddingBatcher(embedder)
+    llm = FakeLLM(args.llm_first_token_ms, args.llm_tokens_per_second, args.think_tokens, args.answer_tokens)
+    rag_core.load_text_indexes(client)
+    # initialize_models() hands these to the app instead of connecting to Groq and Qdrant Cloud
+    rag_core._models = (embedder, llm, client)
+
+    import backend_integration
+    from werkzeug.serving import make_server
+
+    backend_integration.model_loader.wait()
+    server = make_server("127.0.0.1", 0, backend_integration.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="benchmark-server", daemon=True).start()
+    print(f"✅ App serving {len(passages)} passages on port {server.port}")
+    return backend_integration, server
+
+
+# --- Load generation ---
+
+def call(port, method, path, body=None, token=None, stream=False):
+    """(status, parsed JSON or None, seconds, seconds to the first streamed event or None)."""
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    started = time.perf_counter()
+    first_event = None
+    try:
+        connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        response = connection.getresponse()
+        if stream and response.status == 200:
+            data, event = None, None
+            for line in response:
+                line = line.decode("utf-8").rstrip("\n")
+                if line.startswith("event: "):
+                    event = line[7:]
+                    if first_event is None and event in ("thinking", "answer"):
+                        first_event = time.perf_counter() - started
+                elif line.startswith("data: ") and event in ("done", "error"):
+                    data = json.loads(line[6:])
+                    if event == "error":
+                        return 500, data, time.perf_counter() - started, first_event
+            return response.status, data, time.perf_counter() - started, first_event
+        raw = response.read()
+        elapsed = time.perf_counter() - started
+        try:
+            data = json.loads(raw) if raw else None
+        except ValueError:
+            data = None
+        return response.status, data, elapsed, first_event
+    finally:
+        connection.close()
+
+
+class VirtualUser:
+    def __init__(self, index, port, backend, rng, follow_up_ratio):
+        self.port = port
+        self.backend = backend
+        self.rng = rng
+        self.follow_up_ratio = follow_up_ratio
+        self.email = f"bench-{index}-{os.getpid()}-{int(time.time())}@example.com"
+        self.password = "benchmark"
+        self.token = None
+        self.chat_ids = []
+
+    def register(self, record):
+        call(self.port, "POST", "/api/auth/send-registration-otp", {"email": self.email})
+        # The stub mail backend doesn't deliver; read the code from the database like the mail would carry it
+        otp = self.backend.db["otp_codes"].find_one({"email": self.email, "type": "registration"})["otp"]
+        call(self.port, "POST", "/api/auth/verify-registration-otp", {"email": self.email, "otp": otp})
+        status, data, elapsed, _ = call(self.port, "POST", "/api/auth/register",
+                                        {"username": self.email.split("@")[0], "email": self.email,
+                                         "password": self.password})
+        record("register", status, elapsed)
+        if status != 200:
+            raise RuntimeError(f"Registration failed ({status}): {data}")
+        self.token = data["token"]
+
+    def question(self):
+        return self.rng.choice(QUESTIONS).format(self.rng.choice(TOPICS))
+
+    def chat_body(self):
+        if self.chat_ids and self.rng.random() < self.follow_up_ratio:
+            return {"prompt": self.rng.choice(FOLLOW_UPS), "chat_id": self.rng.choice(self.chat_ids)}
+        return {"prompt": self.question(), "language": "english"}
+
+    def run(self, operation, record):
+        if operation in ("chat", "chat_stream"):
+            stream = operation == "chat_stream"
+            status, data, elapsed, first_event = call(self.port, "POST", "/api/chat/stream" if stream else "/api/chat",
+                                                      self.chat_body(), self.token, stream=stream)
+            if status == 200 and data and data.get("chat_id") and data["chat_id"] not in self.chat_ids:
+                self.chat_ids.append(data["chat_id"])
+            if first_event is not None:
+                record("chat_stream_first_event", status, first_event)
+        elif operation == "history":
+            status, _, elapsed, _ = call(self.port, "GET", "/api/history", token=self.token)
+        elif operation == "history_chat":
+            if not self.chat_ids:
+                return self.run("chat", record)
+            chat_id = self.rng.choice(self.chat_ids)
+            status, _, elapsed, _ = call(self.port, "GET", f"/api/history/{chat_id}", token=self.token)
+        elif operation == "login":
+            status, _, elapsed, _ = call(self.port, "POST", "/api/auth/login",
+                                         {"email": self.email, "password": self.password})
+        elif operation == "profile":
+            status, _, elapsed, _ = call(self.port, "GET", "/api/auth/profile", token=self.token)
+        else:
+            raise ValueError(f"Unknown operation {operation}")
+        record(operation, status, elapsed)
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}  # endpoint -> [(seconds, ok)]
+        self._lock = threading.Lock()
+        self.enabled = True
+
+    def __call__(self, endpoint, status, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append((seconds, 200 <= status < 300))
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(q / 100.0 * len(sorted_values)) - 1))]
+
+
+def summarize(samples, wall_seconds):
+    results = {}
+    for endpoint, entries in sorted(samples.items()):
+        latencies = sorted(1000.0 * seconds for seconds, _ in entries)
+        results[endpoint] = {
+            'count': len(entries),
+            'errors': sum(1 for _, ok in entries if not ok),
+            'throughput_rps': round(len(entries) / wall_seconds, 2) if wall_seconds else None,
+            'mean_ms': round(sum(latencies) / len(latencies), 2),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'max_ms': round(latencies[-1], 2),
+        }
+    return results
+
+
+def stage_means():
+    from metrics import STAGE_SECONDS
+
+    means = {}
+    for (stage,), counts in sorted(STAGE_SECONDS.snapshot().items()):
+        # Bucket counts, then the sum of the observations
+        count = sum(counts[:-1])
+        means[stage] = {'count': count, 'mean_ms': round(1000.0 * counts[-1] / count, 2) if count else 0.0}
+    return means
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def run_load(users, mix, total_requests, duration, warmup, seed):
+    recorder = Recorder()
+    operations, weights = zip(*mix.items())
+    lock = threading.Lock()
+    issued = {'count': 0}
+    deadline = {'at': None}
+
+    def take():
+        with lock:
+            if deadline['at'] is not None:
+                return time.perf_counter() < deadline['at']
+            if issued['count'] >= total_requests:
+                return False
+            issued['count'] += 1
+            return True
+
+    def worker(user, n_warmup):
+        rng = random.Random(f"{seed}:{user.email}")
+        for _ in range(n_warmup):
+            user.run(rng.choices(operations, weights)[0], lambda *a: None)
+        barrier.wait()
+        while take():
+            user.run(rng.choices(operations, weights)[0], recorder)
+
+    barrier = threading.Barrier(len(users) + 1)
+    threads = [threading.Thread(target=worker, args=(user, warmup // len(users)), daemon=True) for user in users]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    if duration:
+        deadline['at'] = started + duration
+    for thread in threads:
+        thread.join()
+    return recorder.samples, time.perf_counter() - started
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_report(results, previous=None):
+    print(f"\n{'endpoint':<26}{'count':>7}{'errors':>7}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'max ms':>10}")
+    for endpoint, stats in results['endpoints'].items():
+        throughput = f"{stats['throughput_rps']:.1f}" if stats['throughput_rps'] is not None else "-"
+        print(f"{endpoint:<26}{stats['count']:>7}{stats['errors']:>7}{throughput:>9}"
+              f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+    print(f"Total: {results['total_requests']} requests in {results['wall_seconds']:.1f}s, "
+          f"{results['throughput_rps']:.1f} req/s")
+    if results['stages']:
+        print("\nStage means: " + ", ".join(f"{stage} {stats['mean_ms']:.1f} ms"
+                                            for stage, stats in results['stages'].items()))
+    if previous:
+        print(f"\nChange since {previous.get('commit') or 'the previous run'}:")
+        for endpoint, stats in results['endpoints'].items():
+            before = previous.get('endpoints', {}).get(endpoint)
+            if not before:
+                continue
+            changes = []
+            for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+                if before.get(key) and stats[key] is not None:
+                    changes.append(f"{key} {100.0 * (stats[key] - before[key]) / before[key]:+.1f}%")
+            print(f"  {endpoint:<24}{', '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load benchmark of the API with local stand-ins.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Virtual users sending requests in parallel")
+    parser.add_argument("--requests", type=int, default=500, help="Measured requests in total")
+    parser.add_argument("--duration", type=float, help="Run for this many seconds instead of --requests")
+    parser.add_argument("--warmup", type=int, default=40, help="Unmeasured requests before the run")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Operation weights, e.g. chat=4,history=2,login=1")
+    parser.add_argument("--follow-up-ratio", type=float, default=0.3, help="Share of chats that continue one")
+    parser.add_argument("--llm-first-token-ms", type=float, default=300.0)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=250.0)
+    parser.add_argument("--think-tokens", type=int, default=60)
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    parser.add_argument("--embedder", choices=("hashing", "fastembed"), default="hashing")
+    parser.add_argument("--embedding-dim", type=int, default=384)
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="Added to each hashing embedder call")
+    parser.add_argument("--corpus", help="Text file of passages separated by blank lines (default: synthetic)")
+    parser.add_argument("--corpus-size", type=int, default=700, help="Synthetic passages")
+    parser.add_argument("--mongo-uri", help="Local MongoDB to use instead of mongomock")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="load-benchmark.json")
+    parser.add_argument("--compare", help="Results file of an earlier run to compare against")
+    parser.add_argument("--verbose", action="store_true", help="Keep the app's own log output")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    quiet = open(os.devnull, "w") if not args.verbose else None
+    if quiet:
+        import logging
+
+        # The development server logs every request
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+        backend, server = start_app(args)
+        users = [VirtualUser(i, server.port, backend, random.Random(f"{args.seed}:{i}"), args.follow_up_ratio)
+                 for i in range(args.concurrency)]
+        registrations = Recorder()
+        for user in users:
+            user.register(registrations)
+        samples, wall = run_load(users, mix, args.requests, args.duration, args.warmup, args.seed)
+        server.shutdown()
+
+    endpoints = summarize(samples, wall)
+    # Registrations happen before the measured run, so they get latencies but no throughput
+    endpoints.update(summarize(registrations.samples, None))
+    measured = sum(stats['count'] for name, stats in endpoints.items()
+                   if name not in ('register', 'chat_stream_first_event'))
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'verbose')},
+        'wall_seconds': round(wall, 3),
+        'total_requests': measured,
+        'throughput_rps': round(measured / wall, 2) if wall else 0.0,
+        'endpoints': endpoints,
+        'stages': stage_means(),
+    }
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_report(results, previous)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n📄 Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
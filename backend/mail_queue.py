@@ -0,0 +1,329 @@
+"""Outbound email, sent by background workers over reused SMTP sessions.
+
+`send_email()` used to connect, STARTTLS, log in and send inside the OTP
+request handlers, so a slow mail server held a request thread for up to the
+20-second SMTP timeout. `MailQueue.send()` only queues the message. Each of
+MAIL_WORKERS threads owns one authenticated SMTP session (together, a small
+connection pool), takes up to MAIL_BATCH_MAX queued messages at a time and
+sends them over that session, reconnecting when the server has dropped it or
+it has been idle for MAIL_SMTP_IDLE_SECONDS. Transient failures are retried
+with backoff; permanent (5xx) rejections are not.
+
+MAIL_BACKEND picks the sink: `smtp` (the default when SMTP_* is configured),
+`console` (prints messages, the default otherwise, as before) or `stub`
+(keeps sent messages in memory for tests).
+"""
+import atexit
+import os
+import queue
+import smtplib
+import threading
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from resilience import backoff_delay
+
+SMTP_HOST = os.getenv("SMTP_HOST")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USERNAME = os.getenv("SMTP_USERNAME")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+EMAIL_FROM = os.getenv("EMAIL_FROM") or SMTP_USERNAME
+SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "true").lower() == "true"
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "20"))
+SMTP_CONFIGURED = bool(SMTP_HOST and SMTP_USERNAME and SMTP_PASSWORD and EMAIL_FROM)
+
+MAIL_BACKEND = os.getenv("MAIL_BACKEND", "smtp" if SMTP_CONFIGURED else "console").lower()  # smtp | console | stub
+MAIL_WORKERS = int(os.getenv("MAIL_WORKERS", "2"))
+MAIL_BATCH_MAX = int(os.getenv("MAIL_BATCH_MAX", "20"))
+MAIL_BATCH_WINDOW_MS = float(os.getenv("MAIL_BATCH_WINDOW_MS", "50"))
+MAIL_RETRIES = int(os.getenv("MAIL_RETRIES", "4"))
+MAIL_RETRY_BASE_DELAY = float(os.getenv("MAIL_RETRY_BASE_DELAY", "1.0"))  # seconds
+MAIL_QUEUE_MAX = int(os.getenv("MAIL_QUEUE_MAX", "1000"))
+MAIL_SMTP_IDLE_SECONDS = float(os.getenv("MAIL_SMTP_IDLE_SECONDS", "60"))
+MAIL_DRAIN_TIMEOUT = float(os.getenv("MAIL_DRAIN_TIMEOUT", "10"))  # seconds
+
+
+class OutgoingEmail:
+    __slots__ = ('recipient', 'subject', 'body', 'queued_at')
+
+    def __init__(self, recipient, subject, body):
+        self.recipient = recipient
+        self.subject = subject
+        self.body = body
+        self.queued_at = time.time()
+
+    def as_string(self, sender):
+        message = MIMEMultipart()
+        message["From"] = sender
+        message["To"] = self.recipient
+        message["Subject"] = self.subject
+        message.attach(MIMEText(self.body, "plain", "utf-8"))
+        return message.as_string()
+
+
+def _is_permanent(error):
+    """5xx replies (bad recipient, rejected sender) won't succeed on a retry."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+
+class SmtpSink:
+    """One authenticated SMTP session, reused across batches by a single worker."""
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, username=SMTP_USERNAME, password=SMTP_PASSWORD,
+                 sender=EMAIL_FROM, use_tls=SMTP_USE_TLS, timeout=SMTP_TIMEOUT, idle_seconds=MAIL_SMTP_IDLE_SECONDS):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sender = sender
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self.idle_seconds = idle_seconds
+        self._server = None
+        self._last_used = 0.0
+        self.connects = 0
+
+    def _connection(self):
+        if self._server is not None and time.monotonic() - self._last_used > self.idle_seconds:
+            # Servers close idle sessions; start a fresh one rather than fail the first send
+            self.close()
+        if self._server is None:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            try:
+                if self.use_tls:
+                    server.starttls()
+                server.login(self.username, self.password)
+            except Exception:
+                server.close()
+                raise
+            self._server = server
+            self.connects += 1
+        return self._server
+
+    def send_batch(self, messages):
+        """Send messages over the session; returns [(message, error)] for the ones that failed."""
+        failed = []
+        for i, message in enumerate(messages):
+            try:
+                try:
+                    self._connection().sendmail(self.sender, [message.recipient], message.as_string(self.sender))
+                except smtplib.SMTPServerDisconnected:
+                    # Dropped between batches; one reconnect before counting it as a failure
+                    self.close()
+                    self._connection().sendmail(self.sender, [message.recipient], message.as_string(self.sender))
+                self._last_used = time.monotonic()
+            except Exception as e:
+                failed.append((message, e))
+                if not _is_permanent(e):
+                    # The session itself is suspect; retry the rest of the batch later too
+                    self.close()
+                    failed.extend((rest, e) for rest in messages[i + 1:])
+                    break
+        return failed
+
+    def close(self):
+        server, self._server = self._server, None
+        if server is not None:
+            try:
+                server.quit()
+            except Exception:
+                server.close()
+
+
+class ConsoleSink:
+    """Development fallback when SMTP isn't configured: print the message (and so the OTP)."""
+
+    def send_batch(self, messages):
+        for message in messages:
+            print(f"📧 Email for {message.recipient} ({message.subject}):\n{message.body}")
+        return []
+
+    def close(self):
+        pass
+
+
+class StubSink:
+    """Collects messages in memory instead of sending them; shared by all workers."""
+
+    def __init__(self):
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send_batch(self, messages):
+        with self._lock:
+            self.sent.extend(messages)
+        return []
+
+    def close(self):
+        pass
+
+
+class MailQueue:
+    """Queue of outgoing email drained by background workers, each with its own sink."""
+
+    def __init__(self, sink_factory, workers=MAIL_WORKERS, max_batch=MAIL_BATCH_MAX,
+                 window_ms=MAIL_BATCH_WINDOW_MS, retries=MAIL_RETRIES, max_queue=MAIL_QUEUE_MAX):
+        self.sink_factory = sink_factory
+        self.workers = max(1, workers)
+        self.max_batch = max_batch
+        self.window = window_ms / 1000.0
+        self.retries = retries
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._sinks = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopping = False
+        # Metrics
+        self.queued = 0
+        self.sent = 0
+        self.batches = 0
+        self.retried = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_delivery_time = 0.0
+        self.max_delivery_ms = 0.0
+
+    def _ensure_workers(self):
+        # Threads don't survive fork(), so a forked worker starts its own senders
+        if self._threads and self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+            return
+        with self._lock:
+            if self._threads and self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                self._threads, self._sinks = [], []
+            self._pid = os.getpid()
+            self._stopping = False
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                sink = self.sink_factory()
+                self._sinks.append(sink)
+                thread = threading.Thread(target=self._run, args=(sink,), daemon=True,
+                                          name=f"mail-worker-{len(self._threads)}")
+                self._threads.append(thread)
+                thread.start()
+
+    def send(self, recipient, subject, body):
+        """Queue a plain-text email. Returns False if the queue is full."""
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait(OutgoingEmail(recipient, subject, body))
+        except queue.Full:
+            self.rejected += 1
+            print(f"⚠️ Mail queue full; not sending '{subject}' to {recipient}")
+            return False
+        self.queued += 1
+        return True
+
+    def _run(self, sink):
+        try:
+            while True:
+                try:
+                    batch = [self._queue.get(timeout=0.5)]
+                except queue.Empty:
+                    if self._stopping:
+                        return
+                    continue
+                deadline = time.perf_counter() + self.window
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self._queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+                self._deliver(sink, batch)
+        finally:
+            sink.close()
+
+    def _deliver(self, sink, batch):
+        self.batches += 1
+        for attempt in range(self.retries):
+            try:
+                failed = sink.send_batch(batch)
+            except Exception as e:
+                failed = [(message, e) for message in batch]
+            failed_ids = {id(message) for message, _ in failed}
+            self._record_sent([message for message in batch if id(message) not in failed_ids])
+            batch = []
+            for message, error in failed:
+                if _is_permanent(error):
+                    self.failed += 1
+                    print(f"❌ Email to {message.recipient} rejected: {error}")
+                else:
+                    batch.append(message)
+            if not batch:
+                return
+            print(f"⚠️ Sending {len(batch)} emails failed (attempt {attempt + 1}/{self.retries}): {failed[-1][1]}")
+            if attempt < self.retries - 1:
+                self.retried += len(batch)
+                time.sleep(backoff_delay(attempt, base_delay=MAIL_RETRY_BASE_DELAY))
+        self.failed += len(batch)
+        for message in batch:
+            print(f"❌ Gave up on email to {message.recipient} ({message.subject}) after {self.retries} attempts")
+
+    def _record_sent(self, messages):
+        now = time.time()
+        for message in messages:
+            delay = now - message.queued_at
+            self.total_delivery_time += delay
+            self.max_delivery_ms = max(self.max_delivery_ms, 1000.0 * delay)
+        self.sent += len(messages)
+
+    def drain(self, timeout=MAIL_DRAIN_TIMEOUT):
+        """Send everything queued and stop the workers (called at exit)."""
+        threads = [t for t in self._threads if t.is_alive()]
+        if not threads or self._pid != os.getpid():
+            return
+        self._stopping = True
+        deadline = time.monotonic() + timeout
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        if self._queue.qsize():
+            print(f"⚠️ Mail queue still had {self._queue.qsize()} emails at shutdown")
+
+    def outbox(self):
+        """Messages captured so far by a stub sink (MAIL_BACKEND=stub)."""
+        sinks = {id(sink): sink for sink in self._sinks if isinstance(sink, StubSink)}
+        return [message for sink in sinks.values() for message in sink.sent]
+
+    def stats(self):
+        return {
+            'backend': MAIL_BACKEND,
+            'workers': len(self._threads),
+            'queue_depth': self._queue.qsize(),
+            'queued': self.queued,
+            'sent': self.sent,
+            'batches': self.batches,
+            'retried': self.retried,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'smtp_connects': sum(getattr(sink, 'connects', 0) for sink in self._sinks),
+            'avg_delivery_ms': 1000.0 * self.total_delivery_time / self.sent if self.sent else 0.0,
+            'max_delivery_ms': self.max_delivery_ms,
+        }
+
+
+def create_mail_queue(backend=MAIL_BACKEND):
+    """The mail queue for the configured MAIL_BACKEND."""
+    if backend == "smtp":
+        if not SMTP_CONFIGURED:
+            print("⚠️ MAIL_BACKEND=smtp but SMTP_HOST, SMTP_USERNAME, SMTP_PASSWORD or EMAIL_FROM is unset; "
+                  "printing emails to the console")
+            sink_factory = ConsoleSink
+        else:
+            sink_factory = SmtpSink
+    elif backend == "stub":
+        stub = StubSink()
+        sink_factory = lambda: stub
+    else:
+        sink_factory = ConsoleSink
+    mail_queue = MailQueue(sink_factory)
+    atexit.register(mail_queue.drain)
+    return mail_queue
@@ -0,0 +1,136 @@
+"""Background model loading and warm-up.
+
+Models used to be loaded by the first /api/chat after a deploy: downloading
+and initializing gte-large, opening the Qdrant client and building the text
+indexes inside that request, which the proxy often timed out. `ModelLoader`
+starts all of that in a background thread at startup, then warms each
+dependency with a dummy call (one embedding, one vector search and, unless
+MODEL_WARMUP_LLM is off, one short LLM completion) so first requests don't
+pay for cold connections either.
+
+Requests that arrive before loading finishes wait on the same load for up
+to MODEL_READY_TIMEOUT seconds instead of each starting their own, and /ready
+reports per-component state and timings for the orchestrator's readiness
+probe (/ping stays a pure liveness check).
+"""
+import os
+import threading
+import time
+
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() == "true"
+MODEL_WARMUP_LLM = os.getenv("MODEL_WARMUP_LLM", "true").lower() == "true"
+# Set by gunicorn.conf.py: the master preloads only the embedding model, workers start the loader after fork
+MODEL_PRELOAD = os.getenv("MODEL_PRELOAD", "false").lower() == "true"
+MODEL_READY_TIMEOUT = float(os.getenv("MODEL_READY_TIMEOUT", "30"))  # seconds a request waits for the load
+WARMUP_QUERY = "What does Krishna teach about duty?"
+
+
+class ModelsNotReady(TimeoutError):
+    """The models didn't finish loading within the wait timeout (or loading failed)."""
+
+
+class ModelLoader:
+    """Loads (embed_model, llm, client) once per process in a background thread.
+
+    `load` returns the models; each warm-up is a (component name, fn(models))
+    pair run afterwards. Only `load` decides readiness: a failed warm-up is
+    reported but the models are still used.
+    """
+
+    def __init__(self, load, warmups=()):
+        self.load = load
+        self.warmups = list(warmups)
+        self.models = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._error = None
+        self._started_at = None
+        self._components = {}
+
+    def _reset(self):
+        self._done = threading.Event()
+        self._error = None
+        self._started_at = time.time()
+        self._components = {name: {'state': 'pending'} for name in ['models'] + [name for name, _ in self.warmups]}
+
+    def start(self):
+        """Begin loading unless it's done or already running in this process; retries after a failure."""
+        if self.models is not None:
+            return
+        with self._lock:
+            running = self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
+            if self.models is not None or running:
+                return
+            # Also covers a fork mid-load: the loading thread didn't come along
+            self._reset()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="model-loader", daemon=True)
+            self._thread.start()
+
+    def _timed(self, name, fn):
+        component = self._components[name]
+        component['state'] = 'loading'
+        started = time.perf_counter()
+        try:
+            result = fn()
+        except Exception as e:
+            component.update(state='failed', error=str(e), seconds=round(time.perf_counter() - started, 3))
+            raise
+        component.update(state='ready', seconds=round(time.perf_counter() - started, 3))
+        return result
+
+    def _run(self):
+        try:
+            models = self._timed('models', self.load)
+        except Exception as e:
+            print(f"❌ Model loading failed: {e}")
+            self._error = e
+            self._done.set()
+            return
+        self.models = models
+        # Requests can go ahead now; the warm-ups only take the cold start off their latency
+        self._done.set()
+        print(f"✅ Models loaded in {self._components['models']['seconds']}s")
+        for name, warmup in self.warmups:
+            try:
+                self._timed(name, lambda: warmup(models))
+            except Exception as e:
+                print(f"⚠️ Warm-up of {name} failed: {e}")
+
+    def wait(self, timeout=MODEL_READY_TIMEOUT):
+        """The loaded models, waiting up to timeout seconds; raises ModelsNotReady."""
+        if self.models is not None:
+            return self.models
+        self.start()
+        if not self._done.wait(timeout) or self.models is None:
+            raise ModelsNotReady(f"Models not ready after {timeout}s" if self._error is None
+                                 else f"Model loading failed: {self._error}")
+        return self.models
+
+    def status(self):
+        return {
+            'ready': self.models is not None,
+            'started_at': self._started_at,
+            'components': {name: dict(component) for name, component in self._components.items()},
+        }
+
+
+def default_warmups(collection_name):
+    """Dummy embedding, vector search and (optionally) LLM calls for the RAG models."""
+    vector = {}
+
+    def embedding(models):
+        vector['query'] = models[0].get_query_embedding(WARMUP_QUERY)
+
+    def vector_search(models):
+        models[2].query_points(collection_name=collection_name, query=vector['query'], limit=1)
+
+    def llm(models):
+        models[1].complete("Reply with the single word: ready")
+
+    warmups = [('embedding', embedding), ('vector_search', vector_search)]
+    if MODEL_WARMUP_LLM:
+        warmups.append(('llm', llm))
+    return warmups
@@ -0,0 +1,172 @@
+"""Compact HMAC-signed session tokens.
+
+The old token was the user's profile as JSON (profile image included, hence
+the 431 errors that made the frontend send only the bare user_id), and every
+authenticated request ran it through up to six parsers. A session token is
+now
+
+    ak1.<base64url(user ObjectId (12 bytes) | expiry (4 bytes) | HMAC-SHA256 tag (16 bytes))>
+
+47 characters, checked with one HMAC and one constant-time comparison.
+Recently verified tokens are kept in a small LRU (SESSION_VERIFY_CACHE
+entries, 0 to disable), so repeat requests skip even that.
+
+Legacy credentials are unsigned, so anyone who knows a user id can forge one.
+The profile-JSON token is still accepted until LEGACY_TOKENS_UNTIL (an ISO
+date, DEFAULT_LEGACY_TOKENS_UNTIL unless set; `never` removes the cutoff), so
+signed-in browsers keep working while they pick up a new token at their next
+login. A bare user id (the X-User-Id header or `Bearer <user_id>`, sent by
+older frontend builds) is only accepted within that window when
+LEGACY_BARE_USER_IDS=true. Every accepted legacy credential is logged, and
+`token_stats()` counts how many requests still use them.
+"""
+import ast
+import base64
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import struct
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from bson import ObjectId
+
+TOKEN_PREFIX = "ak1."
+SESSION_TOKEN_TTL = int(os.getenv("SESSION_TOKEN_TTL", str(30 * 24 * 3600)))  # seconds
+SESSION_VERIFY_CACHE = int(os.getenv("SESSION_VERIFY_CACHE", "1024"))
+DEFAULT_LEGACY_TOKENS_UNTIL = "2026-11-30"
+LEGACY_TOKENS_UNTIL = os.getenv("LEGACY_TOKENS_UNTIL") or DEFAULT_LEGACY_TOKENS_UNTIL
+LEGACY_BARE_USER_IDS = os.getenv("LEGACY_BARE_USER_IDS", "false").lower() == "true"
+
+_TAG_BYTES = 16
+_PAYLOAD = struct.Struct(">12sI")
+_LEGACY_USER_ID = re.compile(r'"?user_id"?\s*:\s*"?([0-9a-fA-F]{24})')
+
+
+def _load_secret():
+    secret = os.getenv("SESSION_SECRET")
+    if secret:
+        return secret.encode()
+    print("⚠️ SESSION_SECRET is not set; using a random key, so sessions end on restart "
+          "and are not shared between workers")
+    return secrets.token_bytes(32)
+
+
+def _legacy_cutoff():
+    if LEGACY_TOKENS_UNTIL.lower() == "never":
+        return None
+    cutoff = datetime.fromisoformat(LEGACY_TOKENS_UNTIL)
+    if cutoff.tzinfo is None:
+        cutoff = cutoff.replace(tzinfo=timezone.utc)
+    return cutoff.timestamp()
+
+
+_secret = _load_secret()
+_legacy_until = _legacy_cutoff()
+_cache = OrderedDict()  # token -> (user_id, expires_at), most recently used last
+_cache_lock = threading.Lock()
+_stats = {'signed': 0, 'cache_hits': 0, 'legacy': 0, 'rejected': 0}
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def _tag(payload):
+    return hmac.new(_secret, payload, hashlib.sha256).digest()[:_TAG_BYTES]
+
+
+def issue_token(user_id, ttl=SESSION_TOKEN_TTL):
+    """A signed session token for the user (whose id is a Mongo ObjectId)."""
+    payload = _PAYLOAD.pack(ObjectId(user_id).binary, int(time.time()) + ttl)
+    return TOKEN_PREFIX + _b64encode(payload + _tag(payload))
+
+
+def verify_token(token):
+    """The user_id a signed token was issued for, or None if it is forged, malformed or expired."""
+    now = time.time()
+    with _cache_lock:
+        cached = _cache.get(token)
+        if cached is not None:
+            _cache.move_to_end(token)
+    if cached is not None and cached[1] > now:
+        _stats['cache_hits'] += 1
+        return cached[0]
+
+    try:
+        raw = base64.urlsafe_b64decode(token[len(TOKEN_PREFIX):] + '=' * (-len(token) % 4))
+    except Exception:
+        return None
+    if len(raw) != _PAYLOAD.size + _TAG_BYTES:
+        return None
+    payload, tag = raw[:_PAYLOAD.size], raw[_PAYLOAD.size:]
+    if not hmac.compare_digest(tag, _tag(payload)):
+        return None
+    oid, expires_at = _PAYLOAD.unpack(payload)
+    if expires_at <= now:
+        return None
+
+    user_id = str(ObjectId(oid))
+    if SESSION_VERIFY_CACHE > 0:
+        with _cache_lock:
+            _cache[token] = (user_id, expires_at)
+            if len(_cache) > SESSION_VERIFY_CACHE:
+                _cache.popitem(last=False)
+    return user_id
+
+
+def legacy_tokens_accepted(now=None):
+    return _legacy_until is None or (now or time.time()) < _legacy_until
+
+
+def _legacy_user_id(x_user_id, token):
+    """(user_id, kind) from the pre-signing credentials: the profile JSON, or a bare id if allowed."""
+    if LEGACY_BARE_USER_IDS:
+        if x_user_id and (ObjectId.is_valid(x_user_id) or len(x_user_id) >= 6):
+            return x_user_id, 'X-User-Id header'
+        if token and ObjectId.is_valid(token):
+            return token, 'bare user id'
+    if not token or ObjectId.is_valid(token):
+        return None, None
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            data = parse(token)
+            if isinstance(data, str):
+                # A JSON string wrapped in extra quotes
+                data = json.loads(data)
+            if isinstance(data, dict) and data.get('user_id'):
+                return data['user_id'], 'profile JSON token'
+        except Exception:
+            pass
+    match = _LEGACY_USER_ID.search(token)
+    return (match.group(1), 'profile JSON token') if match else (None, None)
+
+
+def user_id_from_credentials(authorization, x_user_id=None):
+    """Resolve the Authorization / X-User-Id headers to a user_id, or None."""
+    token = authorization[7:].strip() if authorization and authorization.startswith('Bearer ') else None
+    if token and token.startswith(TOKEN_PREFIX):
+        user_id = verify_token(token)
+        _stats['signed' if user_id else 'rejected'] += 1
+        return user_id
+
+    if not (token or x_user_id):
+        return None
+    if not legacy_tokens_accepted():
+        _stats['rejected'] += 1
+        return None
+    user_id, kind = _legacy_user_id(x_user_id, token)
+    _stats['legacy' if user_id else 'rejected'] += 1
+    if user_id:
+        print(f"⚠️ Accepted a legacy {kind} for user {user_id} (until {LEGACY_TOKENS_UNTIL})")
+    return user_id
+
+
+def token_stats():
+    return dict(_stats, cached=len(_cache), legacy_accepted=legacy_tokens_accepted(),
+                legacy_until=LEGACY_TOKENS_UNTIL, legacy_bare_user_ids=LEGACY_BARE_USER_IDS)
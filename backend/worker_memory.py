@@ -0,0 +1,116 @@
+"""Measure the gunicorn master's and workers' memory and size the worker count.
+
+RSS counts shared pages in every process that maps them, so adding up the
+workers' RSS overstates preloaded deployments and `ps` can't say what one
+more worker costs. This reads /proc/<pid>/smaps_rollup (Linux) for the master
+and its workers and reports, per process, RSS, PSS (shared pages split between
+their users) and private memory (what the process alone holds, and what a new
+worker adds). From those and the memory available it suggests how many
+workers fit:
+
+    workers <= (memory * (1 - headroom) - shared) / private per worker
+
+where `shared` is everything that isn't the workers' private memory (the
+master, including the preloaded embedding model). Measure after some traffic
+(e.g. a load test) — private memory grows as workers touch shared pages and
+build their caches — and compare GUNICORN_PRELOAD=true and false.
+
+    python worker_memory.py                        # pid from gunicorn.conf.py's pidfile
+    python worker_memory.py --pid 1234 --memory-mb 4096
+"""
+import os
+import sys
+
+GUNICORN_PIDFILE = os.getenv("GUNICORN_PIDFILE", "/tmp/ask-krishna-gunicorn.pid")
+SIZING_HEADROOM = float(os.getenv("SIZING_HEADROOM", "0.15"))  # kept free for spikes and the page cache
+
+
+def memory_kb(pid):
+    """{'rss', 'pss', 'private', 'shared'} in kB from /proc/<pid>/smaps_rollup."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    private = fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    return {
+        'rss': fields.get("Rss", 0),
+        'pss': fields.get("Pss", 0),
+        'private': private,
+        'shared': fields.get("Rss", 0) - private,
+    }
+
+
+def child_pids(pid):
+    pids = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except FileNotFoundError:
+            pass
+    return pids
+
+
+def memory_limit_kb():
+    """The cgroup memory limit, else the machine's total memory."""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+            if value != "max" and int(value) < 1 << 60:
+                return int(value) // 1024
+        except (OSError, ValueError):
+            pass
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemTotal:"):
+                return int(line.split()[1])
+
+
+def suggest_workers(master, workers, limit_kb, headroom=SIZING_HEADROOM):
+    """(private kB per worker, shared kB, workers that fit in limit_kb)."""
+    per_worker = max(w['private'] for w in workers)
+    total = master['pss'] + sum(w['pss'] for w in workers)
+    shared = total - sum(w['private'] for w in workers)
+    return per_worker, shared, max(0, int((limit_kb * (1 - headroom) - shared) // per_worker))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Per-worker memory of a running gunicorn and a worker count that fits.")
+    parser.add_argument("--pid", type=int, help="gunicorn master pid (default: read from GUNICORN_PIDFILE)")
+    parser.add_argument("--memory-mb", type=float, help="Memory available (default: cgroup limit or total memory)")
+    parser.add_argument("--headroom", type=float, default=SIZING_HEADROOM)
+    args = parser.parse_args()
+
+    pid = args.pid
+    if pid is None:
+        try:
+            with open(GUNICORN_PIDFILE) as f:
+                pid = int(f.read().strip())
+        except (OSError, ValueError):
+            sys.exit(f"❌ No gunicorn pidfile at {GUNICORN_PIDFILE}; pass --pid")
+
+    master = memory_kb(pid)
+    workers = [memory_kb(child) for child in child_pids(pid)]
+    print(f"{'process':<16}{'RSS MB':>10}{'PSS MB':>10}{'shared MB':>11}{'private MB':>12}")
+    rows = [(f"master {pid}", master)] + [(f"worker {i}", w) for i, w in enumerate(workers)]
+    for name, m in rows:
+        print(f"{name:<16}{m['rss'] / 1024:>10.0f}{m['pss'] / 1024:>10.0f}{m['shared'] / 1024:>11.0f}"
+              f"{m['private'] / 1024:>12.0f}")
+    if not workers:
+        sys.exit("❌ The master has no workers yet")
+
+    limit_kb = args.memory_mb * 1024 if args.memory_mb else memory_limit_kb()
+    per_worker, shared, fit = suggest_workers(master, workers, limit_kb, args.headroom)
+    print(f"\nTotal (sum of PSS): {(shared + sum(w['private'] for w in workers)) / 1024:.0f} MB "
+          f"for {len(workers)} workers")
+    print(f"Shared: {shared / 1024:.0f} MB, each additional worker: ~{per_worker / 1024:.0f} MB")
+    print(f"With {limit_kb / 1024:.0f} MB and {args.headroom:.0%} headroom: WEB_CONCURRENCY={fit}")
+
+
+if __name__ == "__main__":
+    main()
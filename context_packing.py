@@ -0,0 +1,96 @@
+"""Context assembly for the RAG prompt: dedup, trim and pack into a token budget.
+
+Retrieved chunks are page sized and neighbouring pages overlap (a purport that
+runs across a page break, the same verse quoted in two places), so joining the
+top-k payloads as-is inflates the prompt. `pack_context()`:
+
+- splits passages into sentences and drops sentences already seen in a
+  higher-ranked passage, and passages that are mostly repeats;
+- keeps the sentences that share terms with the query, plus one sentence of
+  context on either side (a passage with no lexical overlap was still chosen by
+  the vector search, so its opening sentences are kept instead);
+- packs passages in rank order until CONTEXT_TOKEN_BUDGET tokens, counted with
+  the same local tokenizer llama-index uses for prompt budgeting.
+"""
+import os
+import re
+
+from lexical_index import tokenize
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_DUPLICATE_RATIO = float(os.getenv("CONTEXT_DUPLICATE_RATIO", "0.8"))
+CONTEXT_LEAD_SENTENCES = 3  # kept from passages with no query terms
+
+_SENTENCE_END = re.compile(r'(?<=[.!?।॥])\s+|\n\s*\n|\n(?=[A-Z ]{4,}\n)')
+_tokenizer = None
+
+
+def count_tokens(text):
+    """Prompt tokens for text, using llama-index's local tiktoken tokenizer when available."""
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            from llama_index.core.utils import get_tokenizer
+            _tokenizer = get_tokenizer()
+        except Exception as e:
+            print(f"Tokenizer unavailable, estimating token counts: {e}")
+            # Roughly what a BPE tokenizer produces for mixed English/Sanskrit text
+            _tokenizer = lambda text: re.findall(r'\w{1,4}|[^\w\s]', text)
+    return len(_tokenizer(text))
+
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in _SENTENCE_END.split(text) if sentence and sentence.strip()]
+
+
+def _sentence_key(sentence):
+    return ' '.join(tokenize(sentence)) or sentence.strip().lower()
+
+
+def _relevant_sentences(sentences, query_terms):
+    """Indices of the sentences to keep from one passage, most important first."""
+    hits = [i for i, sentence in enumerate(sentences) if query_terms.intersection(tokenize(sentence))]
+    if not hits:
+        return list(range(min(CONTEXT_LEAD_SENTENCES, len(sentences))))
+    neighbours = set()
+    for i in hits:
+        neighbours.update(range(max(0, i - 1), min(len(sentences), i + 2)))
+    return hits + sorted(neighbours.difference(hits))
+
+
+def pack_context(query, passages, budget=None):
+    """Return (context, stats) built from passages (best first) within the token budget."""
+    budget = budget or CONTEXT_TOKEN_BUDGET
+    query_terms = set(tokenize(query))
+    seen = set()
+    packed, used = [], 0
+    stats = {'passages': len(passages), 'duplicates_dropped': 0, 'sentences_trimmed': 0}
+
+    for passage in passages:
+        sentences = split_sentences(passage)
+        keys = [_sentence_key(sentence) for sentence in sentences]
+        fresh = [i for i, key in enumerate(keys) if key not in seen]
+        if not sentences or len(fresh) < (1 - CONTEXT_DUPLICATE_RATIO) * len(sentences):
+            stats['duplicates_dropped'] += 1
+            continue
+        seen.update(keys)
+
+        fresh_sentences = [sentences[i] for i in fresh]
+        wanted = _relevant_sentences(fresh_sentences, query_terms)
+
+        # Fill sentence by sentence, query matches first, so a passage that only
+        # partly fits keeps its most relevant sentences
+        chosen = []
+        for i in wanted:
+            tokens = count_tokens(fresh_sentences[i]) + 1
+            if used + tokens <= budget:
+                chosen.append(i)
+                used += tokens
+        stats['sentences_trimmed'] += len(sentences) - len(chosen)
+        if chosen:
+            packed.append(' '.join(fresh_sentences[i] for i in sorted(chosen)))
+        if len(chosen) < len(wanted):
+            break
+
+    stats['passages_packed'] = len(packed)
+    return '\n\n'.join(packed), stats
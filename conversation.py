@@ -0,0 +1,127 @@
+"""Multi-turn conversation state for follow-up questions.
+
+A chat document holds every turn in `messages`, but only the last few go into
+the prompt verbatim. Older turns are folded into a rolling summary, one short
+line per turn (the question and the first sentence of its answer, so no extra
+LLM call), and the oldest summary lines are dropped once it outgrows
+CONVERSATION_SUMMARY_TOKENS. However long the conversation gets, the history
+in the prompt stays within CONVERSATION_TOKEN_BUDGET tokens.
+
+The context retrieved for the last fresh search is kept with its query
+embedding (`memory`). A follow-up whose embedding is within
+CONTEXT_REUSE_THRESHOLD cosine similarity ("and what does the next verse
+say?") reuses that context instead of searching again.
+"""
+import os
+
+import numpy as np
+
+from context_packing import count_tokens, split_sentences
+
+CONVERSATION_RECENT_TURNS = int(os.getenv("CONVERSATION_RECENT_TURNS", "3"))
+CONVERSATION_TOKEN_BUDGET = int(os.getenv("CONVERSATION_TOKEN_BUDGET", "1000"))
+CONVERSATION_SUMMARY_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_TOKENS", "300"))
+CONTEXT_REUSE_THRESHOLD = float(os.getenv("CONTEXT_REUSE_THRESHOLD", "0.9"))
+SUMMARY_LINE_WORDS = 40
+
+# Fields load() reads; only the recent messages are fetched, never the whole chat
+CONVERSATION_PROJECTION = {'user_id': 1, 'summary': 1, 'recent_turns': 1, 'memory': 1,
+                           'messages': {'$slice': -2 * CONVERSATION_RECENT_TURNS}}
+
+
+def _unit(embedding):
+    vector = np.asarray(embedding, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _clip_words(text, words=SUMMARY_LINE_WORDS):
+    parts = text.split()
+    return ' '.join(parts[:words]) + (' …' if len(parts) > words else '')
+
+
+def _summary_line(question, answer):
+    sentences = split_sentences(answer)
+    return f"- Asked: {_clip_words(question)} → {_clip_words(sentences[0] if sentences else answer)}"
+
+
+class Conversation:
+    """Prompt-side view of one chat: recent turns, rolling summary and reusable context."""
+
+    def __init__(self, chat_id=None, turns=None, summary=None, memory=None):
+        self.chat_id = chat_id
+        self.turns = list(turns or [])      # recent (question, answer) pairs, oldest first
+        self.summary = list(summary or [])  # one line per older turn, oldest first
+        self.memory = memory or {}          # {'context', 'embedding'} of the last fresh retrieval
+
+    @classmethod
+    def from_document(cls, document):
+        """Rebuild from a chat_history document (read with CONVERSATION_PROJECTION)."""
+        messages = document.get('messages') or []
+        turns = [(messages[i]['content'], messages[i + 1]['content'])
+                 for i in range(0, len(messages) - 1, 2)
+                 if messages[i].get('role') == 'user' and messages[i + 1].get('role') == 'assistant']
+        # Chats saved before summaries existed have a single turn and no counter
+        recent = document.get('recent_turns', len(turns))
+        return cls(str(document['_id']), turns[len(turns) - recent:] if recent else [],
+                   document.get('summary'), document.get('memory'))
+
+    @property
+    def is_follow_up(self):
+        return bool(self.turns or self.summary)
+
+    def _turn_text(self, question, answer):
+        return f"User: {question}\nKrishna: {answer}"
+
+    def history_text(self):
+        """Summary plus recent turns for the prompt, within CONVERSATION_TOKEN_BUDGET tokens, or ''."""
+        parts = []
+        if self.summary:
+            parts.append("Summary of earlier turns:\n" + "\n".join(self.summary))
+        parts.extend(self._turn_text(q, a) for q, a in self.turns)
+        text = "\n\n".join(parts)
+        if not text or count_tokens(text) <= CONVERSATION_TOKEN_BUDGET:
+            return text
+        # A single very long last answer: keep its leading sentences
+        question, answer = self.turns[-1]
+        head = "\n\n".join(parts[:-1] + [self._turn_text(question, '')])
+        room = CONVERSATION_TOKEN_BUDGET - count_tokens(head)
+        kept = []
+        for sentence in split_sentences(answer):
+            room -= count_tokens(sentence) + 1
+            if room < 0:
+                break
+            kept.append(sentence)
+        return head + ' '.join(kept)
+
+    def reusable_context(self, query_embedding):
+        """The previous retrieval's context if query_embedding is close to its query, else None."""
+        if query_embedding is None or not self.memory.get('embedding') or not self.memory.get('context'):
+            return None
+        similarity = float(np.dot(_unit(query_embedding), _unit(self.memory['embedding'])))
+        return self.memory['context'] if similarity >= CONTEXT_REUSE_THRESHOLD else None
+
+    def remember_retrieval(self, context, query_embedding):
+        if query_embedding is not None:
+            self.memory = {'context': context, 'embedding': [float(x) for x in np.ravel(query_embedding)]}
+
+    def _fold_oldest(self):
+        self.summary.append(_summary_line(*self.turns.pop(0)))
+
+    def add_turn(self, question, answer):
+        """Record a finished turn, compacting older turns into the summary to stay in budget."""
+        self.turns.append((question, answer))
+        while len(self.turns) > CONVERSATION_RECENT_TURNS:
+            self._fold_oldest()
+        summary_tokens = count_tokens("\n".join(self.summary))
+        while len(self.turns) > 1 and summary_tokens + sum(
+                count_tokens(self._turn_text(q, a)) for q, a in self.turns) > CONVERSATION_TOKEN_BUDGET:
+            self._fold_oldest()
+            summary_tokens = count_tokens("\n".join(self.summary))
+        while len(self.summary) > 1 and summary_tokens > CONVERSATION_SUMMARY_TOKENS:
+            self.summary.pop(0)
+            summary_tokens = count_tokens("\n".join(self.summary))
+
+    def state(self):
+        """Fields to $set on the chat document alongside the new messages."""
+        return {'summary': self.summary, 'recent_turns': len(self.turns), 'memory': self.memory}
@@ -0,0 +1,115 @@
+"""Micro-batching of query embeddings across concurrent requests.
+
+FastEmbed/ONNX embeds a batch far more efficiently per vector than one text at
+a time. `EmbeddingBatcher` wraps the embedding model: concurrent
+`get_query_embedding()` calls are queued, collected for up to
+EMBED_BATCH_MAX_WAIT_MS or EMBED_BATCH_MAX_SIZE queries, embedded with one
+batched call on a dispatcher thread, and handed back to each caller through a
+future.
+"""
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))
+EMBED_BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "5"))
+
+
+class EmbeddingBatcher:
+    """Drop-in wrapper for an embedding model that batches get_query_embedding()."""
+
+    def __init__(self, embed_model, max_batch_size=EMBED_BATCH_MAX_SIZE, max_wait_ms=EMBED_BATCH_MAX_WAIT_MS):
+        self.embed_model = embed_model
+        self.model_name = getattr(embed_model, 'model_name', type(embed_model).__name__)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        # Metrics
+        self.batches = 0
+        self.items = 0
+        self.batch_sizes = Counter()
+        self.total_wait = 0.0
+        self.total_embed_time = 0.0
+
+    def __getattr__(self, name):
+        # Anything we don't batch (text embeddings, config) goes straight to the wrapped model
+        embed_model = self.__dict__.get('embed_model')
+        if embed_model is None:
+            raise AttributeError(name)
+        return getattr(embed_model, name)
+
+    def _ensure_worker(self):
+        # Threads don't survive fork(), so a forked worker starts its own dispatcher
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, query):
+        """Queue a query and return a Future for its embedding."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((query, future, time.perf_counter()))
+        return future
+
+    def get_query_embedding(self, query, timeout=None):
+        return self.submit(query).result(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        started = time.perf_counter()
+        # Identical questions arriving together are embedded once
+        unique = list(dict.fromkeys(query for query, _, _ in batch))
+        try:
+            # gte-large has no query instruction, so query and text embeddings coincide
+            vectors = dict(zip(unique, self.embed_model.get_text_embedding_batch(unique)))
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        finished = time.perf_counter()
+
+        for query, future, queued_at in batch:
+            self.total_wait += started - queued_at
+            future.set_result(vectors[query])
+        self.batches += 1
+        self.items += len(batch)
+        self.batch_sizes[len(batch)] += 1
+        self.total_embed_time += finished - started
+
+    def stats(self):
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'batches': self.batches,
+            'items': self.items,
+            'queue_depth': self._queue.qsize(),
+            'avg_batch_size': self.items / self.batches if self.batches else 0.0,
+            'avg_batch_fill': self.items / (self.batches * self.max_batch_size) if self.batches else 0.0,
+            'avg_queue_wait_ms': 1000.0 * self.total_wait / self.items if self.items else 0.0,
+            'avg_batch_embed_ms': 1000.0 * self.total_embed_time / self.batches if self.batches else 0.0,
+            'batch_size_histogram': {str(size): count for size, count in sorted(self.batch_sizes.items())},
+        }
@@ -0,0 +1,167 @@
+"""Memoization of query embeddings for `search()`.
+
+Vectors are keyed on the normalized query text and the embedding model name
+and kept as compact NumPy arrays in a byte-budgeted LRU. When EMBED_CACHE_PATH
+is set, a direct-mapped, memory-mapped slot file backs the LRU so restarts and
+other worker processes on the same host can reuse earlier embeddings.
+"""
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+EMBED_CACHE_MAX_BYTES = int(os.getenv("EMBED_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+EMBED_CACHE_DTYPE = os.getenv("EMBED_CACHE_DTYPE", "float32")  # float32 | float16
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH")  # e.g. /tmp/ask-krishna-embeddings
+EMBED_CACHE_SLOTS = int(os.getenv("EMBED_CACHE_SLOTS", "16384"))
+
+_WHITESPACE = re.compile(r'\s+')
+_KEY_BYTES = 20  # sha1 digest
+_RECORD_BYTES = _KEY_BYTES + 4  # digest + crc32 of the stored vector
+
+
+def normalize_query(text):
+    """Canonical form used for cache keys: NFKC, casefolded, single-spaced."""
+    text = unicodedata.normalize('NFKC', text)
+    return _WHITESPACE.sub(' ', text).strip().casefold()
+
+
+def cache_key(text, model_name):
+    return hashlib.sha1(f"{model_name}\0{normalize_query(text)}".encode('utf-8')).digest()
+
+
+class _SlotFile:
+    """Fixed-capacity, direct-mapped vector store on two memory-mapped files.
+
+    Slot i holds one vector; its record holds the key digest and a crc32 of the
+    vector bytes, written after the vector so a torn or colliding write is
+    detected on read and treated as a miss.
+    """
+
+    def __init__(self, path, slots, dim, dtype):
+        self.slots = slots
+        vectors_path = path + '.vectors.npy'
+        records_path = path + '.records.npy'
+        if os.path.exists(vectors_path) and os.path.exists(records_path):
+            self.vectors = np.load(vectors_path, mmap_mode='r+')
+            self.records = np.load(records_path, mmap_mode='r+')
+            if self.vectors.shape != (slots, dim) or self.vectors.dtype != dtype:
+                raise ValueError(f"Embedding cache file {vectors_path} has shape "
+                                 f"{self.vectors.shape}/{self.vectors.dtype}, expected {(slots, dim)}/{dtype}")
+        else:
+            self.vectors = np.lib.format.open_memmap(vectors_path, mode='w+', dtype=dtype, shape=(slots, dim))
+            self.records = np.lib.format.open_memmap(records_path, mode='w+', dtype=np.uint8,
+                                                     shape=(slots, _RECORD_BYTES))
+
+    def _slot(self, key):
+        return int.from_bytes(key[:8], 'little') % self.slots
+
+    def get(self, key):
+        slot = self._slot(key)
+        record = self.records[slot].tobytes()
+        if record[:_KEY_BYTES] != key:
+            return None
+        vector = np.array(self.vectors[slot])
+        if zlib.crc32(vector.tobytes()) != int.from_bytes(record[_KEY_BYTES:], 'little'):
+            return None
+        return vector
+
+    def put(self, key, vector):
+        slot = self._slot(key)
+        self.vectors[slot] = vector
+        crc = zlib.crc32(vector.tobytes()).to_bytes(4, 'little')
+        self.records[slot] = np.frombuffer(key + crc, dtype=np.uint8)
+
+
+class EmbeddingCache:
+    """Byte-budgeted LRU of query embeddings with an optional shared mmap tier."""
+
+    def __init__(self, max_bytes=EMBED_CACHE_MAX_BYTES, dtype=EMBED_CACHE_DTYPE,
+                 path=EMBED_CACHE_PATH, slots=EMBED_CACHE_SLOTS):
+        self.max_bytes = max_bytes
+        self.dtype = np.dtype(dtype)
+        self.path = path
+        self.slots = slots
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._disk = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _open_disk(self, dim):
+        if self._disk is None and self.path:
+            try:
+                self._disk = _SlotFile(self.path, self.slots, dim, self.dtype)
+            except Exception as e:
+                print(f"⚠️ Embedding cache file unavailable, using memory only: {e}")
+                self.path = None
+        return self._disk
+
+    def _remember(self, key, vector):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.bytes -= previous.nbytes
+        self._entries[key] = vector
+        self.bytes += vector.nbytes
+        while self.bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= evicted.nbytes
+
+    def get(self, text, model_name):
+        """Return the cached float32 vector for text, or None."""
+        key = cache_key(text, model_name)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector.astype(np.float32)
+            if self._disk is None and self.path and os.path.exists(self.path + '.vectors.npy'):
+                # Shape comes from the file header; reopen with the dimension on disk
+                dim = np.load(self.path + '.vectors.npy', mmap_mode='r').shape[1]
+                self._open_disk(dim)
+            if self._disk is not None:
+                vector = self._disk.get(key)
+                if vector is not None:
+                    self._remember(key, vector)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return vector.astype(np.float32)
+            self.misses += 1
+            return None
+
+    def put(self, text, model_name, embedding):
+        key = cache_key(text, model_name)
+        vector = np.asarray(embedding, dtype=self.dtype).ravel()
+        with self._lock:
+            self._remember(key, vector)
+            disk = self._open_disk(vector.shape[0])
+            if disk is not None:
+                try:
+                    disk.put(key, vector)
+                except Exception as e:
+                    print(f"⚠️ Failed to write embedding cache file: {e}")
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'dtype': self.dtype.name,
+            'persistent': bool(self.path),
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
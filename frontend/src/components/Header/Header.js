@@ -14,6 +14,7 @@ import {
   FaChevronDown,
   FaComments
 } from 'react-icons/fa';
+import { resolveImageUrl } from '../../services/api';
 import './Header.css';
 
 const Header = () => {
@@ -128,7 +129,7 @@ const Header = () => {
                     <div className="user-avatar">
                       {currentUser.profileImage ? (
                         <img 
-                          src={currentUser.profileImage} 
+                          src={resolveImageUrl(currentUser.profileImage)} 
                           alt={currentUser.username} 
                           className="avatar-img"
                         />
@@ -147,7 +148,7 @@ const Header = () => {
                           <div className="dropdown-avatar">
                             {currentUser.profileImage ? (
                               <img 
-                                src={currentUser.profileImage} 
+                                src={resolveImageUrl(currentUser.profileImage)} 
                                 alt={currentUser.username} 
                                 className="dropdown-avatar-img"
                               />
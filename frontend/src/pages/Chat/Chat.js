@@ -15,7 +15,8 @@ const Chat = () => {
   const { currentUser, incrementQuestionCount, questionCount, clearChatHistory } = useAuth();
   const location = useLocation();
   const navigate = useNavigate();
-  const [isHistoryView, setIsHistoryView] = useState(false);
+  // Server-side conversation the next message continues (null starts a new one)
+  const [chatId, setChatId] = useState(localStorage.getItem('chatId'));
   const [historyLoading, setHistoryLoading] = useState(false);
   const [showLoginPrompt, setShowLoginPrompt] = useState(false);
 
@@ -116,28 +117,29 @@ const Chat = () => {
     if (!currentUser) {
       clearChatHistory();
       setMessages([]);
+      setChatId(null);
+      localStorage.removeItem('chatId');
     }
   }, [currentUser, clearChatHistory]);
 
-  // Load conversation by ID if present in URL (from history)
+  // Load conversation by ID if present in URL (from history); new messages continue it
   useEffect(() => {
     const params = new URLSearchParams(location.search);
-    const chatId = params.get('id');
-    if (chatId && currentUser) {
+    const historyChatId = params.get('id');
+    if (historyChatId && currentUser) {
       setHistoryLoading(true);
-      chatService.getChatById(chatId)
+      chatService.getChatById(historyChatId)
         .then(chat => {
           setMessages(chat.messages?.filter(
             msg => msg.role === 'user' || msg.role === 'assistant'
           ) || []);
-          setIsHistoryView(true);
+          setChatId(historyChatId);
+          localStorage.setItem('chatId', historyChatId);
         })
         .catch(() => {
           setMessages([]);
         })
         .finally(() => setHistoryLoading(false));
-    } else {
-      setIsHistoryView(false);
     }
   }, [location.search, currentUser]);
 
@@ -376,8 +378,6 @@ const Chat = () => {
       return;
     }
     
-    if (isHistoryView) return; // Prevent sending in history view
-
     // Add the user message immediately
     setMessages(prev => [...prev, { role: 'user', content: input }]);
     setInput('');
@@ -385,7 +385,11 @@ const Chat = () => {
 
     try {
       // Call the actual backend API using the chatService
-      const response = await chatService.sendMessage(input, language);
+      const response = await chatService.sendMessage(input, language, chatId);
+      if (response.chat_id) {
+        setChatId(response.chat_id);
+        localStorage.setItem('chatId', response.chat_id);
+      }
 
       // Format the response from the backend
       let responseContent;
@@ -407,6 +411,11 @@ const Chat = () => {
       }
     } catch (error) {
       console.error('Error sending message:', error);
+      if (error.response?.status === 404) {
+        // The conversation was deleted; the next message starts a new one
+        setChatId(null);
+        localStorage.removeItem('chatId');
+      }
       const errorMessage = {
         role: 'assistant',
         content: 'Sorry, there was an error processing your request. Please try again.'
@@ -419,7 +428,9 @@ const Chat = () => {
 
   const clearChat = () => {
     setMessages([]);
+    setChatId(null);
     localStorage.removeItem('chatMessages');
+    localStorage.removeItem('chatId');
   };
 
   const toggleLanguage = () => {
@@ -558,7 +569,7 @@ const Chat = () => {
                 );
               })
             )}
-            {isLoading && !isHistoryView && (
+            {isLoading && (
               <div className="message assistant loading">
                 <div className="loading-indicator">
                   <FaSpinner className="spinner" />
@@ -608,7 +619,7 @@ const Chat = () => {
           value={input}
           onChange={(e) => setInput(e.target.value)}
           placeholder="Ask a question about the Bhagavad Gita..."
-          disabled={isLoading || isHistoryView}
+          disabled={isLoading}
         />
         {/* Microphone input moved next to input box */}
         <button
@@ -619,7 +630,7 @@ const Chat = () => {
         >
           {isListening ? <FaMicrophoneSlash /> : <FaMicrophone />}
         </button>
-        <button type="submit" disabled={isLoading || !input.trim() || isHistoryView}>
+        <button type="submit" disabled={isLoading || !input.trim()}>
           <FaPaperPlane />
         </button>
       </form>
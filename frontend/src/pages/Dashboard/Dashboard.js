@@ -12,18 +12,16 @@ import {
   FaSignOutAlt
 } from 'react-icons/fa';
 import { useAuth } from '../../contexts/AuthContext';
-import { chatService } from '../../services/api';
+import { chatService, resolveImageUrl } from '../../services/api';
 import './Dashboard.css';
 
 const Dashboard = () => {
   const { currentUser, logout } = useAuth();
   const navigate = useNavigate();
-  const [chatStats, setChatStats] = useState({
-    totalChats: 0,
-    recentChats: 0,
-    lastChatDate: null
-  });
+  const [history, setHistory] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     if (!currentUser) {
@@ -31,27 +29,13 @@ const Dashboard = () => {
       return;
     }
 
-    const fetchStats = async () => {
+    // First page only; further pages are fetched on demand with "Load more"
+    const fetchFirstPage = async () => {
       try {
         setLoading(true);
-        const history = await chatService.getChatHistory();
-        
-        const now = new Date();
-        const oneWeekAgo = new Date(now.getTime() - 7 * 24 * 60 * 60 * 1000);
-        
-        const recentChats = history.filter(chat => {
-          const ts = chat.created_at ? new Date(chat.created_at * 1000) : new Date(chat.date);
-          return ts >= oneWeekAgo;
-        });
-
-        // Backend already sorts desc by created_at; lastChat should be the most recent
-        const lastChat = history.length > 0 ? history[0] : null;
-
-        setChatStats({
-          totalChats: history.length,
-          recentChats: recentChats.length,
-            lastChatDate: lastChat ? (lastChat.date || (lastChat.created_at ? new Date(lastChat.created_at * 1000).toISOString() : null)) : null
-        });
+        const page = await chatService.getChatHistory();
+        setHistory(page.chats);
+        setNextCursor(page.nextCursor);
       } catch (error) {
         console.error('Error fetching chat stats:', error);
       } finally {
@@ -59,9 +43,36 @@ const Dashboard = () => {
       }
     };
 
-    fetchStats();
+    fetchFirstPage();
   }, [currentUser, navigate]);
 
+  const loadMore = async () => {
+    if (!nextCursor || loadingMore) return;
+    try {
+      setLoadingMore(true);
+      const page = await chatService.getChatHistory(nextCursor);
+      setHistory(prev => [...prev, ...page.chats]);
+      setNextCursor(page.nextCursor);
+    } catch (error) {
+      console.error('Error fetching more chats:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  const chatTime = (chat) => (chat.created_at ? new Date(chat.created_at * 1000) : new Date(chat.date));
+  const oneWeekAgo = new Date(Date.now() - 7 * 24 * 60 * 60 * 1000);
+  const recentChats = history.filter(chat => chatTime(chat) >= oneWeekAgo);
+  // Backend sorts desc by created_at: the first chat is the most recent, and once the
+  // oldest loaded chat is more than a week old the weekly count is complete
+  const lastChat = history.length > 0 ? history[0] : null;
+  const recentComplete = !nextCursor || (history.length > 0 && chatTime(history[history.length - 1]) < oneWeekAgo);
+  const chatStats = {
+    totalChats: nextCursor ? `${history.length}+` : history.length,
+    recentChats: recentComplete ? recentChats.length : `${recentChats.length}+`,
+    lastChatDate: lastChat ? (lastChat.date || (lastChat.created_at ? new Date(lastChat.created_at * 1000).toISOString() : null)) : null
+  };
+
   const handleLogout = async () => {
     try {
       await logout();
@@ -115,7 +126,7 @@ const Dashboard = () => {
             <div className="profile-avatar">
               {currentUser.profileImage ? (
                 <img 
-                  src={currentUser.profileImage} 
+                  src={resolveImageUrl(currentUser.profileImage)} 
                   alt="Profile" 
                   className="avatar-image"
                 />
@@ -181,6 +192,12 @@ const Dashboard = () => {
               </div>
             </div>
           </div>
+          {!loading && nextCursor && (
+            <button onClick={loadMore} className="view-history-btn load-more-btn" disabled={loadingMore}>
+              <FaHistory />
+              {loadingMore ? 'Loading...' : 'Load more'}
+            </button>
+          )}
         </div>
 
         {/* Quick Actions */}
@@ -12,6 +12,8 @@ const History = () => {
   const [filteredHistory, setFilteredHistory] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const { currentUser } = useAuth();
   
   // Fetch real chat history from backend
@@ -29,7 +31,7 @@ const History = () => {
         setError('');
         console.log('🔍 Fetching chat history for user:', currentUser.user_id);
         
-        const history = await chatService.getChatHistory();
+        const { chats: history, nextCursor: cursor } = await chatService.getChatHistory();
         console.log('✅ Chat history received:', history);
         
         // Ensure history is an array
@@ -46,6 +48,7 @@ const History = () => {
         
         setChatHistory(historyArray);
         setFilteredHistory(historyArray);
+        setNextCursor(cursor);
       } catch (err) {
         console.error('❌ Error fetching chat history:', err);
         setError('Failed to load chat history');
@@ -77,6 +80,22 @@ const History = () => {
     setFilteredHistory(filtered);
   }, [searchTerm, chatHistory]);
   
+  // Append the next page of (summary) chats
+  const loadMore = async () => {
+    if (!nextCursor || loadingMore) return;
+    try {
+      setLoadingMore(true);
+      const { chats, nextCursor: cursor } = await chatService.getChatHistory(nextCursor);
+      setChatHistory(prevHistory => [...prevHistory, ...chats]);
+      setNextCursor(cursor);
+    } catch (e) {
+      console.error('Error loading more chats:', e);
+      setError('Failed to load more chats');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const formatDate = (dateString) => {
     try {
       const options = { year: 'numeric', month: 'long', day: 'numeric' };
@@ -105,6 +124,7 @@ const History = () => {
       await chatService.deleteAllChats();
       setChatHistory([]);
       setFilteredHistory([]);
+      setNextCursor(null);
     } catch (e) {
       console.error('Error deleting all chats:', e);
       setError('Failed to delete all chats');
@@ -201,6 +221,11 @@ const History = () => {
               </Link>
             </div>
           ))}
+          {nextCursor && (
+            <button className="start-chat-button load-more-button" onClick={loadMore} disabled={loadingMore}>
+              {loadingMore ? 'Loading...' : 'Load older conversations'}
+            </button>
+          )}
         </div>
       )}
     </div>
@@ -2,7 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { FaUser, FaEnvelope, FaCamera, FaTrash, FaEdit, FaSave, FaTimes } from 'react-icons/fa';
 import { useAuth } from '../../contexts/AuthContext';
-import { authService } from '../../services/api';
+import { authService, resolveImageUrl } from '../../services/api';
 import './Profile.css';
 
 const Profile = () => {
@@ -161,7 +161,7 @@ const Profile = () => {
             <div className="profile-image-container">
               {profileData.profileImage ? (
                 <img 
-                  src={profileData.profileImage} 
+                  src={resolveImageUrl(profileData.profileImage)} 
                   alt="Profile" 
                   className="profile-image"
                 />
@@ -12,6 +12,8 @@ const api = axios.create({
 
 
 
+const SIGNED_TOKEN_PREFIX = 'ak1.';
+
 // Add a request interceptor to include auth token if available
 api.interceptors.request.use(
   (config) => {
@@ -19,6 +21,12 @@ api.interceptors.request.use(
     if (user) {
       try {
         const userData = JSON.parse(user);
+        // Signed session tokens (issued at login since the token format change) are small enough to send as-is
+        if (typeof userData.token === 'string' && userData.token.startsWith(SIGNED_TOKEN_PREFIX)) {
+          config.headers.Authorization = `Bearer ${userData.token}`;
+          return config;
+        }
+        // Legacy profile-JSON tokens: accepted by the backend until the migration window closes
         let tokenString = userData.token;
         // If token object accidentally stored as object, re-serialize
         if (typeof tokenString === 'object' && tokenString !== null) {
@@ -48,11 +56,11 @@ api.interceptors.request.use(
           const repaired = { ...userData, token: validToken };
           localStorage.setItem('user', JSON.stringify(repaired));
         }
-        // Only send the user_id in the Authorization header instead of the full token
-        // This prevents the 431 Request Header Fields Too Large error
-        if (userData && userData.user_id) {
-          config.headers.Authorization = `Bearer ${userData.user_id}`;
-          config.headers['X-User-Id'] = userData.user_id;
+        // Send the profile JSON without the profile image, which made the header
+        // too large (431); bare user ids are no longer accepted by the backend
+        if (validToken) {
+          const { profileImage, ...profile } = JSON.parse(validToken);
+          config.headers.Authorization = `Bearer ${JSON.stringify(profile)}`;
         }
       } catch (e) {
         // ignore malformed localStorage
@@ -68,10 +76,11 @@ api.interceptors.request.use(
 // Chat related API calls
 const chatService = {
   // Send a message to the chatbot
-  sendMessage: async (message, language = 'english') => {
+  // Pass the chat_id of a previous answer to ask a follow-up in the same conversation
+  sendMessage: async (message, language = 'english', chatId = null) => {
     try {
       // This will connect to the Flask backend
-      const response = await api.post('/api/chat', { prompt: message, language });
+      const response = await api.post('/api/chat', { prompt: message, language, ...(chatId ? { chat_id: chatId } : {}) });
       return response.data;
     } catch (error) {
       console.error('Error sending message:', error);
@@ -79,11 +88,14 @@ const chatService = {
     }
   },
   
-  // Get chat history for a user
-  getChatHistory: async () => {
+  // Get one page of chat summaries (newest first); pass nextCursor back to get the next page
+  getChatHistory: async (cursor = null) => {
     try {
-      const response = await api.get('/api/history');
-      return response.data;
+      const response = await api.get('/api/history', { params: cursor ? { cursor } : {} });
+      return {
+        chats: Array.isArray(response.data) ? response.data : [],
+        nextCursor: response.headers['x-next-cursor'] || null,
+      };
     } catch (error) {
       console.error('Error fetching chat history:', error);
       throw error;
@@ -236,4 +248,12 @@ const authService = {
   },
 };
 
-export { chatService, authService };
\ No newline at end of file
+// Profile images are served by the backend (/api/images/...); data URLs (an unsaved upload) pass through
+const resolveImageUrl = (src) => {
+  if (typeof src === 'string' && src.startsWith('/api/') && api.defaults.baseURL) {
+    return `${api.defaults.baseURL.replace(/\/$/, '')}${src}`;
+  }
+  return src;
+};
+
+export { chatService, authService, resolveImageUrl };
\ No newline at end of file
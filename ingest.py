@@ -0,0 +1,358 @@
+"""Build or refresh the `bhagavad-gita` Qdrant collection from source documents.
+
+This is the indexing part of notebook/Bhagavad_Gita_Assistant.ipynb as a
+resumable command:
+
+- documents are streamed file by file from SimpleDirectoryReader, never all
+  held in memory;
+- every chunk gets a stable point id derived from a hash of its text, so
+  chunks already in the collection are skipped and an interrupted run simply
+  picks up where it stopped;
+- embedding runs in parallel batches across a process pool with a bounded
+  number of batches in flight, and vectors are upserted as each batch finishes;
+- each page is tagged with its chapter, the verses it contains and its page
+  number (see verse_index.py); --refresh-payload rewrites those fields on points
+  that are already present without re-embedding them.
+
+The collection built by the notebook has random point ids, which neither
+skipping nor --refresh-payload can match, so ingesting into it would add every
+chunk a second time. --migrate-payload adds the page and verse tags to such
+points in place instead, matching them to the source chunks by their text;
+--refresh-payload refuses to run while the collection has points it can't
+recognise.
+
+Usage:
+    python ingest.py --data-dir data --workers 4
+    python ingest.py --data-dir data --migrate-payload
+"""
+import argparse
+import hashlib
+import os
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from dotenv import load_dotenv
+
+from verse_index import VerseTagger
+
+load_dotenv()
+
+COLLECTION_NAME = "bhagavad-gita"
+EMBED_MODEL_NAME = "thenlper/gte-large"
+VECTOR_SIZE = 1024
+# Fixed namespace so the same text always maps to the same point id
+POINT_ID_NAMESPACE = uuid.UUID("6f1d3a52-8c1e-4a4b-9d57-7a2b8e0c4f10")
+
+_worker_model = None
+
+
+def point_id(text):
+    """Stable Qdrant point id for a chunk of text."""
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, digest))
+
+
+def iter_chunks(data_dir):
+    """Yield (text, metadata) one document at a time, reading one file at a time."""
+    from llama_index.core import SimpleDirectoryReader
+
+    reader = SimpleDirectoryReader(data_dir)
+    for documents in reader.iter_data():
+        for doc in documents:
+            if doc.text and doc.text.strip():
+                yield doc.text, doc.metadata
+
+
+def tag_chunks(chunks):
+    """Add chapter, verses and a per-file page number to each chunk's metadata.
+
+    Chunks must arrive in reading order, which is how iter_chunks() yields them.
+    """
+    taggers = {}
+    pages = {}
+    for text, metadata in chunks:
+        file_name = metadata.get("file_name", "")
+        tagger = taggers.setdefault(file_name, VerseTagger())
+        tags = tagger.tag(text)
+        pages[file_name] = pages.get(file_name, 0) + 1
+        yield text, {**metadata, "chapter": tags["chapter"], "verses": tags["verses"], "page": pages[file_name]}
+
+
+def iter_batches(chunks, batch_size):
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _init_worker(model_name):
+    global _worker_model
+    from llama_index.embeddings.fastembed import FastEmbedEmbedding
+    _worker_model = FastEmbedEmbedding(model_name=model_name)
+
+
+def _embed_batch(texts):
+    return _worker_model.get_text_embedding_batch(texts)
+
+
+def get_client(url=None, api_key=None, location=None):
+    import qdrant_client
+
+    if location:
+        return qdrant_client.QdrantClient(location=location)
+    return qdrant_client.QdrantClient(
+        url=url or os.getenv("QDRANT_URL"),
+        api_key=api_key or os.getenv("QDRANT_API_KEY"),
+        prefer_grpc=True
+    )
+
+
+def ensure_collection(client, collection_name):
+    from qdrant_client import models
+
+    if client.collection_exists(collection_name=collection_name):
+        return
+    client.create_collection(
+        collection_name=collection_name,
+        vectors_config=models.VectorParams(size=VECTOR_SIZE, distance=models.Distance.COSINE, on_disk=True),
+        quantization_config=models.BinaryQuantization(
+            binary=models.BinaryQuantizationConfig(always_ram=True),
+        ),
+        # Skip HNSW builds while bulk loading; finish_collection() turns indexing back on
+        optimizers_config=models.OptimizersConfigDiff(indexing_threshold=0),
+    )
+    print(f"✅ Created collection '{collection_name}'")
+
+
+def finish_collection(client, collection_name):
+    from qdrant_client import models
+
+    client.update_collection(
+        collection_name=collection_name,
+        optimizer_config=models.OptimizersConfigDiff(indexing_threshold=20000)
+    )
+
+
+def existing_ids(client, collection_name, ids):
+    points = client.retrieve(collection_name=collection_name, ids=ids, with_payload=False, with_vectors=False)
+    return {str(point.id) for point in points}
+
+
+def payload_for(text, metadata):
+    """Payload stored with each point; `context` is what the RAG pipeline reads."""
+    payload = {"context": text}
+    for key in ("file_name", "page_label", "page", "chapter", "verses"):
+        if key in metadata:
+            payload[key] = metadata[key]
+    return payload
+
+
+def refresh_payloads(client, collection_name, batch):
+    """Overwrite the payload of points that already exist, keeping their vectors."""
+    from qdrant_client import models
+
+    client.batch_update_points(
+        collection_name=collection_name,
+        update_operations=[
+            models.OverwritePayloadOperation(overwrite_payload=models.SetPayload(payload=payload, points=[pid]))
+            for pid, payload in batch
+        ],
+        wait=True,
+    )
+
+
+def iter_points(client, collection_name, batch_size=256):
+    """Yield every point of the collection with its payload (no vectors)."""
+    offset = None
+    while True:
+        points, offset = client.scroll(collection_name=collection_name, limit=batch_size, offset=offset,
+                                       with_payload=True, with_vectors=False)
+        yield from points
+        if offset is None:
+            break
+
+
+def unrecognised_points(client, collection_name):
+    """Number of points whose id isn't point_id() of their text, e.g. those written by the notebook."""
+    return sum(
+        1 for point in iter_points(client, collection_name)
+        if str(point.id) != point_id((point.payload or {}).get("context", ""))
+    )
+
+
+def migrate_payloads(client, data_dir, collection_name=COLLECTION_NAME, chunks=None, batch_size=256):
+    """Add the page and verse tags to existing points, whatever their ids, by matching their text.
+
+    Vectors and ids are left alone, so the notebook's collection gains the
+    fields verse lookup needs without being re-embedded or duplicated.
+    """
+    from qdrant_client import models
+
+    source = chunks if chunks is not None else iter_chunks(data_dir)
+    payloads = {}
+    for text, metadata in tag_chunks(source):
+        payloads.setdefault(text, payload_for(text, metadata))
+
+    stats = {"points": 0, "migrated": 0, "unmatched": 0}
+    operations = []
+
+    def flush():
+        if operations:
+            client.batch_update_points(collection_name=collection_name, update_operations=operations, wait=True)
+            operations.clear()
+
+    for point in iter_points(client, collection_name):
+        stats["points"] += 1
+        payload = payloads.get((point.payload or {}).get("context"))
+        if payload is None:
+            stats["unmatched"] += 1
+            continue
+        operations.append(models.SetPayloadOperation(set_payload=models.SetPayload(payload=payload,
+                                                                                    points=[point.id])))
+        stats["migrated"] += 1
+        if len(operations) >= batch_size:
+            flush()
+    flush()
+    print(f"✅ Migrated payloads of {stats['migrated']}/{stats['points']} points "
+          f"({stats['unmatched']} matched no source chunk)")
+    return stats
+
+
+def upsert_batch(client, collection_name, batch, vectors):
+    from qdrant_client import models
+
+    client.upsert(
+        collection_name=collection_name,
+        points=[
+            models.PointStruct(id=pid, vector=vector, payload=payload)
+            for (pid, payload), vector in zip(batch, vectors)
+        ],
+        wait=True,
+    )
+
+
+def ingest(client, data_dir, collection_name=COLLECTION_NAME, batch_size=50, workers=None,
+           max_in_flight=None, model_name=EMBED_MODEL_NAME, chunks=None, refresh_payload=False):
+    """Embed and upsert every new chunk under data_dir. Returns a stats dict.
+
+    With refresh_payload, chunks already in the collection get their payload
+    rewritten (e.g. to add verse tags) instead of being skipped outright. That
+    only finds points stored under point_id(), so it raises RuntimeError if the
+    collection has others; migrate_payloads() handles those.
+    """
+    workers = workers if workers is not None else max(1, (os.cpu_count() or 2) - 1)
+    max_in_flight = max_in_flight or workers * 2
+    ensure_collection(client, collection_name)
+    if refresh_payload:
+        unrecognised = unrecognised_points(client, collection_name)
+        if unrecognised:
+            raise RuntimeError(f"{unrecognised} points in '{collection_name}' have ids not derived from their text "
+                               f"(built by the notebook?); refreshing would add every chunk again. "
+                               f"Run ingest.py --migrate-payload instead.")
+
+    stats = {"seen": 0, "skipped": 0, "embedded": 0, "refreshed": 0}
+    started = time.perf_counter()
+    last_report = started
+
+    def report(final=False):
+        elapsed = time.perf_counter() - started
+        rate = stats["embedded"] / elapsed if elapsed else 0.0
+        prefix = "✅ Done:" if final else "⏳"
+        refreshed = f", {stats['refreshed']} payloads refreshed" if stats["refreshed"] else ""
+        print(f"{prefix} {stats['seen']} chunks seen, {stats['skipped']} unchanged{refreshed}, "
+              f"{stats['embedded']} embedded in {elapsed:.1f}s ({rate:.1f} chunks/s)")
+
+    if workers > 0:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_name,))
+    else:
+        _init_worker(model_name)
+        executor = None
+
+    in_flight = {}
+
+    def drain(block_until):
+        nonlocal last_report
+        while len(in_flight) > block_until:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = in_flight.pop(future)
+                upsert_batch(client, collection_name, batch, future.result())
+                stats["embedded"] += len(batch)
+        if time.perf_counter() - last_report > 5:
+            last_report = time.perf_counter()
+            report()
+
+    try:
+        source = chunks if chunks is not None else iter_chunks(data_dir)
+        for raw_batch in iter_batches(tag_chunks(source), batch_size):
+            stats["seen"] += len(raw_batch)
+            keyed = {}
+            for text, metadata in raw_batch:
+                keyed.setdefault(point_id(text), (text, metadata))
+            present = existing_ids(client, collection_name, list(keyed))
+            todo = [(pid, text, metadata) for pid, (text, metadata) in keyed.items() if pid not in present]
+            stats["skipped"] += len(raw_batch) - len(todo)
+            if refresh_payload and present:
+                refresh_payloads(client, collection_name, [
+                    (pid, payload_for(text, metadata)) for pid, (text, metadata) in keyed.items() if pid in present
+                ])
+                stats["refreshed"] += len(present)
+            if not todo:
+                continue
+
+            batch = [(pid, payload_for(text, metadata)) for pid, text, metadata in todo]
+            texts = [text for _, text, _ in todo]
+            if executor is None:
+                upsert_batch(client, collection_name, batch, _embed_batch(texts))
+                stats["embedded"] += len(batch)
+                continue
+            in_flight[executor.submit(_embed_batch, texts)] = batch
+            # Bound memory: wait for a batch to finish before reading further ahead
+            drain(max_in_flight - 1)
+        drain(0)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    finish_collection(client, collection_name)
+    report(final=True)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed documents into the Bhagavad Gita Qdrant collection.")
+    parser.add_argument("--data-dir", default="data", help="Directory read by SimpleDirectoryReader")
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Embedding processes (default: CPUs - 1, 0 embeds in this process)")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="Batches queued for embedding at once (default: 2 x workers)")
+    parser.add_argument("--model", default=EMBED_MODEL_NAME)
+    parser.add_argument("--qdrant-url", default=None, help="Defaults to $QDRANT_URL")
+    parser.add_argument("--location", default=None, help="Local Qdrant location, e.g. :memory: or a path")
+    parser.add_argument("--refresh-payload", action="store_true",
+                        help="Rewrite payloads (page and verse tags) of chunks that are already indexed")
+    parser.add_argument("--migrate-payload", action="store_true",
+                        help="Add page and verse tags to existing points matched by text, whatever their ids")
+    args = parser.parse_args()
+
+    client = get_client(url=args.qdrant_url, location=args.location)
+    if args.migrate_payload:
+        migrate_payloads(client, args.data_dir, collection_name=args.collection)
+        return
+    try:
+        ingest(client, args.data_dir, collection_name=args.collection, batch_size=args.batch_size,
+               workers=args.workers, max_in_flight=args.max_in_flight, model_name=args.model,
+               refresh_payload=args.refresh_payload)
+    except RuntimeError as e:
+        parser.error(str(e))
+
+
+if __name__ == "__main__":
+    main()
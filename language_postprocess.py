@@ -0,0 +1,185 @@
+"""Language detection and answer post-processing for Hindi responses.
+
+The Hindi cleanup used to be a chain of regex passes in `chat()`: strip
+brackets, find the longest run of Devanagari-plus-punctuation text, collapse
+blank lines, strip an English preamble, reduce repeated commas. Here it is one
+pass with precompiled patterns, and `HindiAnswerNormalizer` does it
+incrementally, so the streaming endpoints can emit cleaned text as tokens
+arrive and still end up with exactly the non-streaming answer.
+
+`has_devanagari()` is memoized, so the prompt builders and the request
+handlers share one detection per query string.
+
+Run `python language_postprocess.py` for a micro-benchmark against the old
+implementation (pass `--corpus answers.jsonl` to use exported answers, one
+JSON object with an `answer` field, or a JSON string, per line).
+"""
+import re
+from functools import lru_cache
+
+HINDI_FALLBACK_ANSWER = "क्षमा करें, मुझे आपके प्रश्न का उत्तर देने में समस्या हो रही है। कृपया अपना प्रश्न दोबारा पूछें।"
+
+_DEVANAGARI = re.compile(r'[ऀ-ॿ]')
+# Characters that can be part of a Hindi answer: Devanagari, whitespace, digits,
+# ASCII punctuation and bullets. Latin letters (and other scripts) end a block.
+_BLOCK_CHARS = r'ऀ-ॿ\s\x20-\x40\x5B-\x60\x7B-\x7E•'
+_BLOCK = re.compile(rf'[{_BLOCK_CHARS}]+')
+_BLOCK_CHAR = re.compile(rf'[{_BLOCK_CHARS}]')
+_PROMPT_BLOCK = re.compile(r'[ऀ-ॿ\s\.,;:!?()]+')
+_REPEATS = re.compile(r'\n{3,}|,{2,}')
+_PREAMBLE = re.compile(r'^(Here is|The answer|Answer|Response|In Hindi|Hindi translation)[:\s]*', re.IGNORECASE)
+
+
+@lru_cache(maxsize=1024)
+def has_devanagari(text):
+    return _DEVANAGARI.search(text) is not None
+
+
+def longest_hindi_block(text):
+    """Longest run of Devanagari text (with spaces and punctuation) in a prompt, or ''."""
+    return max(_PROMPT_BLOCK.findall(text), key=len, default='')
+
+
+def _collapse(match):
+    return '\n\n' if match.group()[0] == '\n' else ','
+
+
+def _drop_brackets(text):
+    return text.replace('[', '').replace(']', '')
+
+
+def _finish(answer):
+    answer = _PREAMBLE.sub('', _REPEATS.sub(_collapse, answer).strip())
+    return answer if len(answer.strip()) >= 5 else HINDI_FALLBACK_ANSWER
+
+
+class HindiAnswerNormalizer:
+    """Incremental Hindi answer cleanup.
+
+    feed() takes answer text chunks and returns the Hindi text in them, ready
+    to display; finish() returns the final answer: the longest Hindi block
+    with blank lines and commas collapsed, or a fallback message if there is
+    no usable answer.
+    """
+
+    def __init__(self):
+        self._run = []
+        self._run_len = 0
+        self._best = ''
+        self._saw_block = False
+        self._text = []  # only needed when the answer has no Hindi block at all
+
+    def _close_run(self):
+        if self._run_len > len(self._best):
+            self._best = ''.join(self._run)
+        self._run = []
+        self._run_len = 0
+
+    def feed(self, chunk):
+        chunk = _drop_brackets(chunk)
+        if not chunk:
+            return ''
+        if not self._saw_block:
+            self._text.append(chunk)
+        blocks = _BLOCK.findall(chunk)
+        if not blocks:
+            self._close_run()
+            return ''
+        self._saw_block = True
+
+        # A block touching either end of the chunk may continue in the neighbouring chunk
+        if not _BLOCK_CHAR.match(chunk):
+            self._close_run()
+        self._run.append(blocks[0])
+        self._run_len += len(blocks[0])
+        if len(blocks) > 1:
+            self._close_run()
+            if len(blocks) > 2:
+                middle = max(blocks[1:-1], key=len)
+                if len(middle) > len(self._best):
+                    self._best = middle
+            self._run = [blocks[-1]]
+            self._run_len = len(blocks[-1])
+        if not _BLOCK_CHAR.match(chunk[-1]):
+            self._close_run()
+        return _REPEATS.sub(_collapse, ''.join(blocks))
+
+    def finish(self):
+        self._close_run()
+        return _finish(self._best if self._saw_block else ''.join(self._text))
+
+
+def normalize_hindi_answer(answer):
+    """One-shot equivalent of feeding the whole answer to HindiAnswerNormalizer."""
+    answer = _drop_brackets(answer)
+    blocks = _BLOCK.findall(answer)
+    return _finish(max(blocks, key=len) if blocks else answer)
+
+
+def _legacy_normalize(answer):
+    """The previous multi-pass implementation, kept for the benchmark comparison."""
+    answer = re.sub(r'[\[\]]', '', answer)
+    hindi_blocks = re.findall(r'([ऀ-ॿ0-9\s\n\r\t\-•\.,;:!?()"""'' -@[-`{-~]+)', answer)
+    if hindi_blocks:
+        answer = max(hindi_blocks, key=len).strip()
+    answer = re.sub(r'\n{3,}', '\n\n', answer).strip()
+    answer = re.sub(r'^(Here is|The answer|Answer|Response|In Hindi|Hindi translation)[:\s]*', '', answer,
+                    flags=re.IGNORECASE)
+    if answer.strip() in [',', ',,', ',,,'] or len(answer.strip()) < 5:
+        answer = HINDI_FALLBACK_ANSWER
+    return re.sub(r',{2,}', ',', answer)
+
+
+_SAMPLE_ANSWERS = [
+    "श्रीकृष्ण कहते हैं कि कर्म करना तुम्हारा अधिकार है, उसके फल पर नहीं [2.47]।\n\n\n"
+    "इसलिए फल की इच्छा छोड़कर अपना कर्तव्य करो।",
+    "Here is the answer in Hindi: आत्मा अजर और अमर है। इसे न शस्त्र काट सकते हैं, न अग्नि जला सकती है,, "
+    "न जल गीला कर सकता है।\n\n1. आत्मा नित्य है\n2. शरीर नश्वर है",
+    "भगवद्गीता के अनुसार भक्ति योग सबसे श्रेष्ठ मार्ग है (अध्याय 12)। जो भक्त श्रद्धा से भगवान का स्मरण करता है, "
+    "वह उन्हें प्रिय है। Krishna (कृष्ण) says the devotee is dear to Him.",
+    "Arjuna was overwhelmed by compassion and doubt on the battlefield. Krishna explains that the soul is eternal "
+    "and that one must act according to one's dharma without attachment to results [BG 2.47].\n\n\n\nIn short, "
+    "perform your duty and surrender the fruits to the Lord.",
+    "Karma yoga means acting without selfish desire. • Work as an offering • Remain equal in success and failure "
+    "• Fix the mind on the Supreme",
+    ",,,",
+]
+
+
+def _benchmark(corpus, repeat):
+    import time
+
+    for name, fn in (("legacy", _legacy_normalize), ("single-pass", normalize_hindi_answer)):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for answer in corpus:
+                fn(answer)
+        elapsed = time.perf_counter() - started
+        print(f"{name:>12}: {1e6 * elapsed / (repeat * len(corpus)):.1f} µs/answer")
+
+    def streamed(answer, size=7):
+        normalizer = HindiAnswerNormalizer()
+        for i in range(0, len(answer), size):
+            normalizer.feed(answer[i:i + size])
+        return normalizer.finish()
+
+    mismatches = sum(streamed(answer) != normalize_hindi_answer(answer) for answer in corpus)
+    differs = sum(_legacy_normalize(answer) != normalize_hindi_answer(answer) for answer in corpus)
+    print(f"{len(corpus)} answers: {mismatches} streaming mismatches, {differs} differ from legacy output")
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Micro-benchmark the Hindi answer normalizer.")
+    parser.add_argument("--corpus", help="JSONL file of answers (default: built-in samples)")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    corpus = _SAMPLE_ANSWERS
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        corpus = [row['answer'] if isinstance(row, dict) else row for row in rows]
+    _benchmark(corpus, args.repeat)
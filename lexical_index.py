@@ -0,0 +1,181 @@
+"""In-process BM25 index over the collection's `context` payloads.
+
+It does two jobs in the RAG pipeline (see `search()` in rag_core.py):
+
+- fallback retriever: when the vector search fails (Qdrant unreachable, breaker
+  open, embedding unavailable) the pipeline still gets grounded passages
+  instead of the generic "no context" answer;
+- optional rank-fusion partner (LEXICAL_FUSION=true): dense and lexical hits are
+  merged with reciprocal rank fusion, which helps exact Sanskrit terms and names.
+
+The tokenizer folds IAST diacritics to the spellings people type ("Kṛṣṇa" and
+"Krishna" both become "krishna") and normalizes Devanagari (nukta, virama,
+chandrabindu), so queries match regardless of how they are transliterated.
+Postings are stored CSR-style in numpy arrays, so a lookup is a handful of
+vectorized adds and well under a millisecond for this corpus.
+"""
+import json
+import os
+import re
+import time
+import unicodedata
+
+import numpy as np
+
+LEXICAL_INDEX = os.getenv("LEXICAL_INDEX", "true").lower() == "true"
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH")  # optional precomputed .npz
+LEXICAL_FUSION = os.getenv("LEXICAL_FUSION", "false").lower() == "true"
+BM25_K1 = float(os.getenv("LEXICAL_BM25_K1", "1.2"))
+BM25_B = float(os.getenv("LEXICAL_BM25_B", "0.75"))
+RRF_K = 60
+
+# IAST letters folded to their common ASCII spellings before the remaining
+# diacritics are stripped
+_IAST_FOLDS = str.maketrans({
+    'ṛ': 'ri', 'ṝ': 'ri', 'ḷ': 'li', 'ś': 'sh', 'ṣ': 'sh', 'ṅ': 'n', 'ñ': 'n',
+    'Ṛ': 'ri', 'Ṝ': 'ri', 'Ḷ': 'li', 'Ś': 'sh', 'Ṣ': 'sh', 'Ṅ': 'n', 'Ñ': 'n',
+    'ँ': 'ं',  # chandrabindu -> anusvara
+})
+# Word characters plus Devanagari vowel signs, which \w does not cover (dandas excluded)
+_TOKEN = re.compile(r'[\wऀ-ॣ०-ॿ]+')
+_STOPWORDS = frozenset("""
+a an and are as at be but by do does for from has have he his how i in is it its me my
+no not of on or our she so that the their them then there these they this to was we
+were what when where which who why will with you your
+""".split())
+
+
+def tokenize(text):
+    """Lowercased, diacritic-folded tokens of text, without English stopwords."""
+    text = unicodedata.normalize('NFKD', text.translate(_IAST_FOLDS).lower())
+    # Drop combining marks (IAST accents, nukta, virama) but keep Devanagari vowel signs
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return [token for token in _TOKEN.findall(text) if token not in _STOPWORDS and token != '_']
+
+
+class LexicalIndex:
+    """BM25 over a fixed set of payloads, with postings in CSR arrays."""
+
+    def __init__(self, ids, payloads, terms, offsets, postings, frequencies, doc_lengths):
+        self.ids = list(ids)
+        self.payloads = list(payloads)
+        self.terms = {term: i for i, term in enumerate(terms)}
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.postings = np.asarray(postings, dtype=np.int32)
+        self.frequencies = np.asarray(frequencies, dtype=np.float32)
+        self.doc_lengths = np.asarray(doc_lengths, dtype=np.float32)
+        self.idf = np.zeros(len(terms), dtype=np.float32)
+        self._norms = np.zeros(len(self.ids), dtype=np.float32)
+        if len(self.ids):
+            doc_freq = np.diff(self.offsets).astype(np.float32)
+            self.idf = np.log1p((len(self.ids) - doc_freq + 0.5) / (doc_freq + 0.5))
+            average = self.doc_lengths.mean() or 1.0
+            self._norms = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths / average)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, ids, payloads):
+        started = time.perf_counter()
+        postings = {}
+        doc_lengths = []
+        for doc, payload in enumerate(payloads):
+            tokens = tokenize((payload or {}).get('context', ''))
+            doc_lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                postings.setdefault(token, []).append((doc, count))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[term]) for term in terms])
+        flat = [entry for term in terms for entry in postings[term]]
+        index = cls(ids, payloads, terms, offsets,
+                    [doc for doc, _ in flat], [count for _, count in flat], doc_lengths)
+        print(f"✅ Lexical index built with {len(index)} passages and {len(terms)} terms "
+              f"in {time.perf_counter() - started:.2f}s")
+        return index
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path, allow_pickle=False)
+        index = cls(json.loads(str(data['ids'])), json.loads(str(data['payloads'])), json.loads(str(data['terms'])),
+                    data['offsets'], data['postings'], data['frequencies'], data['doc_lengths'])
+        print(f"✅ Lexical index loaded from {path} ({len(index)} passages)")
+        return index
+
+    def save(self, path):
+        terms = sorted(self.terms, key=self.terms.get)
+        # Through a file object: given a path without .npz, np.savez would append it and load() would miss the file
+        with open(path, 'wb') as f:
+            np.savez(
+                f,
+                ids=np.array(json.dumps(self.ids)),
+                payloads=np.array(json.dumps(self.payloads, ensure_ascii=False)),
+                terms=np.array(json.dumps(terms, ensure_ascii=False)),
+                offsets=self.offsets,
+                postings=self.postings,
+                frequencies=self.frequencies,
+                doc_lengths=self.doc_lengths,
+            )
+
+    def top_k(self, query, k=5):
+        """Return [(row, score)] for the k best BM25 matches, best first."""
+        rows = [self.terms[token] for token in dict.fromkeys(tokenize(query)) if token in self.terms]
+        if not rows:
+            return []
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for row in rows:
+            start, end = self.offsets[row], self.offsets[row + 1]
+            docs = self.postings[start:end]
+            tf = self.frequencies[start:end]
+            # Each document appears once per term, so plain fancy-index adds are safe
+            scores[docs] += self.idf[row] * tf * (BM25_K1 + 1) / (tf + self._norms[docs])
+        matched = np.flatnonzero(scores)
+        k = min(k, len(matched))
+        best = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        best = best[np.argsort(-scores[best])]
+        return [(int(row), float(scores[row])) for row in best]
+
+    def search(self, query, limit=5):
+        """Same shape as QdrantClient.query_points(), but for a text query."""
+        from qdrant_client.http import models  # kept off the import path of the API process
+
+        points = [
+            models.ScoredPoint(id=self.ids[row], version=0, score=score, payload=self.payloads[row])
+            for row, score in self.top_k(query, limit)
+        ]
+        return models.QueryResponse(points=points)
+
+
+def reciprocal_rank_fusion(result_lists, limit=5, k=RRF_K):
+    """Merge ranked ScoredPoint lists into one QueryResponse ordered by sum(1 / (k + rank))."""
+    from qdrant_client.http import models
+
+    scores, points = {}, {}
+    for results in result_lists:
+        for rank, point in enumerate(results):
+            key = str(point.id)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+            points.setdefault(key, point)
+    best = sorted(scores, key=scores.get, reverse=True)[:limit]
+    return models.QueryResponse(points=[
+        models.ScoredPoint(id=points[key].id, version=0, score=scores[key], payload=points[key].payload)
+        for key in best
+    ])
+
+
+def load_lexical_index(read_payloads):
+    """Load LEXICAL_INDEX_PATH when present, otherwise build from read_payloads() -> (ids, payloads) and save it."""
+    if LEXICAL_INDEX_PATH and os.path.exists(LEXICAL_INDEX_PATH):
+        return LexicalIndex.load(LEXICAL_INDEX_PATH)
+    ids, payloads = read_payloads()
+    if not payloads:
+        return None
+    index = LexicalIndex.build(ids, payloads)
+    if LEXICAL_INDEX_PATH:
+        index.save(LEXICAL_INDEX_PATH)
+    return index
@@ -0,0 +1,138 @@
+"""In-process vector index for the read-only `bhagavad-gita` collection.
+
+The collection is loaded once (from Qdrant or a local .npz dump) into a
+contiguous, L2-normalized float32 matrix. Queries are answered with a single
+vectorized dot product, or, when binary quantization is enabled, with a
+Hamming-distance pass over packed sign bits followed by float rescoring of the
+oversampled candidates (the same scheme as the collection's BQ config).
+
+`LocalVectorIndex.query_points()` mirrors the QdrantClient method used by
+`search()`, so it can be passed anywhere a Qdrant client is expected. Of its
+search_params it honours `exact` and the quantization `oversampling`; there is
+no graph for `hnsw_ef` to tune, and candidates are always rescored.
+"""
+import json
+import os
+
+import numpy as np
+from qdrant_client.http import models
+
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH")  # optional .npz dump of the collection
+LOCAL_INDEX_BINARY = os.getenv("LOCAL_INDEX_BINARY", "true").lower() == "true"
+LOCAL_INDEX_OVERSAMPLING = float(os.getenv("LOCAL_INDEX_OVERSAMPLING", "4"))
+
+# Number of set bits for every byte value, used for packed Hamming distances
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint16)
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class LocalVectorIndex:
+    """Brute-force cosine index with optional binary quantization and rescoring."""
+
+    def __init__(self, ids, vectors, payloads, binary=LOCAL_INDEX_BINARY,
+                 oversampling=LOCAL_INDEX_OVERSAMPLING):
+        self.ids = list(ids)
+        self.payloads = list(payloads)
+        self.vectors = np.ascontiguousarray(_normalize_rows(np.asarray(vectors, dtype=np.float32)))
+        self.oversampling = oversampling
+        self.bits = np.packbits(self.vectors > 0, axis=1) if binary else None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_qdrant(cls, client, collection_name, batch_size=256, **kwargs):
+        """Scroll the whole collection (vectors and payloads) out of Qdrant."""
+        ids, vectors, payloads = [], [], []
+        offset = None
+        while True:
+            points, offset = client.scroll(
+                collection_name=collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            for point in points:
+                ids.append(point.id)
+                vectors.append(point.vector)
+                payloads.append(point.payload)
+            if offset is None:
+                break
+        print(f"✅ Loaded {len(ids)} points from Qdrant collection '{collection_name}' into the local index")
+        return cls(ids, np.array(vectors, dtype=np.float32).reshape(len(ids), -1), payloads, **kwargs)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        data = np.load(path, allow_pickle=False)
+        ids = json.loads(str(data['ids']))
+        payloads = json.loads(str(data['payloads']))
+        print(f"✅ Loaded {len(ids)} points into the local index from {path}")
+        return cls(ids, data['vectors'], payloads, **kwargs)
+
+    def save(self, path):
+        # Through a file object: given a path without .npz, np.savez would append it and load() would miss the file
+        with open(path, 'wb') as f:
+            np.savez(
+                f,
+                vectors=self.vectors,
+                ids=np.array(json.dumps(self.ids)),
+                payloads=np.array(json.dumps(self.payloads, ensure_ascii=False)),
+            )
+
+    def _candidates(self, query, count):
+        """Indices of the `count` nearest rows by Hamming distance on packed sign bits."""
+        query_bits = np.packbits(query > 0)
+        distances = _POPCOUNT[np.bitwise_xor(self.bits, query_bits)].sum(axis=1)
+        if count >= len(distances):
+            return np.arange(len(distances))
+        return np.argpartition(distances, count)[:count]
+
+    def top_k(self, query, k=5, oversampling=None, exact=False):
+        """Return [(row, score)] for the k most similar vectors, best first."""
+        if not len(self.ids):
+            return []
+        query = np.asarray(query, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        if self.bits is not None and not exact:
+            rows = self._candidates(query, max(k, int(k * (oversampling or self.oversampling))))
+            scores = self.vectors[rows] @ query
+        else:
+            rows = np.arange(len(self.ids))
+            scores = self.vectors @ query
+
+        k = min(k, len(rows))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(int(rows[i]), float(scores[i])) for i in best]
+
+    def query_points(self, collection_name=None, query=None, limit=10, search_params=None, **kwargs):
+        """Drop-in for QdrantClient.query_points() over the loaded collection."""
+        oversampling, exact = None, False
+        if search_params is not None:
+            exact = bool(search_params.exact)
+            if search_params.quantization is not None:
+                oversampling = search_params.quantization.oversampling
+        points = [
+            models.ScoredPoint(id=self.ids[row], version=0, score=score, payload=self.payloads[row])
+            for row, score in self.top_k(query, limit, oversampling=oversampling, exact=exact)
+        ]
+        return models.QueryResponse(points=points)
+
+
+def load_local_index(client, collection_name):
+    """Build the index from LOCAL_INDEX_PATH when present, otherwise from Qdrant."""
+    if LOCAL_INDEX_PATH and os.path.exists(LOCAL_INDEX_PATH):
+        return LocalVectorIndex.load(LOCAL_INDEX_PATH)
+    index = LocalVectorIndex.from_qdrant(client, collection_name)
+    if LOCAL_INDEX_PATH:
+        index.save(LOCAL_INDEX_PATH)
+    return index
@@ -0,0 +1,294 @@
+"""Latency histograms, counters and per-request traces, exposed in Prometheus text format.
+
+Every stage of a chat request (embedding, vector search, prompt formatting,
+LLM call, answer parsing, Hindi post-processing, history write) is timed with
+`stage()` into the `askkrishna_stage_duration_seconds` histogram. Retries and
+fallbacks (lexical retrieval, no or failed context, the canned generation
+failure) are counted, so degraded answers show up and not just errors.
+
+A request trace (`begin_request()`) carries the request id and collects the
+stage timings, retries and fallbacks of one request in a context variable, so
+threads and coroutines working for the request add to it. `finish_request()`
+records the request and logs it as one JSON line.
+
+Metrics live in the process. Under several gunicorn workers set METRICS_DIR
+(gunicorn.conf.py does): each process then writes its metrics there every
+METRICS_FLUSH_SECONDS, and `render()` sums all of them, so /metrics reports
+the whole server whichever worker answers the scrape.
+"""
+import atexit
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+REQUEST_LOG = os.getenv("REQUEST_LOG", "true").lower() == "true"
+# Probes and scrapes are counted but not logged
+QUIET_ROUTES = {"/metrics", "/ping", "/ready", "/health"}
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values -> count
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+    def samples(self, values):
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [count per bucket (non-cumulative, +Inf last)..., sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: list(counts) for labels, counts in self._values.items()}
+
+    @staticmethod
+    def merge(a, b):
+        return [x + y for x, y in zip(a, b)]
+
+    def samples(self, values):
+        for labels, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else _format_value(bound)
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', le)])} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(counts[-1])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+STAGE_SECONDS = Histogram("askkrishna_stage_duration_seconds", "Time spent in each stage of answering a question",
+                          ["stage"])
+REQUEST_SECONDS = Histogram("askkrishna_request_duration_seconds", "HTTP request latency", ["method", "route"])
+REQUESTS = Counter("askkrishna_requests_total", "HTTP requests", ["method", "route", "status"])
+RETRIES = Counter("askkrishna_retries_total", "Retried calls to a RAG dependency", ["dependency"])
+FALLBACKS = Counter("askkrishna_fallbacks_total", "Answers built on a fallback (degraded) path", ["kind"])
+METRICS = [STAGE_SECONDS, REQUEST_SECONDS, REQUESTS, RETRIES, FALLBACKS]
+
+
+class RequestTrace:
+    __slots__ = ('request_id', 'started', 'stages', 'retries', 'fallbacks')
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.stages = {}  # stage -> seconds (summed when a stage runs more than once)
+        self.retries = {}
+        self.fallbacks = []
+
+
+_current_trace = contextvars.ContextVar('request_trace', default=None)
+
+
+def begin_request(request_id=None):
+    """Start tracing a request in the current context; a valid incoming X-Request-ID is kept."""
+    if not request_id or not _REQUEST_ID.match(request_id):
+        request_id = uuid.uuid4().hex
+    trace = RequestTrace(request_id)
+    _current_trace.set(trace)
+    return trace
+
+
+def observe_stage(name, seconds):
+    STAGE_SECONDS.observe(seconds, name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.stages[name] = trace.stages.get(name, 0.0) + seconds
+    _ensure_flusher()
+
+
+@contextmanager
+def stage(name):
+    """Time the block as one stage of the current request."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+def count_retry(dependency):
+    RETRIES.inc(dependency)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.retries[dependency] = trace.retries.get(dependency, 0) + 1
+
+
+def count_fallback(kind):
+    FALLBACKS.inc(kind)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.fallbacks.append(kind)
+
+
+def request_fallbacks():
+    """Fallback kinds counted so far by the current request, or None outside a traced request."""
+    trace = _current_trace.get()
+    return None if trace is None else list(trace.fallbacks)
+
+
+def finish_request(trace, method, route, status):
+    """Record a finished request and log it as one JSON line."""
+    duration = time.perf_counter() - trace.started
+    REQUEST_SECONDS.observe(duration, method, route)
+    REQUESTS.inc(method, route, str(status))
+    _ensure_flusher()
+    if REQUEST_LOG and route not in QUIET_ROUTES:
+        print(json.dumps({
+            'event': 'request',
+            'request_id': trace.request_id,
+            'method': method,
+            'route': route,
+            'status': status,
+            'duration_ms': round(1000.0 * duration, 1),
+            'stages_ms': {name: round(1000.0 * seconds, 1) for name, seconds in trace.stages.items()},
+            'retries': trace.retries,
+            'fallbacks': trace.fallbacks,
+        }, ensure_ascii=False), flush=True)
+
+
+# --- Sharing between worker processes (METRICS_DIR) ---
+
+_flusher = None
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _snapshot_file(pid=None):
+    return os.path.join(METRICS_DIR, f"{pid or os.getpid()}.json")
+
+
+def write_snapshot():
+    """Write this process's metrics to METRICS_DIR."""
+    data = {metric.name: [[list(labels), value] for labels, value in metric.snapshot().items()] for metric in METRICS}
+    target = _snapshot_file()
+    with open(target + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(target + ".tmp", target)
+
+
+def _run_flusher():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        try:
+            write_snapshot()
+        except OSError as e:
+            print(f"⚠️ Could not write metrics to {METRICS_DIR}: {e}")
+
+
+def _ensure_flusher():
+    # Threads don't survive fork(), so each worker starts its own
+    global _flusher, _flusher_pid
+    if not METRICS_DIR or (_flusher_pid == os.getpid() and _flusher.is_alive()):
+        return
+    with _flusher_lock:
+        if _flusher_pid != os.getpid() or not _flusher.is_alive():
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            _flusher_pid = os.getpid()
+            _flusher = threading.Thread(target=_run_flusher, name="metrics-flusher", daemon=True)
+            _flusher.start()
+
+
+def _collect():
+    """{metric name: {label values: value}} for this process, or summed over METRICS_DIR."""
+    if not METRICS_DIR:
+        return {metric.name: metric.snapshot() for metric in METRICS}
+    write_snapshot()
+    by_name = {metric.name: metric for metric in METRICS}
+    merged = {name: {} for name in by_name}
+    for entry in os.listdir(METRICS_DIR):
+        if not entry.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, entry)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, series in data.items():
+            metric = by_name.get(name)
+            if metric is None:
+                continue
+            for labels, value in series:
+                labels = tuple(labels)
+                current = merged[name].get(labels)
+                merged[name][labels] = value if current is None else metric.merge(current, value)
+    return merged
+
+
+def render():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    values = _collect()
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples(values[metric.name]))
+    return "\n".join(lines) + "\n"
+
+
+@atexit.register
+def _final_snapshot():
+    # Counters of a worker that exits keep counting toward the totals
+    if METRICS_DIR and _flusher_pid == os.getpid():
+        try:
+            write_snapshot()
+        except OSError:
+            pass
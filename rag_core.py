@@ -0,0 +1,568 @@
+"""Retrieval-augmented generation core shared by the Streamlit UI (app.py) and the API.
+
+Plain library module: importing it pulls in neither Streamlit nor the
+LlamaIndex/FastEmbed/Qdrant client stacks. Those are imported on first use,
+in `initialize_models()` and the prompt template, so the backend can serve
+/ping, auth and history before (and without) loading them.
+"""
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from embedding_cache import EmbeddingCache
+from embed_batcher import EmbeddingBatcher, EMBED_BATCH_MAX_SIZE
+from resilience import breakers, call_with_resilience, next_retry_delay, remaining_time, RETRY_MAX_ATTEMPTS
+from verse_index import VerseIndex
+from context_packing import count_tokens, pack_context
+from language_postprocess import has_devanagari
+from lexical_index import LEXICAL_INDEX, LEXICAL_FUSION, load_lexical_index, reciprocal_rank_fusion
+from metrics import count_fallback, count_retry, observe_stage, request_fallbacks, stage
+from search_params import current_search_params
+
+# Shared by every search() in this process (and across processes when EMBED_CACHE_PATH is set)
+embedding_cache = EmbeddingCache()
+
+COLLECTION_NAME = "bhagavad-gita"
+RETRIEVAL_ENGINE = os.getenv("RETRIEVAL_ENGINE", "qdrant").lower()  # qdrant | local
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0"))  # ONNX intra-op threads; 0 = onnxruntime's default
+
+# Filled by initialize_models(); questions naming a verse are answered from it without vector search
+verse_index = VerseIndex()
+# BM25 over the same passages: fallback retriever when vector search fails, optional fusion partner
+lexical_index = None
+
+_models = None
+_models_lock = threading.Lock()
+_embed_model = None
+_embed_model_lock = threading.Lock()
+
+def initialize_models():
+    """Load (once per process) the embedding model, LLM and Qdrant client, and the text indexes."""
+    global _models
+    with _models_lock:
+        if _models is None:
+            _models = _load_models()
+    return _models
+
+def load_embed_model():
+    """The gte-large embedding model, loaded once.
+
+    Unlike the LLM and Qdrant clients (network connections, and gRPC isn't
+    fork-safe) it can be loaded before fork(): the gunicorn master does so
+    (see backend/gunicorn.conf.py) and every worker shares its weights.
+    """
+    global _embed_model
+    with _embed_model_lock:
+        if _embed_model is None:
+            from llama_index.embeddings.fastembed import FastEmbedEmbedding
+
+            # With one intra-op thread onnxruntime keeps no thread pool, which wouldn't survive a fork
+            options = {"threads": EMBED_THREADS} if EMBED_THREADS > 0 else {}
+            embed_model = FastEmbedEmbedding(model_name="thenlper/gte-large", **options)
+            if EMBED_BATCH_MAX_SIZE > 1:
+                # Coalesce concurrent query embeddings into batched ONNX calls
+                embed_model = EmbeddingBatcher(embed_model)
+            _embed_model = embed_model
+    return _embed_model
+
+def _load_models():
+    import qdrant_client
+    from llama_index.llms.groq import Groq
+
+    embed_model = load_embed_model()
+    # resilience.py retries within the request deadline; the SDK's own retries would run past it
+    llm = Groq(model="deepseek-r1-distill-llama-70b", max_retries=0)
+    client = qdrant_client.QdrantClient(
+       url=os.getenv("QDRANT_URL"),
+        api_key=os.getenv("QDRANT_API_KEY"),
+        prefer_grpc=True
+    )
+    if RETRIEVAL_ENGINE == "local":
+        # Serve retrieval from an in-process copy of the collection instead of Qdrant Cloud
+        from local_index import load_local_index
+        client = load_local_index(client, COLLECTION_NAME)
+    load_text_indexes(client)
+    return embed_model, llm, client
+
+def collection_payloads(client):
+    """(ids, payloads) of every point, from the in-process index or a Qdrant scroll."""
+    if hasattr(client, 'payloads'):
+        return client.ids, client.payloads
+    ids, payloads = [], []
+    offset = None
+    while True:
+        points, offset = client.scroll(collection_name=COLLECTION_NAME, limit=256, offset=offset,
+                                       with_payload=True, with_vectors=False)
+        for point in points:
+            ids.append(point.id)
+            payloads.append(point.payload)
+        if offset is None:
+            return ids, payloads
+
+def load_text_indexes(client):
+    """Build the verse and lexical indexes from the collection's payloads."""
+    global lexical_index
+    try:
+        if LEXICAL_INDEX:
+            # A precomputed lexical index carries its own payloads, so startup works without Qdrant
+            lexical_index = load_lexical_index(lambda: collection_payloads(client))
+        payloads = lexical_index.payloads if lexical_index else collection_payloads(client)[1]
+        verse_index.replace(VerseIndex.from_payloads(payloads))
+    except Exception as e:
+        print(f"Could not read collection payloads, verse and lexical lookup disabled: {e}")
+
+SYSTEM_PROMPT = """
+        You are an expert ancient assistant who is well versed in Bhagavad-gita.
+        You are Multilingual, you understand English, Hindi and Sanskrit.
+        
+        Always structure your response in this format:
+        <think>
+        [Your step-by-step thinking process here]
+        </think>
+        
+        [Your final answer here]
+        """
+
+USER_PROMPT = """
+        We have provided context information below.
+        {context_str}
+        ---------------------
+        Given this information, please answer the question: {query}
+        ---------------------
+        If the question is not from the provided context, say `I don't know. Not enough information received.`
+        """
+
+_chat_template = None
+
+def chat_template():
+    """The system + user prompt template (LlamaIndex is imported on first use)."""
+    global _chat_template
+    if _chat_template is None:
+        from llama_index.core import ChatPromptTemplate
+        from llama_index.core.llms import ChatMessage, MessageRole
+
+        _chat_template = ChatPromptTemplate(message_templates=[
+            ChatMessage(content=SYSTEM_PROMPT, role=MessageRole.SYSTEM),
+            ChatMessage(content=USER_PROMPT, role=MessageRole.USER),
+        ])
+    return _chat_template
+
+def embed_query(query, embed_model):
+    """Embed a query with retries. Returns None if the embedding can't be generated."""
+    model_name = getattr(embed_model, 'model_name', type(embed_model).__name__)
+    cached = embedding_cache.get(query, model_name)
+    if cached is not None:
+        return cached.tolist()
+
+    def embed(remaining):
+        if isinstance(embed_model, EmbeddingBatcher):
+            # Don't wait on the batch queue past the request deadline
+            return embed_model.get_query_embedding(query, timeout=remaining)
+        return embed_model.get_query_embedding(query)
+
+    try:
+        with stage('embedding'):
+            query_embedding = call_with_resilience(embed, 'embedding', "Embedding generation")
+    except Exception as e:
+        print(f"Failed to generate embedding: {e}")
+        return None
+    embedding_cache.put(query, model_name, query_embedding)
+    return query_embedding
+
+def lexical_search(query, k=5):
+    """BM25 passages for the query; empty when no lexical index is loaded."""
+    from qdrant_client.http import models
+
+    count_fallback('lexical_search')
+    if lexical_index is None:
+        return models.QueryResponse(points=[])
+    with stage('lexical_search'):
+        return lexical_index.search(query, limit=k)
+
+def fuse_with_lexical(query, dense_results, k=5):
+    """Merge vector hits with BM25 hits when LEXICAL_FUSION is on."""
+    if not LEXICAL_FUSION or lexical_index is None:
+        return dense_results
+    return reciprocal_rank_fusion([dense_results.points, lexical_index.search(query, limit=k).points], limit=k)
+
+def search(query, client, embed_model, k=5, query_embedding=None):
+    collection_name = COLLECTION_NAME
+    
+    # Reuse an embedding the caller already computed (e.g. for the answer cache)
+    if query_embedding is None:
+        query_embedding = embed_query(query, embed_model)
+    if query_embedding is None:
+        # No vector to search with; fall back to the lexical index
+        return lexical_search(query, k)
+    
+    # hnsw_ef, rescoring and oversampling of this request, or the deployment's (see search_params.py)
+    search_params = current_search_params()
+
+    def query_points(remaining):
+        return client.query_points(
+            collection_name=collection_name,
+            query=query_embedding,
+            limit=k,
+            search_params=search_params,
+            timeout=max(1, int(remaining)) if remaining is not None else None
+        )
+
+    # Query Qdrant with backoff, bounded by the request deadline and circuit breaker
+    try:
+        with stage('vector_search'):
+            results = call_with_resilience(query_points, 'vector_search', "Vector database query")
+    except Exception as e:
+        print(f"Failed to query vector database, using lexical fallback: {e}")
+        return lexical_search(query, k)
+    return fuse_with_lexical(query, results, k)
+
+NO_CONTEXT = "No specific context found in the Bhagavad Gita. Providing a general answer based on Krishna's teachings."
+RETRIEVAL_FAILED_CONTEXT = "Unable to retrieve specific context. Providing a general answer based on Krishna's teachings."
+GENERATION_FAILED_MESSAGE = "I apologize, but I'm having trouble generating a response right now. Please try again later."
+
+def context_from_results(relevant_documents, query=None):
+    """Join the retrieved payloads into one context string, or fall back to NO_CONTEXT.
+
+    With a query, passages are deduplicated, trimmed to the sentences relevant to
+    it and packed into CONTEXT_TOKEN_BUDGET tokens (see context_packing.py).
+    """
+    if relevant_documents and hasattr(relevant_documents, 'points') and len(relevant_documents.points) > 0:
+        context = [doc.payload['context'] for doc in relevant_documents.points]
+        joined = "\n".join(context)
+        if query is None:
+            return joined
+        with stage('context_packing'):
+            packed, stats = pack_context(query, context)
+        print(f"📦 Context tokens {count_tokens(joined)} -> {count_tokens(packed)} "
+              f"({stats['passages_packed']}/{stats['passages']} passages, "
+              f"{stats['duplicates_dropped']} duplicates, {stats['sentences_trimmed']} sentences trimmed)")
+        if packed:
+            return packed
+    # Handle case where no relevant documents are found
+    count_fallback('no_context')
+    return NO_CONTEXT
+
+def format_prompt(query, context, conversation=None):
+    """Fill the chat template with the retrieved context (the A of RAG).
+
+    For a follow-up, the conversation's summary and recent turns are added after
+    the context.
+    """
+    # Detect if query is in Hindi (memoized, shared with the request handlers)
+    has_hindi = has_devanagari(query)
+
+    history = conversation.history_text() if conversation is not None else ''
+    if history:
+        context = f"{context}\n---------------------\nEarlier in this conversation:\n{history}"
+
+    # Modify template based on language
+    with stage('prompt_format'):
+        formatted_template = chat_template().format(
+            context_str=context,
+            query=query
+        )
+    
+    # If query has Hindi characters, add instruction to respond in Hindi
+    if has_hindi:
+        formatted_template += "\n\nकृपया इस प्रश्न का उत्तर हिंदी में दें।"
+
+    return formatted_template
+
+def prompt_steps(query, conversation=None, query_embedding=None, question=None):
+    """Retrieve context for the query and format the full LLM prompt (the R and A of RAG), without I/O.
+
+    The retrieval decisions shared by build_prompt() and the async pipeline's
+    abuild_prompt(). A generator: it yields ('embed', text) and
+    ('search', question, query_embedding) requests, is sent each one's result
+    (or thrown its exception), and returns the formatted prompt; the callers
+    carry the requests out with the blocking and the async clients.
+    """
+    question = question or query
+    # Direct lookup: a question naming a verse gets that verse, no embedding or vector search
+    verse_context = verse_index.context_for(query)
+    if verse_context:
+        return format_prompt(query, verse_context, conversation)
+
+    if conversation is not None and query_embedding is None:
+        # Needed to compare with (and remember for) the next follow-up; search() would embed it anyway
+        query_embedding = yield ('embed', query)
+    context = conversation.reusable_context(query_embedding) if conversation is not None else None
+    if context:
+        print("♻️ Follow-up close to the previous question; reusing its context")
+        return format_prompt(query, context, conversation)
+
+    # R - Retriever
+    try:
+        relevant_documents = yield ('search', question, query_embedding)
+        context = context_from_results(relevant_documents, question)
+        if conversation is not None and context != NO_CONTEXT:
+            conversation.remember_retrieval(context, query_embedding)
+    except Exception as e:
+        print(f"Error in retrieval: {e}")
+        # Fallback context if retrieval fails
+        count_fallback('retrieval_failed')
+        context = RETRIEVAL_FAILED_CONTEXT
+
+    # A - Augment
+    return format_prompt(query, context, conversation)
+
+def build_prompt(query, embed_model, client, query_embedding=None, conversation=None, question=None):
+    """Retrieve context for the query and format the full LLM prompt (the R and A of RAG).
+
+    With a conversation, a follow-up close to the previous question reuses that
+    question's context instead of searching again. When `query` wraps the
+    user's question in instructions (e.g. the answer language), pass the bare
+    `question`: lexical search and context packing then score passages against
+    it rather than the instructions, and `query` only goes into the template.
+    """
+    handlers = {
+        'embed': lambda text: embed_query(text, embed_model),
+        'search': lambda text, embedding: search(text, client, embed_model, query_embedding=embedding),
+    }
+    steps = prompt_steps(query, conversation, query_embedding, question)
+    result, error = None, None
+    while True:
+        try:
+            kind, *args = steps.throw(error) if error is not None else steps.send(result)
+        except StopIteration as done:
+            return done.value
+        try:
+            result, error = handlers[kind](*args), None
+        except Exception as e:
+            result, error = None, e
+
+def used_fallback():
+    """Whether the current request's answer was built on a degraded path.
+
+    That is lexical-only retrieval, no or failed context, or the canned failure
+    message, as counted by count_fallback() in the request trace. Such answers
+    mustn't be cached for everyone; without a trace, assume one was used.
+    """
+    fallbacks = request_fallbacks()
+    return fallbacks is None or bool(fallbacks)
+
+def llm_timeout(remaining):
+    """Keyword arguments bounding one LLM request by the time left on the deadline (none without one).
+
+    For streaming the timeout applies to the wait for each chunk, so it bounds
+    the time to the first token and any stall rather than the whole answer.
+    """
+    return {'timeout': max(1.0, remaining)} if remaining is not None else {}
+
+def pipeline(query, embed_model, llm, client, query_embedding=None, conversation=None, question=None):
+    formatted_template = build_prompt(query, embed_model, client, query_embedding=query_embedding,
+                                      conversation=conversation, question=question)
+
+    # G - Generate with backoff, bounded by the request deadline and circuit breaker
+    try:
+        with stage('llm'):
+            return call_with_resilience(lambda remaining: llm.complete(formatted_template, **llm_timeout(remaining)),
+                                        'llm', "LLM generation")
+    except Exception as e:
+        print(f"LLM generation failed: {e}")
+        # Return a fallback response if all retries fail
+        count_fallback('generation_failed')
+        return GENERATION_FAILED_MESSAGE
+
+class StreamRetries:
+    """Retry policy of one streamed LLM answer, shared by stream_pipeline() and astream_pipeline().
+
+    Iterating it gives one attempt per retry (the seconds left on the request
+    deadline, or None without one) while the deadline and the LLM circuit
+    breaker allow. Only an attempt that hasn't sent a token yet can be retried.
+    """
+
+    def __init__(self):
+        self.breaker = breakers['llm']
+        self.began = time.perf_counter()
+        self.attempt = 0
+        self.started = False
+
+    def __iter__(self):
+        for self.attempt in range(RETRY_MAX_ATTEMPTS):
+            remaining = remaining_time()
+            if (remaining is not None and remaining <= 0) or not self.breaker.allow():
+                return
+            self.started = False
+            yield remaining
+
+    def token(self):
+        if not self.started:
+            observe_stage('llm_first_token', time.perf_counter() - self.began)
+        self.started = True
+
+    def succeeded(self):
+        self.breaker.record_success()
+        observe_stage('llm', time.perf_counter() - self.began)
+
+    def abandoned(self):
+        # Client went away mid-stream; the LLM itself was fine
+        self.breaker.record_success()
+
+    def failed(self, error):
+        """Seconds to wait before the next attempt, or None to give up; re-raises once tokens were sent."""
+        self.breaker.record_failure()
+        # Tokens already sent can't be taken back, so only retry before the first one
+        if self.started:
+            raise error
+        delay = next_retry_delay(self.attempt, RETRY_MAX_ATTEMPTS, "LLM streaming", error)
+        if delay is not None:
+            count_retry('llm')
+        return delay
+
+    def fallback(self):
+        count_fallback('generation_failed')
+        return "</think>" + GENERATION_FAILED_MESSAGE
+
+def stream_pipeline(query, embed_model, llm, client, query_embedding=None, conversation=None, question=None):
+    """Like pipeline(), but yields raw text deltas from the LLM's streaming API as they arrive."""
+    formatted_template = build_prompt(query, embed_model, client, query_embedding=query_embedding,
+                                      conversation=conversation, question=question)
+
+    retries = StreamRetries()
+    for remaining in retries:
+        try:
+            for chunk in llm.stream_complete(formatted_template, **llm_timeout(remaining)):
+                if chunk.delta:
+                    retries.token()
+                    yield chunk.delta
+            retries.succeeded()
+            return
+        except GeneratorExit:
+            retries.abandoned()
+            raise
+        except Exception as e:
+            delay = retries.failed(e)
+            if delay is None:
+                break
+            time.sleep(delay)
+    yield retries.fallback()
+
+
+def extract_thinking_and_answer(response_text):
+    """Extract thinking process and final answer from response"""
+    try:
+        # Handle both string and object responses
+        if not isinstance(response_text, str):
+            # If it's an object with a text attribute, use that
+            if hasattr(response_text, 'text'):
+                response_text = response_text.text
+            else:
+                # Otherwise convert to string
+                response_text = str(response_text)
+                
+        end = response_text.find("</think>")
+        if end == -1:
+            # No thinking section (e.g. a fallback message): it's all answer
+            thinking = ""
+            answer = response_text.strip()
+            if answer.startswith("<think>"):
+                answer = answer[7:]
+        else:
+            start = response_text.find("<think>")
+            thinking = response_text[start + 7 if 0 <= start < end else 0:end].strip()
+            answer = response_text[end + 8:].strip()
+        
+        # Clean up Hindi text by removing unwanted symbols
+        import re
+        answer = re.sub(r'[\[\]]', '', answer)
+        
+        # Improve formatting for both Hindi and English text
+        answer = re.sub(r'\n{3,}', '\n\n', answer).strip()
+        
+        return thinking, answer
+    except Exception as e:
+        print(f"Error extracting thinking and answer: {e}")
+        # Return original response as fallback
+        if hasattr(response_text, 'text'):
+            return "", response_text.text
+        return "", response_text
+
+class ThinkingAnswerSplitter:
+    """Streaming counterpart of extract_thinking_and_answer().
+
+    feed() takes raw LLM deltas and returns a list of ("thinking" | "answer", text)
+    events. Text before `</think>` is thinking; everything after is answer, with the
+    same cleanup as extract_thinking_and_answer (brackets dropped, runs of blank lines
+    collapsed, surrounding whitespace stripped). A possible partial marker at the end
+    of a chunk is held back until the next chunk decides it.
+    """
+
+    OPEN = "<think>"
+    CLOSE = "</think>"
+
+    def __init__(self):
+        self.in_answer = False
+        self.thinking = ""
+        self.answer = ""
+        self._buffer = ""
+        self._pending_ws = ""  # trailing answer whitespace, held back until more text follows
+
+    def _held_back(self, text, marker):
+        """Length of the longest suffix of text that is a prefix of marker."""
+        for size in range(min(len(marker) - 1, len(text)), 0, -1):
+            if marker.startswith(text[-size:]):
+                return size
+        return 0
+
+    def _emit_answer(self, text, events):
+        import re
+        text = self._pending_ws + text.replace("[", "").replace("]", "")
+        body = text.rstrip()
+        self._pending_ws = text[len(body):]
+        if not self.answer:
+            body = body.lstrip()
+        if not body:
+            return
+        # Trailing whitespace is always held back, so every newline run is whole here
+        body = re.sub(r'\n{3,}', '\n\n', body)
+        self.answer += body
+        events.append(("answer", body))
+
+    def feed(self, delta):
+        events = []
+        self._buffer += delta
+        if not self.in_answer:
+            end = self._buffer.find(self.CLOSE)
+            if end == -1:
+                keep = self._held_back(self._buffer, self.CLOSE)
+                ready, self._buffer = self._buffer[:len(self._buffer) - keep], self._buffer[len(self._buffer) - keep:]
+            else:
+                ready, self._buffer = self._buffer[:end], self._buffer[end + len(self.CLOSE):]
+            if not self.thinking:
+                ready = ready.lstrip()
+                if ready.startswith(self.OPEN):
+                    ready = ready[len(self.OPEN):]
+                elif self.OPEN.startswith(ready) and end == -1:
+                    # Could still be the start of "<think>"; wait for more text
+                    self._buffer = ready + self._buffer
+                    ready = ""
+            if ready:
+                self.thinking += ready
+                events.append(("thinking", ready))
+            if end == -1:
+                return events
+            self.in_answer = True
+        self._emit_answer(self._buffer, events)
+        self._buffer = ""
+        return events
+
+    def close(self):
+        """Flush held-back text once the stream has ended."""
+        events = []
+        if not self.in_answer:
+            # No </think> ever arrived: like extract_thinking_and_answer, treat it all as answer
+            text = self.thinking + self._buffer
+            self.thinking = ""
+            self._buffer = ""
+            self.in_answer = True
+            self._emit_answer(text, events)
+        elif self._buffer:
+            self._emit_answer(self._buffer, events)
+            self._buffer = ""
+        self.thinking = self.thinking.strip()
+        return events
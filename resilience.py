@@ -0,0 +1,216 @@
+"""Shared retry, deadline and circuit-breaker helpers for the RAG dependencies.
+
+- Retries use exponential backoff with full jitter instead of a fixed sleep.
+- A per-request deadline (set with `deadline_scope()`) caps the total time spent
+  across embedding, vector search and generation; no retry is started that
+  would overrun it.
+- One circuit breaker per dependency fails fast while that dependency is
+  unhealthy, so callers drop straight to their existing fallbacks.
+"""
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import count_retry
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.25"))  # seconds
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "4"))  # seconds
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "30"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RECOVERY_SECONDS = float(os.getenv("BREAKER_RECOVERY_SECONDS", "30"))
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is open."""
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the request deadline leaves no time for another attempt."""
+
+
+class Deadline:
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+_current_deadline = contextvars.ContextVar('request_deadline', default=None)
+
+
+@contextmanager
+def deadline_scope(seconds=REQUEST_DEADLINE_SECONDS):
+    """Bound everything called inside the block (threads and coroutines alike) by one deadline."""
+    token = _current_deadline.set(Deadline(seconds))
+    try:
+        yield _current_deadline.get()
+    finally:
+        _current_deadline.reset(token)
+
+
+def current_deadline():
+    return _current_deadline.get()
+
+
+def remaining_time(default=None):
+    """Seconds left on the current request's deadline, or `default` if none is set."""
+    deadline = _current_deadline.get()
+    return deadline.remaining() if deadline is not None else default
+
+
+class CircuitBreaker:
+    """Closed -> open after `failure_threshold` consecutive failures; after
+    `recovery_timeout` one trial call is let through (half-open) and its
+    outcome closes or re-opens the breaker."""
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, recovery_timeout=BREAKER_RECOVERY_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.total_failures = 0
+        self.total_rejections = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.total_rejections += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.total_failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"🔌 Circuit breaker '{self.name}' opened after {self.failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def snapshot(self):
+        with self._lock:
+            retry_in = None
+            if self.state == self.OPEN:
+                retry_in = max(0.0, self.recovery_timeout - (time.monotonic() - self.opened_at))
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'total_failures': self.total_failures,
+                'rejected_calls': self.total_rejections,
+                'retry_in_seconds': retry_in,
+            }
+
+
+breakers = {
+    'embedding': CircuitBreaker('embedding'),
+    'vector_search': CircuitBreaker('vector_search'),
+    'llm': CircuitBreaker('llm'),
+}
+
+
+def breaker_states():
+    return {name: breaker.snapshot() for name, breaker in breakers.items()}
+
+
+def backoff_delay(attempt, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+    """Full-jitter exponential backoff for the given 0-based attempt."""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def next_retry_delay(attempt, max_attempts, description, error):
+    """Log a failed attempt and return how long to wait, or None to give up."""
+    print(f"{description} error (attempt {attempt+1}/{max_attempts}): {error}")
+    if attempt >= max_attempts - 1:
+        return None
+    delay = backoff_delay(attempt)
+    remaining = remaining_time()
+    if remaining is not None and delay >= remaining:
+        return None
+    return delay
+
+
+def call_with_resilience(fn, dependency, description, max_attempts=RETRY_MAX_ATTEMPTS):
+    """Call fn() under the dependency's breaker, retrying with backoff within the deadline.
+
+    fn receives the seconds left on the request deadline (or None) so it can pass
+    a timeout to the client. Raises CircuitOpenError, DeadlineExceeded or the last
+    error when no attempt succeeds.
+    """
+    breaker = breakers[dependency]
+    error = None
+    for attempt in range(max_attempts):
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(f"deadline exceeded before {description}")
+        if not breaker.allow():
+            raise CircuitOpenError(f"{dependency} circuit is open")
+        try:
+            result = fn(remaining)
+            breaker.record_success()
+            return result
+        except Exception as e:
+            breaker.record_failure()
+            error = e
+            delay = next_retry_delay(attempt, max_attempts, description, e)
+            if delay is None:
+                break
+            count_retry(dependency)
+            time.sleep(delay)
+    raise error
+
+
+async def acall_with_resilience(fn, dependency, description, max_attempts=RETRY_MAX_ATTEMPTS):
+    """Async counterpart of call_with_resilience(); fn returns an awaitable."""
+    breaker = breakers[dependency]
+    error = None
+    for attempt in range(max_attempts):
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(f"deadline exceeded before {description}")
+        if not breaker.allow():
+            raise CircuitOpenError(f"{dependency} circuit is open")
+        try:
+            if remaining is not None:
+                result = await asyncio.wait_for(fn(remaining), timeout=remaining)
+            else:
+                result = await fn(remaining)
+            breaker.record_success()
+            return result
+        except Exception as e:
+            breaker.record_failure()
+            error = e
+            delay = next_retry_delay(attempt, max_attempts, description, e)
+            if delay is None:
+                break
+            count_retry(dependency)
+            await asyncio.sleep(delay)
+    raise error
@@ -0,0 +1,133 @@
+"""Qdrant search parameters for `search()`: HNSW beam width and quantization rescoring.
+
+The collection is stored with binary quantization (see ingest.py), so Qdrant
+answers a query from the 1-bit vectors first: the HNSW graph is walked keeping
+`hnsw_ef` candidates, then the best `limit * oversampling` of them are rescored
+against the original float vectors when `rescore` is on. Raising hnsw_ef or
+oversampling buys recall with latency; turning rescoring off does the reverse.
+
+Deployment defaults come from SEARCH_HNSW_EF, SEARCH_RESCORE,
+SEARCH_OVERSAMPLING and SEARCH_EXACT; unset, Qdrant's own defaults apply. A
+chat request can override hnsw_ef, rescore and oversampling for itself with a
+`search_params` object, capped by SEARCH_MAX_HNSW_EF and SEARCH_MAX_OVERSAMPLING
+(exact, brute-force search is a deployment setting only). The settings travel
+in a context variable, like the request deadline, so `search()` picks them up
+in threads and coroutines alike.
+
+Choose the values with search_sweep.py, which measures recall against exact
+search and latency for every combination.
+"""
+import contextvars
+import os
+from contextlib import contextmanager
+
+
+def _optional_bool(value):
+    value = value.strip().lower()
+    return None if not value else value == "true"
+
+
+SEARCH_HNSW_EF = int(os.getenv("SEARCH_HNSW_EF", "0"))  # 0 = the collection's hnsw_config.ef_construct
+SEARCH_RESCORE = _optional_bool(os.getenv("SEARCH_RESCORE", ""))  # unset = Qdrant's default (rescore)
+SEARCH_OVERSAMPLING = float(os.getenv("SEARCH_OVERSAMPLING", "0"))  # 0 = Qdrant's default (no oversampling)
+SEARCH_EXACT = os.getenv("SEARCH_EXACT", "false").lower() == "true"
+# Bounds on per-request overrides; a large beam or oversampling is a cheap way to make a query slow
+SEARCH_MAX_HNSW_EF = int(os.getenv("SEARCH_MAX_HNSW_EF", "512"))
+SEARCH_MAX_OVERSAMPLING = float(os.getenv("SEARCH_MAX_OVERSAMPLING", "8"))
+
+REQUEST_OVERRIDES = ('hnsw_ef', 'rescore', 'oversampling')
+
+
+class SearchSettings:
+    """One set of search parameters; None leaves Qdrant's default."""
+
+    __slots__ = ('hnsw_ef', 'rescore', 'oversampling', 'exact')
+
+    def __init__(self, hnsw_ef=None, rescore=None, oversampling=None, exact=False):
+        self.hnsw_ef = hnsw_ef
+        self.rescore = rescore
+        self.oversampling = oversampling
+        self.exact = exact
+
+    def replace(self, **changes):
+        values = self.as_dict()
+        values.update(changes)
+        return SearchSettings(**values)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other):
+        return isinstance(other, SearchSettings) and self.as_dict() == other.as_dict()
+
+    __hash__ = None
+
+    def to_qdrant(self):
+        """models.SearchParams for query_points(), or None when every value is Qdrant's default."""
+        if self.hnsw_ef is None and self.rescore is None and self.oversampling is None and not self.exact:
+            return None
+        from qdrant_client.http import models
+
+        quantization = None
+        if self.rescore is not None or self.oversampling is not None:
+            quantization = models.QuantizationSearchParams(rescore=self.rescore, oversampling=self.oversampling)
+        return models.SearchParams(hnsw_ef=self.hnsw_ef, exact=self.exact, quantization=quantization)
+
+
+DEFAULT_SEARCH = SearchSettings(
+    hnsw_ef=SEARCH_HNSW_EF or None,
+    rescore=SEARCH_RESCORE,
+    oversampling=SEARCH_OVERSAMPLING or None,
+    exact=SEARCH_EXACT,
+)
+
+
+def parse_search_params(value, base=DEFAULT_SEARCH):
+    """Apply a request's `search_params` object to the deployment defaults.
+
+    Raises ValueError, with a message fit for the client, for anything but a
+    JSON object of in-range REQUEST_OVERRIDES.
+    """
+    if value is None:
+        return base
+    if not isinstance(value, dict):
+        raise ValueError("search_params must be an object")
+    unknown = sorted(set(value) - set(REQUEST_OVERRIDES))
+    if unknown:
+        raise ValueError(f"Unsupported search_params: {', '.join(unknown)}")
+
+    changes = {}
+    if 'hnsw_ef' in value:
+        hnsw_ef = value['hnsw_ef']
+        if isinstance(hnsw_ef, bool) or not isinstance(hnsw_ef, int) or not 1 <= hnsw_ef <= SEARCH_MAX_HNSW_EF:
+            raise ValueError(f"hnsw_ef must be an integer from 1 to {SEARCH_MAX_HNSW_EF}")
+        changes['hnsw_ef'] = hnsw_ef
+    if 'rescore' in value:
+        if not isinstance(value['rescore'], bool):
+            raise ValueError("rescore must be true or false")
+        changes['rescore'] = value['rescore']
+    if 'oversampling' in value:
+        oversampling = value['oversampling']
+        if (isinstance(oversampling, bool) or not isinstance(oversampling, (int, float))
+                or not 1 <= oversampling <= SEARCH_MAX_OVERSAMPLING):
+            raise ValueError(f"oversampling must be a number from 1 to {SEARCH_MAX_OVERSAMPLING:g}")
+        changes['oversampling'] = float(oversampling)
+    return base.replace(**changes)
+
+
+_current_search = contextvars.ContextVar('search_settings', default=None)
+
+
+@contextmanager
+def search_scope(settings):
+    """Search with `settings` for everything called inside the block (threads and coroutines alike)."""
+    token = _current_search.set(settings)
+    try:
+        yield settings
+    finally:
+        _current_search.reset(token)
+
+
+def current_search_params():
+    """models.SearchParams for the current request (or the deployment defaults), or None."""
+    return (_current_search.get() or DEFAULT_SEARCH).to_qdrant()
@@ -0,0 +1,287 @@
+"""Recall-vs-latency sweep over the Qdrant search parameters (see search_params.py).
+
+Copies the `bhagavad-gita` collection, with its HNSW and binary quantization
+settings, into a local Qdrant, then runs a labelled query set through every
+combination of hnsw_ef, rescore and oversampling. Each combination is scored
+by recall@k against exact search (a full scan over the original float
+vectors) and by its query latency, and the Pareto frontier, the combinations
+no other one beats on both, is printed with the environment settings that
+select them.
+
+Start a local Qdrant first; qdrant-client's own `:memory:` mode always searches
+exactly and ignores these parameters, so it is only good for a dry run:
+
+    docker run -p 6333:6333 -p 6334:6334 qdrant/qdrant
+    python search_sweep.py --queries queries.jsonl --hnsw-ef 16,32,64,128,256 --oversampling 1,2,4
+
+The query set is a JSON-lines file with a "query" per line (other fields are
+ignored) or plain text, one question per line; it is embedded with the same
+model as the collection. Without one, --sample stored vectors are used as
+queries; each one's own point is left out of its truth and results, since it
+would otherwise be a free hit at rank 1 and inflate recall. The collection comes from $QDRANT_URL, or from a LOCAL_INDEX_PATH
+dump with --dump. A collection smaller than its indexing_threshold has no
+HNSW graph and is searched by a scan of the quantized vectors, where hnsw_ef
+changes nothing; the sweep reports whether the copy was indexed.
+"""
+import argparse
+import itertools
+import json
+import math
+import random
+import time
+
+from dotenv import load_dotenv
+
+from ingest import COLLECTION_NAME, EMBED_MODEL_NAME, get_client
+from local_index import LocalVectorIndex
+from search_params import DEFAULT_SEARCH, SearchSettings
+
+load_dotenv()
+
+SWEEP_COLLECTION = "bhagavad-gita-sweep"
+DEFAULT_INDEXING_THRESHOLD = 20000  # KB, as set by ingest.finish_collection()
+
+
+def load_source(args):
+    """(LocalVectorIndex of the collection, its CollectionConfig or None for a dump)."""
+    if args.dump:
+        return LocalVectorIndex.load(args.dump, binary=False), None
+    client = get_client(url=args.qdrant_url)
+    config = client.get_collection(args.collection).config
+    return LocalVectorIndex.from_qdrant(client, args.collection, binary=False), config
+
+
+def copy_collection(target, name, index, source_config, indexing_threshold, batch_size=256):
+    """Recreate the collection in the target Qdrant and wait until it is optimized."""
+    from qdrant_client.http import models
+
+    if target.collection_exists(collection_name=name):
+        target.delete_collection(collection_name=name)
+    if source_config is not None:
+        hnsw_config = models.HnswConfigDiff(**source_config.hnsw_config.model_dump())
+        quantization_config = source_config.quantization_config
+        if indexing_threshold is None:
+            indexing_threshold = source_config.optimizer_config.indexing_threshold
+    else:
+        hnsw_config = None
+        quantization_config = models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+    target.create_collection(
+        collection_name=name,
+        vectors_config=models.VectorParams(size=index.vectors.shape[1], distance=models.Distance.COSINE, on_disk=True),
+        hnsw_config=hnsw_config,
+        quantization_config=quantization_config,
+        optimizers_config=models.OptimizersConfigDiff(indexing_threshold=0),
+    )
+    for start in range(0, len(index), batch_size):
+        target.upsert(
+            collection_name=name,
+            points=[
+                models.PointStruct(id=index.ids[row], vector=index.vectors[row].tolist())
+                for row in range(start, min(start + batch_size, len(index)))
+            ],
+        )
+    target.update_collection(
+        collection_name=name,
+        optimizer_config=models.OptimizersConfigDiff(
+            indexing_threshold=DEFAULT_INDEXING_THRESHOLD if indexing_threshold is None else indexing_threshold
+        ),
+    )
+
+    deadline = time.monotonic() + 600
+    info = target.get_collection(name)
+    while info.status != models.CollectionStatus.GREEN and time.monotonic() < deadline:
+        time.sleep(1)
+        info = target.get_collection(name)
+    indexed = info.indexed_vectors_count or 0
+    print(f"✅ Copied {len(index)} points into '{name}'; HNSW index covers {indexed} vectors")
+    if not indexed:
+        print("⚠️ No HNSW graph (collection below its indexing_threshold, or local mode): hnsw_ef has no effect")
+
+
+def load_queries(path, embed_model_name):
+    """Embed the questions of a JSON-lines or plain-text query file."""
+    from llama_index.embeddings.fastembed import FastEmbedEmbedding
+
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            questions.append(json.loads(line)["query"] if line.startswith("{") else line)
+    embed_model = FastEmbedEmbedding(model_name=embed_model_name)
+    print(f"⏳ Embedding {len(questions)} queries")
+    return [embed_model.get_query_embedding(question) for question in questions]
+
+
+def sample_queries(index, count, seed):
+    """(stored vectors of `count` random points, their ids), for sweeps without a query file."""
+    rows = random.Random(seed).sample(range(len(index)), min(count, len(index)))
+    return [index.vectors[row].tolist() for row in rows], [index.ids[row] for row in rows]
+
+
+def neighbour_ids(client, name, query, k, params, source_id=None):
+    """Ids of the k nearest points of `query`, leaving out the point it was sampled from."""
+    limit = k if source_id is None else k + 1
+    points = client.query_points(collection_name=name, query=query, limit=limit, search_params=params).points
+    return [point.id for point in points if point.id != source_id][:k]
+
+
+def exact_neighbours(client, name, queries, k, sources):
+    """Ids of the true k nearest points of each query, by a full scan of the float vectors."""
+    from qdrant_client.http import models
+
+    params = models.SearchParams(exact=True, quantization=models.QuantizationSearchParams(ignore=True))
+    return [set(neighbour_ids(client, name, query, k, params, source_id))
+            for query, source_id in zip(queries, sources)]
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(q / 100.0 * len(sorted_values)) - 1)]
+
+
+def measure(client, name, queries, sources, truth, settings, k, repeat):
+    """Recall@k and per-query latency (ms) of one parameter combination."""
+    params = settings.to_qdrant()
+
+    for query, source_id in zip(queries, sources):  # warm-up pass
+        neighbour_ids(client, name, query, k, params, source_id)
+    latencies, hits = [], 0
+    for attempt in range(repeat):
+        for query, source_id, expected in zip(queries, sources, truth):
+            started = time.perf_counter()
+            found = neighbour_ids(client, name, query, k, params, source_id)
+            latencies.append(1000.0 * (time.perf_counter() - started))
+            if attempt == 0:
+                hits += len(expected & set(found))
+    latencies.sort()
+    return {
+        'recall': hits / float(sum(len(expected) for expected in truth) or 1),
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'mean_ms': sum(latencies) / len(latencies),
+    }
+
+
+def pareto_frontier(results, latency_key):
+    """Results no other result beats on recall and latency together, fastest first."""
+    frontier = []
+    for result in results:
+        dominated = any(
+            other['recall'] >= result['recall'] and other[latency_key] <= result[latency_key]
+            and (other['recall'] > result['recall'] or other[latency_key] < result[latency_key])
+            for other in results
+        )
+        if not dominated:
+            frontier.append(result)
+    return sorted(frontier, key=lambda result: result[latency_key])
+
+
+def environment(settings):
+    """The search_params.py settings that make a combination the deployment default."""
+    if settings['exact']:
+        return "SEARCH_EXACT=true"
+    return " ".join([
+        f"SEARCH_HNSW_EF={settings['hnsw_ef'] or 0}",
+        f"SEARCH_RESCORE={'' if settings['rescore'] is None else str(settings['rescore']).lower()}",
+        f"SEARCH_OVERSAMPLING={settings['oversampling'] or 0:g}",
+    ])
+
+
+def format_setting(value):
+    return "default" if value is None else str(value).lower() if isinstance(value, bool) else f"{value:g}"
+
+
+def print_report(results, frontier, k, latency_key):
+    print(f"\n{'':2}{'label':<12}{'hnsw_ef':>8}{'rescore':>9}{'overs.':>8}{f'recall@{k}':>11}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'mean ms':>9}")
+    on_frontier = {id(result) for result in frontier}
+    for result in results:
+        settings = result['settings']
+        print(f"{'*' if id(result) in on_frontier else '':2}{result['label']:<12}"
+              f"{format_setting(settings['hnsw_ef']):>8}{format_setting(settings['rescore']):>9}"
+              f"{format_setting(settings['oversampling']):>8}{result['recall']:>11.3f}"
+              f"{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}{result['mean_ms']:>9.2f}")
+    print(f"\nPareto frontier (recall@{k} vs {latency_key.replace('_ms', '')} latency), fastest first:")
+    for result in frontier:
+        print(f"  recall {result['recall']:.3f}  {result[latency_key]:7.2f} ms  {environment(result['settings'])}")
+
+
+def parse_list(value, cast):
+    return [cast(item) for item in value.split(",") if item.strip()]
+
+
+def parse_bool(value):
+    return value.strip().lower() == "true"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep Qdrant search parameters for recall against latency.")
+    parser.add_argument("--queries", help="JSON-lines ({\"query\": ...}) or plain-text file of questions")
+    parser.add_argument("--sample", type=int, default=200, help="Stored vectors used as queries without --queries")
+    parser.add_argument("--model", default=EMBED_MODEL_NAME, help="Embedding model for --queries")
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    parser.add_argument("--qdrant-url", default=None, help="Collection to copy; defaults to $QDRANT_URL")
+    parser.add_argument("--dump", help="Copy the collection from a LOCAL_INDEX_PATH .npz dump instead")
+    parser.add_argument("--target-url", default="http://localhost:6333", help="Local Qdrant to sweep against")
+    parser.add_argument("--location", default=None, help="qdrant-client local mode, e.g. :memory: (dry run only)")
+    parser.add_argument("--grpc", action="store_true", help="Query the local Qdrant over gRPC, as the app does")
+    parser.add_argument("--indexing-threshold", type=int, default=None,
+                        help="KB; defaults to the source collection's (0 never builds the HNSW graph)")
+    parser.add_argument("--k", type=int, default=5, help="Results per query, as in search()")
+    parser.add_argument("--hnsw-ef", default="16,32,64,128,256")
+    parser.add_argument("--rescore", default="true,false")
+    parser.add_argument("--oversampling", default="1,2,4")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed passes over the query set per combination")
+    parser.add_argument("--latency", choices=("p50", "p95", "mean"), default="p50",
+                        help="Latency the frontier is drawn against")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    import qdrant_client
+
+    index, source_config = load_source(args)
+    if args.location:
+        target = qdrant_client.QdrantClient(location=args.location)
+    else:
+        target = qdrant_client.QdrantClient(url=args.target_url, prefer_grpc=args.grpc)
+    copy_collection(target, SWEEP_COLLECTION, index, source_config, args.indexing_threshold)
+
+    if args.queries:
+        queries = load_queries(args.queries, args.model)
+        sources = [None] * len(queries)
+    else:
+        queries, sources = sample_queries(index, args.sample, args.seed)
+    truth = exact_neighbours(target, SWEEP_COLLECTION, queries, args.k, sources)
+
+    combinations = [('qdrant', SearchSettings())]
+    if DEFAULT_SEARCH.to_qdrant() is not None:
+        combinations.append(('deployment', DEFAULT_SEARCH))
+    combinations += [
+        ('', SearchSettings(hnsw_ef=hnsw_ef, rescore=rescore, oversampling=oversampling))
+        for hnsw_ef, rescore, oversampling in itertools.product(
+            parse_list(args.hnsw_ef, int), parse_list(args.rescore, parse_bool),
+            parse_list(args.oversampling, float))
+    ]
+    results = []
+    for number, (label, settings) in enumerate(combinations, 1):
+        print(f"⏳ [{number}/{len(combinations)}] {label or 'grid'} {settings.as_dict()}")
+        result = measure(target, SWEEP_COLLECTION, queries, sources, truth, settings, args.k, args.repeat)
+        results.append({'label': label, 'settings': settings.as_dict(), **result})
+
+    latency_key = f"{args.latency}_ms"
+    frontier = pareto_frontier(results, latency_key)
+    print_report(results, frontier, args.k, latency_key)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({'k': args.k, 'queries': len(queries), 'points': len(index), 'results': results,
+                       'frontier': [results.index(result) for result in frontier]}, f, indent=2)
+        print(f"\n📝 Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""Chapter/verse index over the Bhagavad-gītā text with a direct-lookup fast path.
+
+Ingestion runs `VerseTagger` over the pages in reading order and stores each
+page's `chapter`, the `verses` whose "TEXT n" headings appear on it, and its
+`page` number in the Qdrant payload. At startup `VerseIndex` rebuilds the verse
+blocks (verse, synonyms, translation, purport) from those pages, so questions
+that name a verse ("BG 2.47", "chapter 3 verse 19", or a quoted transliterated
+line) get the exact verse as context without embedding or vector search.
+"""
+import os
+import re
+import unicodedata
+
+VERSE_CONTEXT_MAX_CHARS = int(os.getenv("VERSE_CONTEXT_MAX_CHARS", "8000"))
+MAX_VERSES_PER_QUERY = 3
+
+_NUMBER_WORDS = {
+    'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7, 'eight': 8, 'nine': 9,
+    'ten': 10, 'eleven': 11, 'twelve': 12, 'thirteen': 13, 'fourteen': 14, 'fifteen': 15,
+    'sixteen': 16, 'seventeen': 17, 'eighteen': 18,
+}
+_ORDINALS = {
+    'first': 1, 'second': 2, 'third': 3, 'fourth': 4, 'fifth': 5, 'sixth': 6, 'seventh': 7, 'eighth': 8,
+    'ninth': 9, 'tenth': 10, 'eleventh': 11, 'twelfth': 12, 'thirteenth': 13, 'fourteenth': 14,
+    'fifteenth': 15, 'sixteenth': 16, 'seventeenth': 17, 'eighteenth': 18,
+}
+
+# Headings in the source text (words are tab separated in the PDF extraction)
+_CHAPTER_HEADING = re.compile(r'^[ \t]*CHAPTER[ \t]+(\d{1,2}|[A-Z]+)[ \t]*$', re.MULTILINE | re.IGNORECASE)
+_CHAPTER_END = re.compile(r'Purports?\s+to\s+the\s+(\w+)\s+Chapter', re.IGNORECASE)
+_TEXT_HEADING = re.compile(r'^[ \t]*TEXTS?[ \t]+(\d{1,2})(?:[ \t]*[-–][ \t]*(\d{1,2}))?[ \t]*$', re.MULTILINE)
+_SECTION_HEADING = re.compile(r'^[ \t]*(SYNONYMS|TRANSLATION|PURPORT)[ \t]*$', re.MULTILINE)
+
+# Verse references in user questions
+_DEVANAGARI_DIGITS = str.maketrans('०१२३४५६७८९', '0123456789')
+_REFERENCE_PATTERNS = [
+    # BG 2.47, Bg. 2:47, Gita 2.47, Bhagavad-gita 2.47
+    re.compile(r'\b(?:b\.?\s?g|bhagavad[\s-]*g[iī]t[aā]|g[iī]t[aā])\.?\s*(\d{1,2})\s*[.:]\s*(\d{1,2})\b', re.IGNORECASE),
+    # Chapter 3 verse 19, chapter 3, text 19
+    re.compile(r'\bchapter\s*(\d{1,2})\s*[,\-]?\s*(?:verse|text|shloka|sloka|śloka)\s*(\d{1,2})\b', re.IGNORECASE),
+    # अध्याय 2 श्लोक 47
+    re.compile(r'अध्याय\s*(\d{1,2})\D{0,5}?श्लोक\s*(\d{1,2})'),
+]
+_REVERSED_REFERENCE = re.compile(
+    r'\b(?:verse|text|shloka|sloka|śloka)\s*(\d{1,2})\s*(?:of|in|from)\s*(?:the\s*)?chapter\s*(\d{1,2})\b',
+    re.IGNORECASE)
+
+
+def _chapter_number(token):
+    token = token.lower()
+    if token.isdigit():
+        return int(token)
+    return _NUMBER_WORDS.get(token)
+
+
+def verse_key(chapter, verse):
+    return f"{chapter}.{verse}"
+
+
+def fold_text(text):
+    """Lowercase, strip diacritics and collapse whitespace (for matching quoted verse lines)."""
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return re.sub(r'[^\w]+', ' ', text.lower()).strip()
+
+
+class VerseTagger:
+    """Tracks the current chapter across pages fed in reading order."""
+
+    def __init__(self):
+        self.chapter = None
+
+    def tag(self, text):
+        """Return {'chapter', 'verses', 'headings'} for a page and advance the chapter state.
+
+        `headings` lists (start, end, chapter, first_verse, last_verse) for every
+        "TEXT n" heading on the page; chapter is None before the first chapter.
+        """
+        events = []
+        for match in _CHAPTER_HEADING.finditer(text):
+            number = _chapter_number(match.group(1))
+            if number:
+                events.append((match.start(), number))
+        for match in _CHAPTER_END.finditer(text):
+            number = _ORDINALS.get(match.group(1).lower())
+            if number:
+                events.append((match.end(), number + 1 if number < 18 else None))
+        events.sort()
+
+        chapter_at_start = self.chapter
+        verses, headings = [], []
+        for match in _TEXT_HEADING.finditer(text):
+            chapter = self.chapter
+            for position, number in events:
+                if position <= match.start():
+                    chapter = number
+            first = int(match.group(1))
+            last = int(match.group(2) or first)
+            headings.append((match.start(), match.end(), chapter, first, last))
+            if chapter:
+                verses.extend(verse_key(chapter, verse) for verse in range(first, last + 1))
+        if events:
+            self.chapter = events[-1][1]
+        return {'chapter': chapter_at_start or self.chapter, 'verses': verses, 'headings': headings}
+
+
+def _split_sections(block):
+    """Split one verse block into its sanskrit, synonyms, translation and purport parts."""
+    parts = {'verse': '', 'synonyms': '', 'translation': '', 'purport': ''}
+    headings = list(_SECTION_HEADING.finditer(block))
+    parts['verse'] = block[:headings[0].start()].strip() if headings else block.strip()
+    for i, heading in enumerate(headings):
+        end = headings[i + 1].start() if i + 1 < len(headings) else len(block)
+        parts[heading.group(1).lower()] = block[heading.end():end].strip()
+    return parts
+
+
+class VerseIndex:
+    """In-memory map of "chapter.verse" -> verse record."""
+
+    def __init__(self, records=None):
+        self.records = records or {}
+        self._lines = {}  # first words of each transliterated line -> key
+        for key, record in self.records.items():
+            for line in record['verse'].splitlines():
+                words = fold_text(line).split()
+                if len(words) >= 4:
+                    self._lines.setdefault(' '.join(words[:4]), key)
+
+    def __len__(self):
+        return len(self.records)
+
+    def replace(self, other):
+        """Take over another index's contents in place, so modules holding this instance see them."""
+        self.records = other.records
+        self._lines = other._lines
+        return self
+
+    @classmethod
+    def build(cls, pages):
+        """Build from page texts in reading order."""
+        tagger = VerseTagger()
+        headings = []
+        position = 0
+        for text in pages:
+            for start, end, chapter, first, last in tagger.tag(text)['headings']:
+                headings.append((position + start, position + end, chapter, first, last))
+            position += len(text) + 1
+        full_text = '\n'.join(pages)
+
+        records = {}
+        for i, (start, end, chapter, first, last) in enumerate(headings):
+            if not chapter:
+                continue
+            # A verse runs until the next TEXT heading, possibly across pages
+            block_end = headings[i + 1][0] if i + 1 < len(headings) else len(full_text)
+            block = full_text[end:block_end]
+            # A chapter's last purport is followed by the next chapter's front matter
+            chapter_end = _CHAPTER_END.search(block)
+            if chapter_end:
+                block = block[:chapter_end.end()]
+            record = {'chapter': chapter, 'verses': list(range(first, last + 1)), **_split_sections(block)}
+            for verse in record['verses']:
+                records.setdefault(verse_key(chapter, verse), record)
+        return cls(records)
+
+    @classmethod
+    def from_payloads(cls, payloads):
+        """Build from ingested point payloads (needs the `page` field written by ingest.py)."""
+        pages = [p for p in payloads if p and 'page' in p and 'context' in p]
+        if not pages:
+            print("⚠️ Collection payloads have no page numbers; run ingest.py --migrate-payload to enable verse lookup")
+            return cls()
+        pages.sort(key=lambda p: (p.get('file_name', ''), p['page']))
+        index = cls.build([p['context'] for p in pages])
+        print(f"✅ Verse index built with {len(index)} verses")
+        return index
+
+    def find_references(self, query):
+        """Verse keys named in the query, in order of appearance, limited to known verses."""
+        if not self.records:
+            return []
+        text = query.translate(_DEVANAGARI_DIGITS)
+        found = []
+        for pattern in _REFERENCE_PATTERNS:
+            for match in pattern.finditer(text):
+                found.append((match.start(), verse_key(int(match.group(1)), int(match.group(2)))))
+        for match in _REVERSED_REFERENCE.finditer(text):
+            found.append((match.start(), verse_key(int(match.group(2)), int(match.group(1)))))
+
+        if not found:
+            # A quoted transliterated line, e.g. "Jayas tu pāṇḍu-putrāṇāṁ yeṣāṁ pakṣe janārdanaḥ"
+            words = fold_text(text).split()
+            for i in range(len(words) - 3):
+                key = self._lines.get(' '.join(words[i:i + 4]))
+                if key:
+                    found.append((i, key))
+
+        keys = []
+        for _, key in sorted(found):
+            if key in self.records and key not in keys:
+                keys.append(key)
+        return keys[:MAX_VERSES_PER_QUERY]
+
+    def format_context(self, key):
+        record = self.records[key]
+        chapter = record['chapter']
+        verses = record['verses']
+        label = f"{chapter}.{verses[0]}" if len(verses) == 1 else f"{chapter}.{verses[0]}-{verses[-1]}"
+        parts = [f"Bhagavad-gītā {label}", record['verse']]
+        if record['translation']:
+            parts += ["TRANSLATION", record['translation']]
+        if record['purport']:
+            parts += ["PURPORT", record['purport']]
+        return '\n'.join(parts)[:VERSE_CONTEXT_MAX_CHARS]
+
+    def context_for(self, query):
+        """Exact verse context for a query that names verses, or None."""
+        keys = self.find_references(query)
+        if not keys:
+            return None
+        blocks = []
+        for key in keys:
+            block = self.format_context(key)
+            if block not in blocks:
+                blocks.append(block)
+        print(f"📖 Verse lookup for {', '.join(keys)}")
+        return '\n\n'.join(blocks)